@@ -3,7 +3,18 @@
 from . import buttons, exceptions, filters, fsm, utils
 from .bot import *
 from .cache import *
+from .dedupe import *
+from .journal import *
+from .lag import *
+from .loaders import *
+from .markers import *
+from .memory import *
+from .metrics import *
+from .profiling import *
 from .router import *
+from .tracing import *
+from .transport import *
 from .types import *
+from .watchdog import *
 
 __all__ = ["buttons", "exceptions", "filters", "fsm", "utils"]
@@ -0,0 +1,14 @@
+"""
+Benchmarks of update handling. Run with `python -m aiomax.bench`
+"""
+
+from .generator import UpdateGenerator
+from .runner import bench_dispatch, bench_parsing, build_bot, environment
+
+__all__ = [
+    "UpdateGenerator",
+    "bench_dispatch",
+    "bench_parsing",
+    "build_bot",
+    "environment",
+]
@@ -0,0 +1,77 @@
+import argparse
+import asyncio
+import json
+import logging
+
+from .generator import UpdateGenerator
+from .runner import bench_dispatch, bench_parsing, build_bot, environment
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m aiomax.bench",
+        description="Benchmarks update handling and prints results as JSON",
+    )
+    parser.add_argument("--updates", type=int, default=10000)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--handlers", type=int, default=20)
+    parser.add_argument("--commands", type=int, default=10)
+    parser.add_argument("--callbacks", type=int, default=10)
+    parser.add_argument(
+        "--routers", type=int, default=2, help="child routers per router"
+    )
+    parser.add_argument(
+        "--depth", type=int, default=1, help="depth of the router tree"
+    )
+    parser.add_argument(
+        "--no-allocations",
+        action="store_true",
+        help="do not measure allocations with tracemalloc",
+    )
+    parser.add_argument("--output", help="also write results to this file")
+    args = parser.parse_args()
+
+    # handlers are benchmarked, not logging
+    logging.disable(logging.CRITICAL)
+
+    generator = UpdateGenerator(
+        seed=args.seed,
+        users=args.users,
+        commands=args.commands,
+        payloads=args.callbacks,
+    )
+    updates = generator.generate(args.updates)
+    bot = build_bot(
+        handlers=args.handlers,
+        commands=args.commands,
+        callbacks=args.callbacks,
+        routers=args.routers,
+        depth=args.depth,
+    )
+
+    results = {
+        "environment": environment(),
+        "config": vars(args),
+        "dispatch": asyncio.run(
+            bench_dispatch(
+                bot,
+                updates,
+                warmup=args.warmup,
+                allocations=not args.no_allocations,
+            )
+        ),
+        "parsing": bench_parsing(updates),
+    }
+
+    text = json.dumps(results, indent=2)
+    print(text)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import random
+
+WORDS = [
+    "hello", "привет", "how", "are", "you", "order", "status", "please",
+    "thanks", "menu", "help", "price", "delivery", "today", "tomorrow",
+    "ok", "yes", "no", "сколько", "стоит", "где", "мой", "заказ",
+]  # fmt: skip
+
+DEFAULT_MIX = {
+    "text": 0.4,
+    "command": 0.15,
+    "callback": 0.2,
+    "attachments": 0.15,
+    "edit": 0.1,
+}
+
+
+class UpdateGenerator:
+    def __init__(
+        self,
+        seed: int = 0,
+        users: int = 1000,
+        chats: int = 100,
+        commands: int = 10,
+        payloads: int = 20,
+        mix: "dict[str, float] | None" = None,
+    ):
+        """
+        Generates synthetic raw updates shaped like the ones
+        the Max API sends.
+
+        :param seed: Random seed, so that runs are comparable
+        :param users: Number of distinct senders
+        :param chats: Number of distinct chats
+        :param commands: Number of distinct commands, named `cmd0`, `cmd1`...
+        :param payloads: Number of distinct callback payloads,
+            named `btn0`, `btn1`...
+        :param mix: Share of each update kind: "text", "command",
+            "callback", "attachments" and "edit"
+        """
+        self.random = random.Random(seed)
+        self.users: int = users
+        self.chats: int = chats
+        self.commands: int = commands
+        self.payloads: int = payloads
+        self.mix: dict[str, float] = mix or DEFAULT_MIX
+
+        self.timestamp: int = 1_700_000_000_000
+        self.seq: int = 0
+        self.sent: list[dict] = []  # messages that can be edited
+
+    def generate(self, count: int) -> list[dict]:
+        """
+        Returns `count` updates in the configured mix
+        """
+        kinds = list(self.mix)
+        weights = [self.mix[i] for i in kinds]
+
+        return [
+            getattr(self, kind)()
+            for kind in self.random.choices(kinds, weights, k=count)
+        ]
+
+    def text(self) -> dict:
+        words = self.random.randint(1, 30)
+        return self._message_created(
+            " ".join(self.random.choices(WORDS, k=words))
+        )
+
+    def command(self) -> dict:
+        name = f"cmd{self.random.randrange(max(self.commands, 1))}"
+        args = " ".join(
+            self.random.choices(WORDS, k=self.random.randint(0, 3))
+        )
+        return self._message_created(f"/{name} {args}".strip())
+
+    def attachments(self) -> dict:
+        attachments = [
+            self._attachment()
+            for _ in range(self.random.choice((1, 1, 1, 2, 4)))
+        ]
+        text = " ".join(
+            self.random.choices(WORDS, k=self.random.randint(0, 5))
+        )
+        return self._message_created(text, attachments)
+
+    def callback(self) -> dict:
+        self._tick()
+        payload = f"btn{self.random.randrange(max(self.payloads, 1))}"
+        return {
+            "update_type": "message_callback",
+            "timestamp": self.timestamp,
+            "callback": {
+                "timestamp": self.timestamp,
+                "callback_id": f"cb.{self.timestamp}.{self.seq}",
+                "payload": payload,
+                "user": self._user(),
+            },
+            "message": self._message(
+                "Choose an option",
+                [self._keyboard()],
+                sender=self._user(bot=True),
+            ),
+            "user_locale": "ru",
+        }
+
+    def edit(self) -> dict:
+        if not self.sent:
+            return self.text()
+
+        self._tick()
+        message = dict(self.random.choice(self.sent))
+        message["body"] = dict(
+            message["body"],
+            text=" ".join(
+                self.random.choices(WORDS, k=self.random.randint(1, 30))
+            ),
+        )
+        return {
+            "update_type": "message_edited",
+            "timestamp": self.timestamp,
+            "message": message,
+        }
+
+    def _message_created(
+        self, text: str, attachments: "list[dict] | None" = None
+    ) -> dict:
+        self._tick()
+        message = self._message(text, attachments)
+
+        self.sent.append(message)
+        if len(self.sent) > 1000:
+            self.sent.pop(0)
+
+        return {
+            "update_type": "message_created",
+            "timestamp": self.timestamp,
+            "message": message,
+            "user_locale": "ru",
+        }
+
+    def _message(
+        self,
+        text: str,
+        attachments: "list[dict] | None" = None,
+        sender: "dict | None" = None,
+    ) -> dict:
+        self.seq += 1
+        chat_id = -self.random.randrange(1, self.chats + 1)
+        body = {
+            "mid": f"mid.{self.seq:016x}",
+            "seq": self.seq,
+            "text": text,
+        }
+        if attachments:
+            body["attachments"] = attachments
+
+        return {
+            "sender": sender or self._user(),
+            "recipient": {"chat_id": chat_id, "chat_type": "chat"},
+            "timestamp": self.timestamp,
+            "body": body,
+            "stat": {"views": self.random.randint(0, 100)},
+        }
+
+    def _user(self, bot: bool = False) -> dict:
+        user_id = 1 if bot else self.random.randrange(2, self.users + 2)
+        return {
+            "user_id": user_id,
+            "first_name": f"User {user_id}",
+            "last_name": "",
+            "name": f"User {user_id}",
+            "username": None if user_id % 3 else f"user{user_id}",
+            "is_bot": bot,
+            "last_activity_time": self.timestamp,
+        }
+
+    def _attachment(self) -> dict:
+        kind = self.random.choice(("image", "image", "video", "file"))
+        token = f"{self.random.getrandbits(128):032x}"
+
+        if kind == "image":
+            return {
+                "type": "image",
+                "payload": {
+                    "photo_id": self.random.getrandbits(48),
+                    "token": token,
+                    "url": f"https://i.oneme.ru/i?r={token}",
+                },
+            }
+        if kind == "video":
+            return {
+                "type": "video",
+                "payload": {"token": token, "url": None},
+                "thumbnail": {"url": f"https://i.oneme.ru/i?r={token}"},
+                "width": 1280,
+                "height": 720,
+                "duration": self.random.randint(1, 600),
+            }
+        return {
+            "type": "file",
+            "payload": {"token": token, "url": None},
+            "filename": f"{token[:8]}.pdf",
+            "size": self.random.randint(1000, 10000000),
+        }
+
+    def _keyboard(self) -> dict:
+        return {
+            "type": "inline_keyboard",
+            "payload": {
+                "buttons": [
+                    [
+                        {
+                            "type": "callback",
+                            "text": f"Option {i}",
+                            "payload": f"btn{i}",
+                        }
+                        for i in range(row * 2, row * 2 + 2)
+                    ]
+                    for row in range(2)
+                ]
+            },
+        }
+
+    def _tick(self):
+        self.timestamp += self.random.randint(0, 50)
@@ -0,0 +1,205 @@
+import asyncio
+import platform
+import sys
+import time
+import tracemalloc
+
+from .. import filters
+from ..bot import Bot
+from ..router import Router
+from ..types import Message
+from ..utils import percentile
+
+WORD = ["hello", "order", "help", "price", "menu", "where"]
+
+
+async def _noop(*args, **kwargs):
+    pass
+
+
+async def _with_cursor(obj, cursor):
+    cursor.get_state()
+
+
+def _filters(i: int) -> list:
+    """
+    Returns filters of the i-th message handler, so that the tree
+    contains a realistic mix of cheap and expensive filters
+    """
+    kind = i % 5
+
+    if kind == 0:
+        return [filters.startswith(WORD[i % len(WORD)])]
+    if kind == 1:
+        return [filters.has(WORD[i % len(WORD)])]
+    if kind == 2:
+        return [filters.regex(rf"\b{WORD[i % len(WORD)]}\b")]
+    if kind == 3:
+        return [filters.state(f"state{i}")]
+    return [lambda message, i=i: len(message.content or "") % 7 == i % 7]
+
+
+def build_bot(
+    handlers: int = 20,
+    commands: int = 10,
+    callbacks: int = 10,
+    routers: int = 2,
+    depth: int = 1,
+) -> Bot:
+    """
+    Returns a bot with a router tree of the given size. Handlers,
+    commands and callback handlers are spread evenly over all routers
+
+    :param handlers: Number of message and edit handlers
+    :param commands: Number of commands, named `cmd0`, `cmd1`...
+    :param callbacks: Number of callback handlers
+    :param routers: Number of child routers of each router
+    :param depth: Depth of the router tree. 0 to use only the bot
+    """
+    bot = Bot("bench", max_messages_cached=10000)
+    bot.id = 1
+    bot.username = "benchbot"
+    bot.name = "Bench bot"
+
+    tree: list[Router] = [bot]
+    level = [bot]
+    for _ in range(depth):
+        children = []
+        for parent in level:
+            for _ in range(routers):
+                child = Router()
+                parent.add_router(child)
+                children.append(child)
+        tree.extend(children)
+        level = children
+
+    for i in range(handlers):
+        router = tree[i % len(tree)]
+        call = _with_cursor if i % 4 == 0 else _noop
+        router.on_message(*_filters(i))(call)
+        if i % 3 == 0:
+            router.on_message_edit(*_filters(i))(_noop)
+
+    for i in range(commands):
+        tree[i % len(tree)].on_command(f"cmd{i}")(_noop)
+
+    for i in range(callbacks):
+        tree[i % len(tree)].on_button_callback(filters.equals(f"btn{i}"))(
+            _noop
+        )
+
+    return bot
+
+
+async def bench_dispatch(
+    bot: Bot,
+    updates: list[dict],
+    warmup: int = 100,
+    allocations: bool = True,
+) -> dict:
+    """
+    Measures `Bot.handle_update`, including running the handlers.
+
+    Returns updates per second, percentiles of dispatch latency in
+    microseconds and, if `allocations` is True, average memory allocated
+    while handling an update (`peak_bytes`) and left allocated after it
+    (`retained_bytes`), measured in a separate pass with tracemalloc
+
+    :param bot: Bot to dispatch the updates to
+    :param updates: Raw updates
+    :param warmup: Number of updates to handle before measuring
+    :param allocations: Whether to measure allocations
+    """
+    for update in updates[:warmup]:
+        await bot.handle_update(update)
+        await asyncio.sleep(0)
+
+    latencies = []
+    start = time.perf_counter()
+
+    for update in updates:
+        handled = time.perf_counter()
+        await bot.handle_update(update)
+        latencies.append(time.perf_counter() - handled)
+        # run the spawned handlers
+        await asyncio.sleep(0)
+
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    result = {
+        "updates": len(updates),
+        "seconds": elapsed,
+        "updates_per_second": len(updates) / elapsed,
+        "latency_us": {
+            f"p{q}": percentile(latencies, q) * 1e6 for q in (50, 90, 99)
+        },
+    }
+
+    if allocations:
+        result.update(await _allocations(bot, updates))
+
+    return result
+
+
+async def _allocations(bot: Bot, updates: list[dict]) -> dict:
+    peak = retained = 0
+
+    tracemalloc.start()
+    try:
+        for update in updates:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+
+            await bot.handle_update(update)
+            await asyncio.sleep(0)
+
+            current, update_peak = tracemalloc.get_traced_memory()
+            peak += update_peak - before
+            retained += current - before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "peak_bytes": peak / len(updates),
+        "retained_bytes": retained / len(updates),
+    }
+
+
+def bench_parsing(updates: list[dict]) -> dict:
+    """
+    Measures `Message.from_json` on messages of the given updates.
+
+    Returns messages parsed per second
+    """
+    messages = [i["message"] for i in updates if "message" in i]
+
+    start = time.perf_counter()
+    for message in messages:
+        Message.from_json(message)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "messages": len(messages),
+        "seconds": elapsed,
+        "messages_per_second": len(messages) / elapsed if elapsed else 0.0,
+    }
+
+
+def environment() -> dict:
+    """
+    Returns information about the environment to compare runs with
+    """
+    try:
+        from importlib.metadata import version
+
+        aiomax_version = version("aiomax")
+    except Exception:
+        aiomax_version = None
+
+    return {
+        "aiomax": aiomax_version,
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+    }
@@ -2,7 +2,10 @@ import asyncio
 import logging
 import os
 import ssl
+import time
+from array import array
 from collections.abc import AsyncIterator
+from contextvars import ContextVar
 from typing import IO, BinaryIO, Literal
 
 import aiofiles
@@ -10,8 +13,18 @@ import aiohttp
 from aiohttp.client_exceptions import ClientConnectorCertificateError
 
 from . import buttons, exceptions, fsm, utils
-from .cache import MessageCache
+from .cache import MISSING, EntityCache, MessageCache
+from .dedupe import Deduplicator
+from .filters import ANY_STATE
+from .journal import UpdateRecorder
+from .lag import LagTracker
+from .loaders import MembershipLoader
+from .markers import FileMarkerStore, MarkerStore
+from .metrics import Metrics
+from .profiling import Profiler
 from .router import Router
+from .tracing import NO_SPAN, Tracer, current_span
+from .transport import AiohttpTransport, Transport
 from .types import (
     Attachment,
     AudioAttachment,
@@ -24,6 +37,7 @@ from .types import (
     ChatTitleEditPayload,
     CommandContext,
     FileAttachment,
+    Handler,
     ImageRequestPayload,
     Message,
     MessageDeletePayload,
@@ -32,9 +46,16 @@ from .types import (
     UserMembershipPayload,
     VideoAttachment,
 )
+from .watchdog import LoopMonitor
 
 bot_logger = logging.getLogger("aiomax.bot")
 
+# dispatch start and server timestamp of the update being handled,
+# per task so that concurrent `Bot.handle_update` calls do not mix them
+_dispatching: "ContextVar[tuple[float, int] | None]" = ContextVar(
+    "aiomax_dispatching", default=None
+)
+
 
 class Bot(Router):
     def __init__(
@@ -47,6 +68,21 @@ class Bot(Router):
         max_messages_cached: int = 10000,
         use_certificate: bool = False,
         api_url: str = "https://platform-api2.max.ru/",
+        entity_cache: "EntityCache | None" = None,
+        coalesce_requests: bool = True,
+        batch_memberships: bool = False,
+        message_cache: "MessageCache | None" = None,
+        storage: "fsm.FSMStorage | None" = None,
+        marker_store: "MarkerStore | str | None" = None,
+        marker_policy: "Literal['completed', 'received']" = "completed",
+        dedupe: "Deduplicator | None" = None,
+        recorder: "UpdateRecorder | None" = None,
+        transport: "Transport | None" = None,
+        metrics: "Metrics | None" = None,
+        tracer: "Tracer | None" = None,
+        lag_tracker: "LagTracker | None" = None,
+        loop_monitor: "LoopMonitor | None" = None,
+        marker_timeout: "float | None" = 300,
     ):
         """
         Bot init
@@ -62,6 +98,41 @@ class Bot(Router):
         Set to 0 to disable caching
         :param use_certificate: Whether to automatically use
         a Russian Mintsifra SSL certificate
+        :param api_url: API URL
+        :param entity_cache: Cache for `get_chat`, `get_admins`,
+        `my_membership` and `get_memberships` results. Disabled by default
+        :param coalesce_requests: Whether identical concurrent GET requests
+        made through `Bot.get_json` should share a single request
+        :param batch_memberships: Whether `get_memberships` calls made
+        at the same time should be merged into one request per chat
+        :param message_cache: Custom message cache, e.g. with a TTL
+        or a memory limit. Overrides `max_messages_cached`
+        :param storage: FSM storage, e.g. with a persistent backend
+        :param marker_store: Where to save the polling marker to continue
+        from it after a restart. A path to save it to a file
+        :param marker_policy: When the saved marker advances. "completed"
+        waits until all handlers of the received updates are completed,
+        "received" saves it as soon as updates are received
+        :param dedupe: Deduplicator that skips updates delivered twice,
+        e.g. `WindowDeduplicator`. Disabled by default
+        :param recorder: Journal to record all received updates to,
+        to replay them later with `UpdateReplayer`
+        :param transport: Transport to send API requests through, e.g.
+        `MemoryTransport` for benchmarks. By default an aiohttp session
+        is created when polling starts
+        :param metrics: Registry to collect metrics of updates, handlers,
+        API requests and caches to. Disabled by default
+        :param tracer: Tracer to record spans of updates, their parsing,
+        filters, handlers and API requests with. Disabled by default
+        :param lag_tracker: Tracker of the age of updates and the latency
+        of their handlers, to notice when the bot falls behind.
+        Disabled by default
+        :param loop_monitor: Monitor of the event loop lag that reports
+        handlers blocking the loop while polling. Disabled by default
+        :param marker_timeout: Seconds the "completed" marker policy waits
+        for handlers before saving the marker anyway, so that a hung
+        handler does not stop markers from being saved. None to wait
+        forever
         """
         super().__init__(case_sensitive)
 
@@ -70,14 +141,25 @@ class Bot(Router):
 
         self.access_token: str = access_token
         self.session = None
+        self.transport: Transport | None = transport
+        # transport of the current session, created once per session
+        self._session_transport: AiohttpTransport | None = None
         self.polling = False
 
         self.command_prefixes: str | list[str] = command_prefixes
         self.mention_prefix: bool = mention_prefix
         self.default_format: str | None = default_format
-        self.cache: MessageCache | None = (
-            MessageCache(max_messages_cached)
-            if max_messages_cached > 0
+        self.cache: MessageCache | None = message_cache
+        if self.cache is None and max_messages_cached > 0:
+            self.cache = MessageCache(max_messages_cached)
+        if self.cache is not None:
+            self.cache.bot = self
+        self.entity_cache: EntityCache | None = entity_cache
+        self.coalesce_requests: bool = coalesce_requests
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self.membership_loader: MembershipLoader | None = (
+            MembershipLoader(self._fetch_memberships)
+            if batch_memberships
             else None
         )
 
@@ -88,40 +170,102 @@ class Bot(Router):
         self.bot_commands: list[BotCommand] = None
 
         self.marker: int | None = None
+        if isinstance(marker_store, str):
+            marker_store = FileMarkerStore(marker_store)
+        self.marker_store: MarkerStore | None = marker_store
+        self.marker_policy: str = marker_policy
+        self.marker_timeout: float | None = marker_timeout
+        self._checkpoint: asyncio.Task | None = None
+
+        self.dedupe: Deduplicator | None = dedupe
+        self.recorder: UpdateRecorder | None = recorder
+
+        self.tasks: set[asyncio.Task] = set()
+        self._batch: list[asyncio.Task] | None = None
+
+        self.lag_tracker: LagTracker | None = lag_tracker
+        self.loop_monitor: LoopMonitor | None = loop_monitor
+        self.profiler: Profiler = Profiler(self)
+
+        # files being uploaded, for `memory_report`
+        self.uploads_in_flight: int = 0
+        self.upload_bytes_in_flight: int = 0
+
+        self.metrics: Metrics | None = metrics
+        if metrics is not None:
+            metrics.bind(self)
+        self.tracer: Tracer | None = tracer
+
+        self.storage: fsm.FSMStorage = (
+            storage if storage is not None else fsm.FSMStorage()
+        )
 
-        self.storage = fsm.FSMStorage()
-
-    async def get(self, url: str, *args, **kwargs):
+    def _transport(self) -> Transport:
         """
-        Sends a GET request to the API.
+        Returns the transport that API requests are sent through.
         """
+        if self.transport is not None:
+            return self.transport
+
         if self.session is None:
             raise Exception("Session is not initialized")
 
-        params = kwargs.get("params", {})
-        if "params" in kwargs:
-            del kwargs["params"]
+        transport = self._session_transport
+        if transport is None or transport.session is not self.session:
+            transport = self._session_transport = AiohttpTransport(
+                self.session
+            )
 
-        response = await self.session.get(url, *args, params=params, **kwargs)
+        return transport
 
-        exception = await utils.get_exception(response)
+    def _span(self, name: str, **attributes):
+        """
+        Returns a child span of the current span if tracing is enabled.
+        """
+        if self.tracer is None:
+            return NO_SPAN
 
-        if not exception:
-            return response
-        raise exception
+        return self.tracer.span(name, **attributes)
 
-    async def post(self, url: str, *args, **kwargs):
+    def _filter_span(self, handler: Handler):
         """
-        Sends a POST request to the API.
+        Returns a span of the filters of a handler if tracing is enabled.
+        The handler name is only looked up when it is.
         """
-        if self.session is None:
-            raise Exception("Session is not initialized")
+        if self.tracer is None:
+            return NO_SPAN
+
+        return self.tracer.span("filter", handler=handler.call.__qualname__)
+
+    async def request(self, method: str, url: str, *args, **kwargs):
+        """
+        Sends a request to the API.
+        """
+        transport = self._transport()
 
         params = kwargs.get("params", {})
         if "params" in kwargs:
             del kwargs["params"]
 
-        response = await self.session.post(url, *args, params=params, **kwargs)
+        span = NO_SPAN
+        if self.tracer is not None and current_span.get() is not None:
+            span = self.tracer.span(
+                "api", method=method, endpoint=utils.endpoint_name(url)
+            )
+
+        with span:
+            if self.metrics is None:
+                response = await transport.request(
+                    method, url, *args, params=params, **kwargs
+                )
+            else:
+                response = await self._measure(
+                    transport.request(
+                        method, url, *args, params=params, **kwargs
+                    ),
+                    method,
+                    url,
+                )
 
         exception = await utils.get_exception(response)
 
@@ -129,66 +273,105 @@ class Bot(Router):
             return response
         raise exception
 
-    async def patch(self, url: str, *args, **kwargs):
+    async def _measure(self, request, method: str, url: str):
         """
-        Sends a PATCH request to the API.
+        Awaits a request, recording its latency and status to metrics.
         """
-        if self.session is None:
-            raise Exception("Session is not initialized")
+        endpoint = utils.endpoint_name(url)
+        status = "error"
+        start = time.perf_counter()
 
-        params = kwargs.get("params", {})
-        if "params" in kwargs:
-            del kwargs["params"]
-
-        response = await self.session.patch(
-            url, *args, params=params, **kwargs
-        )
-
-        exception = await utils.get_exception(response)
-
-        if not exception:
+        try:
+            response = await request
+            status = str(response.status)
             return response
-        raise exception
+        finally:
+            self.metrics.api_latency.observe(
+                time.perf_counter() - start, method, endpoint
+            )
+            self.metrics.api_requests.inc(method, endpoint, status)
 
-    async def put(self, url: str, *args, **kwargs):
+    async def get(self, url: str, *args, **kwargs):
         """
-        Sends a PUT request to the API.
+        Sends a GET request to the API.
         """
-        if self.session is None:
-            raise Exception("Session is not initialized")
+        return await self.request("GET", url, *args, **kwargs)
 
-        params = kwargs.get("params", {})
-        if "params" in kwargs:
-            del kwargs["params"]
+    async def get_json(self, url: str, params: "dict | None" = None):
+        """
+        Sends a GET request to the API and returns the decoded JSON.
 
-        response = await self.session.put(url, *args, params=params, **kwargs)
+        If `Bot.coalesce_requests` is enabled, identical concurrent requests
+        share one request and its result. The result must not be modified.
+        Cancelling one caller does not cancel the request for the others.
+        """
+        if not self.coalesce_requests:
+            return await self._get_json(url, params)
 
-        exception = await utils.get_exception(response)
+        key = (url, repr(sorted((params or {}).items())))
+        task = self._inflight.get(key)
 
-        if not exception:
-            return response
-        raise exception
+        if task is None:
+            task = asyncio.create_task(self._get_json(url, params))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    async def _get_json(self, url: str, params: "dict | None" = None):
+        response = await self.get(url, params=params or {})
+        return await response.json()
+
+    async def post(self, url: str, *args, **kwargs):
+        """
+        Sends a POST request to the API.
+        """
+        return await self.request("POST", url, *args, **kwargs)
+
+    async def patch(self, url: str, *args, **kwargs):
+        """
+        Sends a PATCH request to the API.
+        """
+        return await self.request("PATCH", url, *args, **kwargs)
+
+    async def put(self, url: str, *args, **kwargs):
+        """
+        Sends a PUT request to the API.
+        """
+        return await self.request("PUT", url, *args, **kwargs)
 
     async def delete(self, url: str, *args, **kwargs):
         """
         Sends a DELETE request to the API.
         """
-        if self.session is None:
-            raise Exception("Session is not initialized")
+        return await self.request("DELETE", url, *args, **kwargs)
 
-        params = kwargs.get("params", {})
-        if "params" in kwargs:
-            del kwargs["params"]
+    async def _cached(self, key: tuple, fetch):
+        """
+        Returns an entity from `Bot.entity_cache`, calling `fetch`
+        and caching its result on a miss.
 
-        response = await self.session.delete(
-            url, *args, params=params, **kwargs
-        )
+        :param key: Entity key
+        :param fetch: Coroutine function that requests the entity
+        """
+        if self.entity_cache is None:
+            return await fetch()
 
-        exception = await utils.get_exception(response)
+        value = self.entity_cache.get(key)
+        if value is not MISSING:
+            return value
 
-        if not exception:
-            return response
-        raise exception
+        try:
+            value = await fetch()
+        except (
+            exceptions.ChatNotFound,
+            exceptions.NotFoundException,
+        ) as e:
+            self.entity_cache.set_missing(key, e)
+            raise
+
+        self.entity_cache.set(key, value)
+        return value
 
     # send requests
 
@@ -196,8 +379,7 @@ class Bot(Router):
         """
         Returns info about the bot.
         """
-        response = await self.get("me")
-        user = await response.json()
+        user = await self.get_json("me")
         user = User.from_json(user)
 
         # caching info
@@ -251,31 +433,112 @@ class Bot(Router):
 
         return User.from_json(data)
 
+    async def _paginate(
+        self,
+        url: str,
+        count_per_iter: int = 100,
+        prefetch: int = 1,
+        params: "dict | None" = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Returns an asynchronous iterator of raw pages of a paginated
+        endpoint. Next pages are requested in the background while
+        the current one is being consumed.
+
+        :param url: Endpoint URL
+        :param count_per_iter: The number of items to fetch per request.
+        :param prefetch: How many pages to fetch ahead of the consumer.
+            Set to 0 to fetch pages only when they are needed
+        :param params: Additional query parameters
+        """
+        params = dict(params or {})
+
+        async def fetch(marker):
+            page_params = {
+                **params,
+                "count": count_per_iter,
+                "marker": marker,
+            }
+            page_params = {k: v for k, v in page_params.items() if v}
+            return await self.get_json(url, params=page_params)
+
+        if prefetch <= 0:
+            marker = None
+
+            while True:
+                data = await fetch(marker)
+                yield data
+
+                marker = data.get("marker", None)
+                if marker is None:
+                    break
+            return
+
+        pages = asyncio.Queue(maxsize=prefetch)
+
+        async def producer():
+            marker = None
+
+            try:
+                while True:
+                    data = await fetch(marker)
+                    await pages.put(data)
+
+                    marker = data.get("marker", None)
+                    if marker is None:
+                        break
+
+            except Exception as e:
+                await pages.put(e)
+                return
+
+            await pages.put(None)
+
+        task = asyncio.create_task(producer())
+
+        try:
+            while True:
+                data = await pages.get()
+
+                if data is None:
+                    break
+                if isinstance(data, Exception):
+                    raise data
+
+                yield data
+        finally:
+            task.cancel()
+
     async def get_chats(
-        self, count_per_iter: int = 100
+        self, count_per_iter: int = 100, prefetch: int = 1
     ) -> AsyncIterator[Chat]:
         """
         Returns an asynchronous interator of chats the bot is in.
 
         :param count_per_iter: The number of chats to fetch per request.
+        :param prefetch: How many pages to fetch ahead while the current
+            one is being iterated. Set to 0 to disable read-ahead
         """
-        marker = None
-
-        while True:
-            params = {
-                "count": count_per_iter,
-                "marker": marker,
-            }
-            params = {k: v for k, v in params.items() if v}
-            response = await self.get("chats", params=params)
-            data = await response.json()
-
+        async for data in self._paginate("chats", count_per_iter, prefetch):
             for chat in data["chats"]:
                 yield Chat.from_json(chat)
 
-            marker = data.get("marker", None)
-            if marker is None:
-                break
+    async def collect_chat_ids(
+        self, count_per_iter: int = 100, prefetch: int = 1
+    ) -> array:
+        """
+        Returns IDs of all chats the bot is in as a compact array.
+        Faster than `get_chats` as no `Chat` objects are created.
+
+        :param count_per_iter: The number of chats to fetch per request.
+        :param prefetch: How many pages to fetch ahead.
+        """
+        out = array("q")
+
+        async for data in self._paginate("chats", count_per_iter, prefetch):
+            out.extend(chat["chat_id"] for chat in data["chats"])
+
+        return out
 
     async def chat_by_link(self, link: str) -> Chat:
         """
@@ -283,8 +546,7 @@ class Bot(Router):
 
         :param link: Public chat link or username.
         """
-        response = await self.get(f"chats/{link}")
-        json = await response.json()
+        json = await self.get_json(f"chats/{link}")
 
         return Chat.from_json(json)
 
@@ -294,10 +556,13 @@ class Bot(Router):
 
         :param chat_id: The ID of the chat.
         """
-        response = await self.get(f"chats/{chat_id}")
-        json = await response.json()
 
-        return Chat.from_json(json)
+        async def fetch():
+            json = await self.get_json(f"chats/{chat_id}")
+
+            return Chat.from_json(json)
+
+        return await self._cached(("chat", chat_id), fetch)
 
     async def get_pin(self, chat_id: int) -> "Message | None":
         """
@@ -306,8 +571,7 @@ class Bot(Router):
 
         :param chat_id: The ID of the chat.
         """
-        response = await self.get(f"chats/{chat_id}/pin")
-        json = await response.json()
+        json = await self.get_json(f"chats/{chat_id}/pin")
 
         if json["message"] is None:
             return None
@@ -346,10 +610,13 @@ class Bot(Router):
 
         :param chat_id: The ID of the chat.
         """
-        response = await self.get(f"chats/{chat_id}/members/me")
-        json = await response.json()
 
-        return User.from_json(json)
+        async def fetch():
+            json = await self.get_json(f"chats/{chat_id}/members/me")
+
+            return User.from_json(json)
+
+        return await self._cached(("my_membership", chat_id), fetch)
 
     async def leave_chat(self, chat_id: int):
         """
@@ -359,6 +626,9 @@ class Bot(Router):
         """
         response = await self.delete(f"chats/{chat_id}/members/me")
 
+        if self.entity_cache is not None:
+            self.entity_cache.invalidate_chat(chat_id)
+
         return await response.json()
 
     async def get_admins(self, chat_id: int) -> list[User]:
@@ -367,11 +637,13 @@ class Bot(Router):
 
         :param chat_id: The ID of the chat.
         """
-        response = await self.get(f"chats/{chat_id}/members/admins")
 
-        users = [User.from_json(i) for i in (await response.json())["members"]]
+        async def fetch():
+            json = await self.get_json(f"chats/{chat_id}/members/admins")
 
-        return users
+            return [User.from_json(i) for i in json["members"]]
+
+        return list(await self._cached(("admins", chat_id), fetch))
 
     async def get_memberships(
         self, chat_id: int, user_ids: "list[int] | int"
@@ -380,50 +652,105 @@ class Bot(Router):
         Returns a list of memberships in the chat for the users with the
         specified ID.
         """
-        params = {
-            "user_ids": user_ids if isinstance(user_ids, list) else [user_ids]
-        }
-        response = await self.get(
-            f"chats/{chat_id}/members",
-            params=params,
-        )
+        ids = user_ids if isinstance(user_ids, list) else [user_ids]
+
+        if self.entity_cache is None:
+            users = await self._load_memberships(chat_id, ids)
+        else:
+            found = {}
+            missing = []
+
+            for user_id in ids:
+                user = self.entity_cache.get(("membership", chat_id, user_id))
+
+                if user is MISSING:
+                    missing.append(user_id)
+                else:
+                    found[user_id] = user
 
-        users = [User.from_json(i) for i in (await response.json())["members"]]
+            if missing:
+                fetched = await self._load_memberships(chat_id, missing)
+                fetched = {user.user_id: user for user in fetched}
+
+                for user_id in missing:
+                    key = ("membership", chat_id, user_id)
+
+                    if user_id in fetched:
+                        self.entity_cache.set(key, fetched[user_id])
+                    else:
+                        self.entity_cache.set_missing(key)
+
+                found.update(fetched)
+
+            users = [found[i] for i in ids if found.get(i) is not None]
 
         if isinstance(user_ids, list):
             return users
         else:
             return users[0] if len(users) > 0 else None
 
+    async def _load_memberships(
+        self, chat_id: int, user_ids: list[int]
+    ) -> list[User]:
+        """
+        Requests memberships of the users in the chat, through
+        `Bot.membership_loader` if batching is enabled.
+        """
+        if self.membership_loader is None:
+            return await self._fetch_memberships(chat_id, user_ids)
+
+        users = await self.membership_loader.load_many(chat_id, user_ids)
+        return [user for user in users if user is not None]
+
+    async def _fetch_memberships(
+        self, chat_id: int, user_ids: list[int]
+    ) -> list[User]:
+        """
+        Requests memberships of the users in the chat, bypassing the cache.
+        """
+        json = await self.get_json(
+            f"chats/{chat_id}/members",
+            params={"user_ids": user_ids},
+        )
+
+        return [User.from_json(i) for i in json["members"]]
+
     async def get_members(
-        self, chat_id: int, count_per_iter: int = 100
+        self, chat_id: int, count_per_iter: int = 100, prefetch: int = 1
     ) -> AsyncIterator[User]:
         """
         Returns an asynchronous interator of members in the chat.
 
         :param chat_id: The ID of the chat.
         :param count_per_iter: The number of users to fetch per request.
+        :param prefetch: How many pages to fetch ahead while the current
+            one is being iterated. Set to 0 to disable read-ahead
         """
-        marker = None
-
-        while True:
-            params = {
-                "count": count_per_iter,
-                "marker": marker,
-            }
-            params = {k: v for k, v in params.items() if v}
-            response = await self.get(
-                f"chats/{chat_id}/members",
-                params=params,
-            )
-            data = await response.json()
-
+        async for data in self._paginate(
+            f"chats/{chat_id}/members", count_per_iter, prefetch
+        ):
             for user in data["members"]:
                 yield User.from_json(user)
 
-            marker = data.get("marker", None)
-            if marker is None:
-                break
+    async def collect_member_ids(
+        self, chat_id: int, count_per_iter: int = 100, prefetch: int = 1
+    ) -> array:
+        """
+        Returns IDs of all members in the chat as a compact array.
+        Faster than `get_members` as no `User` objects are created.
+
+        :param chat_id: The ID of the chat.
+        :param count_per_iter: The number of users to fetch per request.
+        :param prefetch: How many pages to fetch ahead.
+        """
+        out = array("q")
+
+        async for data in self._paginate(
+            f"chats/{chat_id}/members", count_per_iter, prefetch
+        ):
+            out.extend(user["user_id"] for user in data["members"])
+
+        return out
 
     async def add_members(self, chat_id: int, users: list[int]):
         """
@@ -438,6 +765,10 @@ class Bot(Router):
             json={"user_ids": users},
         )
 
+        if self.entity_cache is not None:
+            for user_id in users:
+                self.entity_cache.invalidate_member(chat_id, user_id)
+
         return await response.json()
 
     async def kick_member(
@@ -462,6 +793,9 @@ class Bot(Router):
             params=params,
         )
 
+        if self.entity_cache is not None:
+            self.entity_cache.invalidate_member(chat_id, user_id)
+
         return await response.json()
 
     async def patch_chat(
@@ -493,8 +827,12 @@ class Bot(Router):
 
         response = await self.patch(f"chats/{chat_id}", json=payload)
         json = await response.json()
+        chat = Chat.from_json(json)
 
-        return Chat.from_json(json)
+        if self.entity_cache is not None:
+            self.entity_cache.set(("chat", chat_id), chat)
+
+        return chat
 
     async def post_action(self, chat_id: int, action: str):
         """
@@ -529,9 +867,28 @@ class Bot(Router):
         form = aiohttp.FormData(quote_fields=False)
         form.add_field(field_name, data)
 
-        url_resp = await self.post("uploads", params={"type": type})
-        url_json = await url_resp.json()
-        token_resp = await self.session.post(url_json["url"], data=form)
+        size = utils.payload_size(data) or 0
+        if self.metrics is not None:
+            self.metrics.upload_bytes.inc(type, amount=size)
+
+        self.uploads_in_flight += 1
+        self.upload_bytes_in_flight += size
+        try:
+            url_resp = await self.post("uploads", params={"type": type})
+            url_json = await url_resp.json()
+            upload = self._transport().request(
+                "POST", url_json["url"], data=form
+            )
+            with self._span("api", method="POST", endpoint="upload"):
+                if self.metrics is None:
+                    token_resp = await upload
+                else:
+                    token_resp = await self._measure(
+                        upload, "POST", url_json["url"]
+                    )
+        finally:
+            self.uploads_in_flight -= 1
+            self.upload_bytes_in_flight -= size
         token_resp.raise_for_status()
 
         if type in {"audio", "video"}:
@@ -719,6 +1076,11 @@ class Bot(Router):
                 exception = await utils.get_exception(response)
                 if exception:
                     raise exception
+
+            # the edited message is not returned, so it is fetched again
+            if self.cache is not None:
+                self.cache.remove_message(message_id)
+
             message = Message.from_json(json)
             message.bot = self
             return message
@@ -750,21 +1112,92 @@ class Bot(Router):
         if not json["success"]:
             raise Exception(json["message"])
 
-    async def get_message(self, message_id: str) -> Message:
+        if self.cache is not None:
+            self.cache.remove_message(message_id)
+
+    async def get_message(
+        self,
+        message_id: str,
+        use_cache: bool = True,
+        max_age: "float | None" = None,
+    ) -> Message:
         """
         Allows you to fetch message's info.
 
         :param message_id: ID of the message to get info of
+        :param use_cache: Whether to return the message from `Bot.cache`
+            if it is there
+        :param max_age: Maximum number of seconds since the message was
+            cached for the cached copy to be used. None for any age
         """
-        try:
-            response = await self.get(f"messages/{message_id}")
+        if use_cache and self.cache is not None:
+            await self.cache.load(message_id)
+            message = self.cache.get_message(message_id, max_age)
 
-            data = await response.json()
+            if message is not None:
+                return message
 
-            return Message.from_json(data)
+        try:
+            data = await self.get_json(f"messages/{message_id}")
         except exceptions.NotFoundException:
             raise exceptions.MessageNotFoundException from None
 
+        message = Message.from_json(data)
+        message.bot = self
+
+        if self.cache is not None:
+            self.cache.add_message(message, raw=data)
+
+        return message
+
+    async def get_messages(
+        self,
+        message_ids: list[str],
+        use_cache: bool = True,
+        max_age: "float | None" = None,
+    ) -> list[Message]:
+        """
+        Fetches multiple messages. Messages missing from `Bot.cache` are
+        requested in as few requests as possible. Messages that were not
+        found are skipped.
+
+        :param message_ids: IDs of the messages to get info of
+        :param use_cache: Whether to return messages from `Bot.cache`
+            if they are there
+        :param max_age: Maximum number of seconds since a message was
+            cached for the cached copy to be used. None for any age
+        """
+        found: dict[str, Message] = {}
+        missing = []
+
+        for message_id in dict.fromkeys(message_ids):
+            message = None
+
+            if use_cache and self.cache is not None:
+                await self.cache.load(message_id)
+                message = self.cache.get_message(message_id, max_age)
+
+            if message is None:
+                missing.append(message_id)
+            else:
+                found[message_id] = message
+
+        for i in range(0, len(missing), 100):
+            data = await self.get_json(
+                "messages",
+                params={"message_ids": ",".join(missing[i : i + 100])},
+            )
+
+            for raw in data["messages"]:
+                message = Message.from_json(raw)
+                message.bot = self
+                found[message.id] = message
+
+                if self.cache is not None:
+                    self.cache.add_message(message, raw=raw)
+
+        return [found[i] for i in message_ids if i in found]
+
     async def get_updates(self, limit: int = 100) -> tuple[int, dict]:
         """
         Get bot updates / events.
@@ -781,21 +1214,156 @@ class Bot(Router):
 
         return json
 
+    def _spawn(self, coro) -> asyncio.Task:
+        """
+        Runs a handler in a task and keeps track of it.
+        """
+        handler = coro.__qualname__
+
+        if self.tracer is not None:
+            parent = current_span.get()
+            if parent is not None:
+                coro = self._traced(coro, handler, parent.root)
+
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        if self.metrics is not None:
+            self.metrics.handlers_dispatched.inc(handler)
+            task.add_done_callback(
+                lambda task: self._handler_done(task, handler)
+            )
+
+        dispatching = _dispatching.get()
+        if self.lag_tracker is not None and dispatching is not None:
+            dispatched, timestamp = dispatching
+            task.add_done_callback(
+                lambda task: self.lag_tracker.record_handler(
+                    time.perf_counter() - dispatched, timestamp
+                )
+            )
+
+        if self._batch is not None:
+            self._batch.append(task)
+
+        return task
+
+    async def _traced(self, coro, name: str, parent):
+        """
+        Runs a handler in a span of the update it was spawned by.
+        The span is current in the task, so requests made by the
+        handler are its children.
+        """
+        with self.tracer.span("handler", parent=parent, handler=name):
+            return await coro
+
+    def _handler_done(self, task: asyncio.Task, handler: str):
+        """
+        Counts a failed handler. The exception is logged here since
+        it is retrieved from the task.
+        """
+        if task.cancelled():
+            return
+
+        exception = task.exception()
+        if exception is not None:
+            self.metrics.handlers_failed.inc(handler)
+            bot_logger.error(f'Handler "{handler}" failed', exc_info=exception)
+
+    def _save_marker(self, marker: int, tasks: list[asyncio.Task]):
+        """
+        Saves the marker according to `marker_policy`.
+        Markers are saved in the order they were received.
+        """
+        previous = self._checkpoint
+
+        async def save():
+            if previous is not None:
+                await previous
+            if self.marker_policy == "completed" and tasks:
+                _, pending = await asyncio.wait(
+                    tasks, timeout=self.marker_timeout
+                )
+                if pending:
+                    bot_logger.warning(
+                        f"{len(pending)} handlers did not complete in "
+                        f"{self.marker_timeout}s, saving marker {marker} "
+                        "without waiting for them"
+                    )
+
+            try:
+                await self.marker_store.save(marker)
+            except Exception as e:
+                bot_logger.exception(e)
+
+        self._checkpoint = asyncio.create_task(save())
+
     async def handle_update(self, update: dict):
         """
         Handles an update.
         """
         update_type = update["update_type"]
 
+        if self.recorder is not None:
+            self.recorder.record(update)
+
+        if self.dedupe is not None and self.dedupe.is_duplicate(update):
+            bot_logger.debug(f'Duplicate update "{update_type}" skipped')
+            if self.metrics is not None:
+                self.metrics.duplicates.inc(update_type)
+            return
+
+        if self.profiler.mode is not None:
+            self.profiler.count_update()
+
+        token = None
+        if self.lag_tracker is not None:
+            timestamp = update.get("timestamp")
+            self.lag_tracker.record_update(timestamp)
+            if timestamp:
+                token = _dispatching.set((time.perf_counter(), timestamp))
+
+        span = NO_SPAN
+        if self.tracer is not None:
+            span = self.tracer.trace("update", type=update_type)
+
+        try:
+            with span:
+                if self.metrics is None:
+                    await self._dispatch(update)
+                    return
+
+                self.metrics.updates.inc(update_type)
+                start = time.perf_counter()
+                try:
+                    await self._dispatch(update)
+                finally:
+                    self.metrics.dispatch_latency.observe(
+                        time.perf_counter() - start, update_type
+                    )
+        finally:
+            if token is not None:
+                _dispatching.reset(token)
+
+    async def _dispatch(self, update: dict):
+        """
+        Runs handlers of an update.
+        """
+        update_type = update["update_type"]
+
         if update_type == "message_created":
-            message = Message.from_json(update["message"])
+            with self._span("parse"):
+                message = Message.from_json(update["message"])
             message.bot = self
             message.user_locale = update.get("user_locale")
+            await self.storage.load(message.sender.user_id)
             cursor = fsm.FSMCursor(self.storage, message.sender.user_id)
+            state = self.storage.get_state(message.sender.user_id)
 
             # caching
-            if self.cache:
-                self.cache.add_message(message)
+            if self.cache is not None:
+                self.cache.add_message(message, raw=update["message"])
 
             # handling commands
             prefixes = (
@@ -838,7 +1406,7 @@ class Bot(Router):
 
                 for i in self.commands[check_name]:
                     kwargs = utils.context_kwargs(i.call, cursor=cursor)
-                    asyncio.create_task(
+                    self._spawn(
                         i.call(
                             CommandContext(self, message, name, args), **kwargs
                         )
@@ -852,15 +1420,16 @@ class Bot(Router):
             # handling
             handled = False
 
-            for handler in self.handlers["message_created"]:
+            for handler in self.handlers_for("message_created", state):
                 if not handler.detect_commands and block:
                     continue
 
-                filters = [filter(message) for filter in handler.filters]
+                with self._filter_span(handler):
+                    filters = [filter(message) for filter in handler.filters]
 
                 if all(filters):
                     kwargs = utils.context_kwargs(handler.call, cursor=cursor)
-                    asyncio.create_task(handler.call(message, **kwargs))
+                    self._spawn(handler.call(message, **kwargs))
                     handled = True
 
             # handle logs
@@ -870,109 +1439,151 @@ class Bot(Router):
                 bot_logger.debug(f'Message "{message.body.text}" not handled')
 
         if update_type == "message_edited":
-            message = Message.from_json(update["message"])
+            with self._span("parse"):
+                message = Message.from_json(update["message"])
             message.bot = self
             message.user_locale = update.get("user_locale")
+            await self.storage.load(message.sender.user_id)
             cursor = fsm.FSMCursor(self.storage, message.sender.user_id)
+            state = self.storage.get_state(message.sender.user_id)
 
             # caching
             old_message = None
-            if self.cache:
+            if self.cache is not None:
+                await self.cache.load(message.id)
                 old_message = self.cache.get_message(message.id)
-                self.cache.add_message(message)
+                self.cache.add_message(message, raw=update["message"])
 
             # handling
-            for handler in self.handlers[update_type]:
-                filters = [filter(message) for filter in handler.filters]
+            for handler in self.handlers_for(update_type, state):
+                with self._filter_span(handler):
+                    filters = [filter(message) for filter in handler.filters]
 
                 if all(filters):
                     kwargs = utils.context_kwargs(
                         handler.call,
                         cursor=cursor,
                     )
-                    asyncio.create_task(
-                        handler.call(old_message, message, **kwargs)
-                    )
+                    self._spawn(handler.call(old_message, message, **kwargs))
 
             # handle logs
             bot_logger.debug(f'Message "{message.body.text}" edited')
 
         if update_type == "message_removed":
-            payload = MessageDeletePayload.from_json(update, self)
+            if self.cache is not None:
+                await self.cache.load(update.get("message_id"))
+
+            with self._span("parse"):
+                payload = MessageDeletePayload.from_json(update, self)
+
+            # the payload keeps the cached message for handlers
+            if self.cache is not None and payload.message_id is not None:
+                self.cache.remove_message(payload.message_id)
 
             if payload.user_id:
+                await self.storage.load(payload.user_id)
                 cursor = fsm.FSMCursor(self.storage, payload.user_id)
+                state = self.storage.get_state(payload.user_id)
             else:
                 cursor = None
+                state = ANY_STATE
 
             # handling
-            for handler in self.handlers[update_type]:
-                filters = [filter(payload) for filter in handler.filters]
+            for handler in self.handlers_for(update_type, state):
+                with self._filter_span(handler):
+                    filters = [filter(payload) for filter in handler.filters]
 
                 if all(filters):
                     kwargs = utils.context_kwargs(handler.call, cursor=cursor)
-                    asyncio.create_task(handler.call(payload, **kwargs))
+                    self._spawn(handler.call(payload, **kwargs))
 
             # handle logs
             bot_logger.debug(f'Message "{payload.content}" deleted')
 
         if update_type == "bot_started":
             payload = BotStartPayload.from_json(update, self)
+            handlers = self.handlers_for(update_type)
             cursor = fsm.FSMCursor(self.storage, payload.user.user_id)
+            if any(utils.accepts(i, "cursor") for i in handlers):
+                await self.storage.load(payload.user.user_id)
 
             bot_logger.debug(f'User "{payload.user!r}" started bot')
 
-            for i in self.handlers[update_type]:
+            for i in handlers:
                 kwargs = utils.context_kwargs(i, cursor=cursor)
-                asyncio.create_task(i(payload, **kwargs))
+                self._spawn(i(payload, **kwargs))
 
         if update_type == "chat_title_changed":
             payload = ChatTitleEditPayload.from_json(update)
+
+            if self.entity_cache is not None:
+                self.entity_cache.invalidate(("chat", payload.chat_id))
+            handlers = self.handlers_for(update_type)
             cursor = fsm.FSMCursor(self.storage, payload.user.user_id)
+            if any(utils.accepts(i, "cursor") for i in handlers):
+                await self.storage.load(payload.user.user_id)
 
             bot_logger.debug(
                 f'User "{payload.user!r} '
                 f"changed title of chat {payload.chat_id}"
             )
 
-            for i in self.handlers[update_type]:
+            for i in handlers:
                 kwargs = utils.context_kwargs(i, cursor=cursor)
-                asyncio.create_task(i(payload, **kwargs))
+                self._spawn(i(payload, **kwargs))
 
         if update_type == "bot_added" or update_type == "bot_removed":
             payload = ChatMembershipPayload.from_json(update)
+
+            if self.entity_cache is not None:
+                self.entity_cache.invalidate_chat(payload.chat_id)
+            handlers = self.handlers_for(update_type)
             cursor = fsm.FSMCursor(self.storage, payload.user.user_id)
+            if any(utils.accepts(i, "cursor") for i in handlers):
+                await self.storage.load(payload.user.user_id)
 
-            for i in self.handlers[update_type]:
+            for i in handlers:
                 kwargs = utils.context_kwargs(i, cursor=cursor)
-                asyncio.create_task(i(payload, **kwargs))
+                self._spawn(i(payload, **kwargs))
 
         if update_type == "user_added" or update_type == "user_removed":
             payload = UserMembershipPayload.from_json(update)
+
+            if self.entity_cache is not None:
+                self.entity_cache.invalidate_member(
+                    payload.chat_id, payload.user.user_id
+                )
+            handlers = self.handlers_for(update_type)
             cursor = fsm.FSMCursor(self.storage, payload.user.user_id)
+            if any(utils.accepts(i, "cursor") for i in handlers):
+                await self.storage.load(payload.user.user_id)
 
-            for i in self.handlers[update_type]:
+            for i in handlers:
                 kwargs = utils.context_kwargs(i, cursor=cursor)
-                asyncio.create_task(i(payload, **kwargs))
+                self._spawn(i(payload, **kwargs))
 
         if update_type == "message_callback":
             handled = False
 
-            callback = Callback.from_json(
-                update["callback"],
-                update.get("message"),
-                update.get("user_locale"),
-                self,
-            )
+            with self._span("parse"):
+                callback = Callback.from_json(
+                    update["callback"],
+                    update.get("message"),
+                    update.get("user_locale"),
+                    self,
+                )
 
+            await self.storage.load(callback.user.user_id)
             cursor = fsm.FSMCursor(self.storage, callback.user.user_id)
+            state = self.storage.get_state(callback.user.user_id)
 
-            for handler in self.handlers[update_type]:
-                filters = [filter(callback) for filter in handler.filters]
+            for handler in self.handlers_for(update_type, state):
+                with self._filter_span(handler):
+                    filters = [filter(callback) for filter in handler.filters]
 
                 if all(filters):
                     kwargs = utils.context_kwargs(handler.call, cursor=cursor)
-                    asyncio.create_task(handler.call(callback, **kwargs))
+                    self._spawn(handler.call(callback, **kwargs))
                     handled = True
 
             if handled:
@@ -984,8 +1595,8 @@ class Bot(Router):
             payload = ChatCreatePayload.from_json(update)
             bot_logger.debug(f'Created chat "{payload.start_payload}"')
 
-            for i in self.handlers[update_type]:
-                asyncio.create_task(i(payload))
+            for i in self.handlers_for(update_type):
+                self._spawn(i(payload))
 
     async def start_polling(
         self, session: "aiohttp.ClientSession | None" = None
@@ -993,68 +1604,132 @@ class Bot(Router):
         """
         Starts polling.
 
-        :param session: Custom aiohttp client session
+        :param session: Custom aiohttp client session. Not used if
+            `Bot.transport` is set
         """
         self.polling = True
 
-        conn = None
-
-        if self.use_certificate:
-            path = os.path.dirname(__file__) + "/russian_trusted_root_ca.cer"
-            ssl_context = ssl.create_default_context()
-            ssl_context.load_verify_locations(cafile=path)
-            conn = aiohttp.TCPConnector(ssl=ssl_context)
-
-        if not session:
-            session = aiohttp.ClientSession(
-                headers={"Authorization": self.access_token},
-                connector=conn,
-                base_url=self.api_url,
-            )
+        if self.loop_monitor is not None:
+            self.loop_monitor.start(self)
 
-        async with session:
-            self.session = session
+        try:
+            if self.transport is not None:
+                await self._poll()
+            else:
+                conn = None
 
-            # self info (this will cache the info automatically)
-            # also used to check the SSL certificate
-            try:
-                await self.get_me()
-
-            except ClientConnectorCertificateError as e:
-                raise exceptions.InvalidSSLException(
-                    "Invalid SSL certificate. A Mintsifra certificate is now "
-                    "required to connect to the Max servers. You can set "
-                    "`use_certificate=True` when creating your `Bot` "
-                    "instance to use the embedded certificate if you do not "
-                    "wish to install the certificate system-wide."
-                ) from e
-
-            bot_logger.info(
-                f"Started polling with bot "
-                f"@{self.username} ({self.id}) - {self.name}"
-            )
+                if self.use_certificate:
+                    path = (
+                        os.path.dirname(__file__)
+                        + "/russian_trusted_root_ca.cer"
+                    )
+                    ssl_context = ssl.create_default_context()
+                    ssl_context.load_verify_locations(cafile=path)
+                    conn = aiohttp.TCPConnector(ssl=ssl_context)
+
+                if not session:
+                    session = aiohttp.ClientSession(
+                        headers={"Authorization": self.access_token},
+                        connector=conn,
+                        base_url=self.api_url,
+                    )
 
-            # ready event
-            for i in self.handlers["on_ready"]:
-                asyncio.create_task(i())
+                async with session:
+                    self.session = session
+                    await self._poll()
 
-            while self.polling:
-                try:
-                    updates = await self.get_updates()
+        finally:
+            # also when polling fails or is cancelled, so that changes
+            # and the last marker are not lost
+            await self._shutdown()
 
-                    for update in updates["updates"]:
-                        await self.handle_update(update)
+    async def _shutdown(self):
+        """
+        Writes buffered data and stops the components started by polling.
+        """
+        if self.cache is not None:
+            await self.cache.close()
+        await self.storage.close()
 
-                except Exception as e:
-                    bot_logger.exception(e)
-                    await asyncio.sleep(3)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.tracer is not None:
+            self.tracer.flush()
+        if self.loop_monitor is not None:
+            await self.loop_monitor.stop()
+        if self.profiler.running:
+            await self.profiler.stop()
 
-                except asyncio.exceptions.CancelledError:
-                    break  # Python 3.9 throws an error when exit() is used
+        if self.marker_store is not None:
+            # markers of unfinished handlers are not saved
+            if self._checkpoint is not None and not self._checkpoint.done():
+                self._checkpoint.cancel()
+            await self.marker_store.close()
 
         self.session = None
+        self._session_transport = None
         self.polling = False
 
+    async def _poll(self):
+        """
+        Receives and handles updates until polling is stopped.
+        """
+        if self.marker_store is not None and self.marker is None:
+            self.marker = await self.marker_store.load()
+
+        # self info (this will cache the info automatically)
+        # also used to check the SSL certificate
+        try:
+            await self.get_me()
+
+        except ClientConnectorCertificateError as e:
+            raise exceptions.InvalidSSLException(
+                "Invalid SSL certificate. A Mintsifra certificate is now "
+                "required to connect to the Max servers. You can set "
+                "`use_certificate=True` when creating your `Bot` "
+                "instance to use the embedded certificate if you do not "
+                "wish to install the certificate system-wide."
+            ) from e
+
+        bot_logger.info(
+            f"Started polling with bot "
+            f"@{self.username} ({self.id}) - {self.name}"
+        )
+
+        # ready event
+        for i in self.handlers_for("on_ready"):
+            self._spawn(i())
+
+        while self.polling:
+            try:
+                span = NO_SPAN
+                if self.tracer is not None:
+                    span = self.tracer.trace("get_updates")
+
+                with span:
+                    updates = await self.get_updates()
+
+                self._batch = []
+                try:
+                    for update in updates["updates"]:
+                        await self.handle_update(update)
+                finally:
+                    batch, self._batch = self._batch, None
+
+                if (
+                    self.marker_store is not None
+                    and self.marker is not None
+                    and updates["updates"]
+                ):
+                    self._save_marker(self.marker, batch)
+
+            except Exception as e:
+                bot_logger.exception(e)
+                await asyncio.sleep(3)
+
+            except asyncio.exceptions.CancelledError:
+                break  # Python 3.9 throws an error when exit() is used
+
     def run(self, *args, **kwargs):
         """
         Shortcut for `asyncio.run(Bot.start_polling())`
@@ -1,31 +1,728 @@
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Literal
+
+from . import exceptions
 from .types import Message
 
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+MISSING = object()
+
+cache_logger = logging.getLogger("aiomax.cache")
+
+
+# approximate sizes of the objects a cached message consists of
+MESSAGE_SIZE = 3800
+ATTACHMENT_SIZE = 800
+MARKUP_SIZE = 600
+LINK_SIZE = 2500
+
+
+def message_size(message: Message) -> int:
+    """
+    Returns the approximate number of bytes a message takes in memory.
+
+    :param message: Message
+    """
+    size = MESSAGE_SIZE
+
+    if message.body is not None:
+        size += sys.getsizeof(message.body.text or "")
+        size += ATTACHMENT_SIZE * len(message.body.attachments or [])
+        size += MARKUP_SIZE * len(message.body.markup or [])
+
+    if message.link is not None:
+        size += LINK_SIZE
+
+    return size
+
 
 class MessageCache:
-    def __init__(self, max_size: int = 10000):
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl: "float | None" = None,
+        max_bytes: "int | None" = None,
+        compact: bool = False,
+        compression: "Literal['zlib', 'lz4'] | None" = None,
+        backend: "CacheBackend | None" = None,
+    ):
         """
-        New message cache.
+        New message cache. Least recently used messages are evicted first.
 
         :param max_size: Maximum number of messages to store
+        :param ttl: Seconds to keep a message for. None to keep messages
+            until they are evicted
+        :param max_bytes: Approximate maximum memory the cached messages
+            can take. None for no limit
+        :param compact: Whether to store messages as JSON bytes and
+            rebuild `Message` objects only when they are requested.
+            Uses several times less memory
+        :param compression: Compression of the stored JSON. Only used
+            with `compact`. `lz4` requires the lz4 package
+        :param backend: Persistent storage for messages, e.g.
+            `SQLiteCacheBackend`. The cache then acts as an in-memory
+            hot tier in front of it
         """
+        if compression not in (None, "zlib", "lz4"):
+            raise exceptions.AiomaxException(
+                f"Unsupported compression: {compression}"
+            )
+        if compression == "lz4" and lz4 is None:
+            raise exceptions.AiomaxException(
+                "lz4 compression requires the lz4 package"
+            )
+
         self.max_size: int = max_size
-        self.messages: dict[str, Message] = {}
+        self.ttl: "float | None" = ttl
+        self.max_bytes: "int | None" = max_bytes
+        self.compact: bool = compact
+        self.compression: "str | None" = compression
+        self.backend: "CacheBackend | None" = backend
+        self.bot = None  # Bot that rebuilt messages are attached to
+
+        # message id -> (message or its encoded JSON, expiration time,
+        # size, time added)
+        self.entries: OrderedDict[
+            str, tuple["Message | bytes", float, int, float]
+        ] = OrderedDict()
+        self.size_bytes: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.expirations: int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.entries
 
-    def get_message(self, id: str) -> "Message | None":
+    @property
+    def messages(self) -> dict[str, Message]:
+        """
+        Returns all cached messages, from least to most recently used.
+        """
+        return {k: self._decode(v[0]) for k, v in self.entries.items()}
+
+    def get_message(
+        self, id: str, max_age: "float | None" = None
+    ) -> "Message | None":
         """
         Returns a message by ID. None if message wasnt cached
 
+        :param id: Message ID
+        :param max_age: If specified, messages cached more than
+            this many seconds ago are treated as not cached
+        """
+        entry = self.entries.get(id)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        now = time.monotonic()
+
+        if entry[1] <= now:
+            self._remove(id)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        if max_age is not None and now - entry[3] > max_age:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(id)
+        self.hits += 1
+        return self._decode(entry[0])
+
+    async def load(self, id: str) -> bool:
+        """
+        Loads a message from the backend into memory if it is not
+        there yet. Returns whether the message is cached now.
+
         :param id: Message ID
         """
-        return self.messages.get(id, None)
+        entry = self.entries.get(id)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                return True
+
+            self._remove(id)
+            self.expirations += 1
+
+        if self.backend is None:
+            return False
+
+        data = await self.backend.get(id)
+        if data is None or id in self.entries:
+            return id in self.entries
 
-    def add_message(self, message: Message):
+        # the time it was stored at is unknown, so it is never fresh
+        self._insert(id, data, self.ttl, sys.getsizeof(data), -math.inf)
+        return True
+
+    def add_message(
+        self,
+        message: Message,
+        ttl: "float | None" = None,
+        *,
+        raw: "dict | None" = None,
+    ):
         """
         Caches a message.
 
         :param message: Message
+        :param ttl: Seconds to keep the message for.
+            `MessageCache.ttl` by default
+        :param raw: JSON the message was created from. Required to store
+            the message compactly
+        """
+        data = None
+        if raw is not None and (self.compact or self.backend is not None):
+            data = self._encode(raw, message.user_locale)
+
+        if self.compact and data is not None:
+            self._insert(message.id, data, ttl, sys.getsizeof(data))
+        else:
+            self._insert(message.id, message, ttl, message_size(message))
+
+        if self.backend is not None and data is not None:
+            self.backend.put(message.id, data)
+
+    def remove_message(self, id: str) -> "Message | None":
+        """
+        Removes a message from the cache and returns it.
+
+        :param id: Message ID
+        """
+        entry = self._remove(id)
+
+        if self.backend is not None:
+            self.backend.delete(id)
+
+        return self._decode(entry[0]) if entry else None
+
+    def clear(self):
+        """
+        Removes all messages from memory. Messages in the backend are kept.
+        """
+        self.entries.clear()
+        self.size_bytes = 0
+
+    async def close(self):
+        """
+        Writes pending messages to the backend and closes it.
+        """
+        if self.backend is not None:
+            await self.backend.close()
+
+    def stats(self) -> dict:
+        """
+        Returns cache statistics.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self.entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _insert(
+        self,
+        id: str,
+        value: "Message | bytes",
+        ttl: "float | None",
+        size: int,
+        added: "float | None" = None,
+    ):
+        now = time.monotonic()
+        ttl = ttl if ttl is not None else self.ttl
+        expires = now + ttl if ttl is not None else math.inf
+
+        if id in self.entries:
+            self._remove(id)
+
+        self.entries[id] = (
+            value,
+            expires,
+            size,
+            added if added is not None else now,
+        )
+        self.size_bytes += size
+
+        self._evict()
+
+    def _encode(self, raw: dict, user_locale: "str | None") -> bytes:
+        data = json.dumps(
+            [raw, user_locale], ensure_ascii=False, separators=(",", ":")
+        ).encode()
+
+        if self.compression == "zlib":
+            return zlib.compress(data)
+        if self.compression == "lz4":
+            return lz4.frame.compress(data)
+        return data
+
+    def _decode(self, value: "Message | bytes") -> Message:
+        if isinstance(value, Message):
+            return value
+
+        if self.compression == "zlib":
+            value = zlib.decompress(value)
+        elif self.compression == "lz4":
+            value = lz4.frame.decompress(value)
+
+        raw, user_locale = json.loads(value)
+        message = Message.from_json(raw)
+        message.bot = self.bot
+        message.user_locale = user_locale
+        return message
+
+    def _evict(self):
+        now = time.monotonic()
+
+        while self.entries:
+            id, entry = next(iter(self.entries.items()))
+            expires = entry[1]
+
+            if expires <= now:
+                self._remove(id)
+                self.expirations += 1
+            elif len(self.entries) > self.max_size or (
+                self.max_bytes is not None and self.size_bytes > self.max_bytes
+            ):
+                self._remove(id)
+                self.evictions += 1
+            else:
+                break
+
+    def _remove(self, id: str):
+        entry = self.entries.pop(id, None)
+
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+        return entry
+
+
+class CacheBackend:
+    """
+    Persistent storage behind `MessageCache`.
+
+    `put` and `delete` are called from the event loop and must not block,
+    so implementations are expected to buffer them and write in the
+    background. `get` must return messages that are still buffered.
+    """
+
+    async def get(self, id: str) -> "bytes | None":
+        """
+        Returns the stored message data. None if there is no such message
+        """
+        raise NotImplementedError
+
+    def put(self, id: str, data: bytes):
+        """
+        Stores message data
+        """
+        raise NotImplementedError
+
+    def delete(self, id: str):
+        """
+        Deletes message data
+        """
+        raise NotImplementedError
+
+    async def flush(self):
+        """
+        Writes all buffered changes
+        """
+
+    async def close(self):
+        """
+        Writes all buffered changes and releases resources
+        """
+        await self.flush()
+
+
+class SQLiteCacheBackend(CacheBackend):
+    def __init__(
+        self,
+        path: str,
+        max_size: "int | None" = 1000000,
+        max_age: "float | None" = 7 * 24 * 60 * 60,
+        flush_interval: float = 1,
+        batch_size: int = 1000,
+        mmap_size: int = 64 * 1024 * 1024,
+    ):
+        """
+        Stores cached messages in an SQLite database, so they survive
+        restarts. Writes are batched and done in a separate thread.
+
+        :param path: Database file path
+        :param max_size: Maximum number of messages to keep.
+            Oldest messages are deleted first. None for no limit
+        :param max_age: Seconds to keep messages for. None for no limit
+        :param flush_interval: Seconds to buffer writes for
+        :param batch_size: Number of buffered writes that triggers
+            a flush right away
+        :param mmap_size: Size of the memory-mapped part of the database
+        """
+        self.path: str = path
+        self.max_size: "int | None" = max_size
+        self.max_age: "float | None" = max_age
+        self.flush_interval: float = flush_interval
+        self.batch_size: int = batch_size
+
+        # message id -> (data, time added). None data means deletion
+        self.pending: dict[str, tuple["bytes | None", float]] = {}
+        self.flush_task: "asyncio.Task | None" = None
+        # set when the batch is full, to write it before the interval ends
+        self.full: "asyncio.Event | None" = None
+        self.last_prune: float = 0
+        self.mmap_size: int = mmap_size
+
+        self.lock = threading.Lock()
+        self.connection: "sqlite3.Connection | None" = None
+        with self.lock:
+            self._connect()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(path={self.path!r})"
+
+    async def get(self, id: str) -> "bytes | None":
+        if id in self.pending:
+            return self.pending[id][0]
+
+        return await asyncio.to_thread(self._read, id)
+
+    def put(self, id: str, data: bytes):
+        self.pending[id] = (data, time.time())
+        self._schedule()
+
+    def delete(self, id: str):
+        self.pending[id] = (None, time.time())
+        self._schedule()
+
+    async def flush(self):
+        if self.flush_task is not None and not self.flush_task.done():
+            self.full.set()
+            await self.flush_task
+
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        try:
+            await asyncio.to_thread(self._write, pending)
+        except Exception:
+            self._restore(pending)
+            raise
+
+    async def close(self):
+        """
+        Writes all buffered changes and closes the database.
+        It is opened again when the backend is used
+        """
+        await self.flush()
+
+        # bound to the current event loop, created again when used
+        self.full = None
+        self.flush_task = None
+
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _schedule(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # will be written on the next flush
+
+        if self.flush_task is None or self.flush_task.done():
+            # created with the task, so that it is bound to its loop
+            self.full = asyncio.Event()
+            self.flush_task = loop.create_task(self._flush_later())
+
+        if len(self.pending) >= self.batch_size:
+            self.full.set()
+
+    async def _flush_later(self):
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.full.wait(), self.flush_interval)
+        self.full.clear()
+
+        pending, self.pending = self.pending, {}
+        try:
+            await asyncio.to_thread(self._write, pending)
+        except Exception as e:
+            # retried on the next flush
+            self._restore(pending)
+            cache_logger.exception(e)
+
+        if self.pending:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    def _restore(self, pending: dict[str, tuple["bytes | None", float]]):
+        """
+        Puts back changes that failed to be written. Newer changes
+        of the same messages are kept
+        """
+        self.pending = {**pending, **self.pending}
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection, opening the database if it is closed.
+        Must be called with the lock held
+        """
+        if self.connection is not None:
+            return self.connection
+
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(id TEXT PRIMARY KEY, data BLOB NOT NULL, added REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS messages_added ON messages (added)"
+        )
+        connection.commit()
+
+        self.connection = connection
+        return connection
+
+    def _read(self, id: str) -> "bytes | None":
+        query = "SELECT data FROM messages WHERE id = ?"
+        args = [id]
+
+        if self.max_age is not None:
+            query += " AND added >= ?"
+            args.append(time.time() - self.max_age)
+
+        with self.lock:
+            row = self._connect().execute(query, args).fetchone()
+
+        return row[0] if row else None
+
+    def _write(self, pending: dict[str, tuple["bytes | None", float]]):
+        upserts = [(k, v[0], v[1]) for k, v in pending.items() if v[0]]
+        deletes = [(k,) for k, v in pending.items() if v[0] is None]
+
+        with self.lock:
+            connection = self._connect()
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO messages VALUES (?, ?, ?)",
+                    upserts,
+                )
+                connection.executemany(
+                    "DELETE FROM messages WHERE id = ?", deletes
+                )
+
+                if time.monotonic() - self.last_prune > 60:
+                    self._prune(connection)
+                    self.last_prune = time.monotonic()
+
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+
+    def _prune(self, connection: sqlite3.Connection):
+        if self.max_age is not None:
+            connection.execute(
+                "DELETE FROM messages WHERE added < ?",
+                (time.time() - self.max_age,),
+            )
+
+        if self.max_size is not None:
+            count = connection.execute(
+                "SELECT COUNT(*) FROM messages"
+            ).fetchone()[0]
+
+            if count > self.max_size:
+                connection.execute(
+                    "DELETE FROM messages WHERE id IN (SELECT id FROM "
+                    "messages ORDER BY added LIMIT ?)",
+                    (count - self.max_size,),
+                )
+
+
+class EntityCache:
+    def __init__(
+        self,
+        chat_ttl: float = 300,
+        admins_ttl: float = 60,
+        membership_ttl: float = 60,
+        negative_ttl: float = 10,
+        max_entries: int = 10000,
+    ):
+        """
+        Read-through cache for chats, admin lists and memberships.
+
+        Cached objects are shared between callers, so they should not be
+        modified.
+
+        :param chat_ttl: Seconds to keep chat info for
+        :param admins_ttl: Seconds to keep chat admin lists for
+        :param membership_ttl: Seconds to keep memberships for
+        :param negative_ttl: Seconds to remember that a chat
+            or a member was not found
+        :param max_entries: Maximum number of entries to store.
+            Least recently used entries are evicted first
+        """
+        self.ttls: dict[str, float] = {
+            "chat": chat_ttl,
+            "admins": admins_ttl,
+            "my_membership": membership_ttl,
+            "membership": membership_ttl,
+        }
+        self.negative_ttl: float = negative_ttl
+        self.max_entries: int = max_entries
+
+        # key -> (expiration time, value, whether the value is an exception)
+        self.entries: OrderedDict[tuple, tuple[float, Any, bool]] = (
+            OrderedDict()
+        )
+        self.chats: dict[int, set[tuple]] = {}  # chat id -> keys
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: tuple) -> Any:
+        """
+        Returns a cached value or `MISSING`. Raises the cached
+        exception if the entity was remembered as not found.
+
+        :param key: Entity key, e.g. `("chat", chat_id)`
+        """
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        expires, value, negative = entry
+
+        if expires <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return MISSING
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        if negative:
+            raise value.with_traceback(None)
+        return value
+
+    def set(self, key: tuple, value: Any, ttl: "float | None" = None):
+        """
+        Caches a value.
+
+        :param key: Entity key, e.g. `("chat", chat_id)`
+        :param value: Value to cache
+        :param ttl: Seconds to keep the value for. Defaults to the TTL
+            of the entity type
+        """
+        self._store(key, value, False, ttl)
+
+    def set_missing(self, key: tuple, exception: "Exception | None" = None):
+        """
+        Remembers that an entity was not found.
+
+        :param key: Entity key
+        :param exception: Exception to raise on lookups. If None,
+            lookups return None
+        """
+        if exception is None:
+            self._store(key, None, False, self.negative_ttl)
+        else:
+            self._store(key, exception, True, self.negative_ttl)
+
+    def invalidate(self, key: tuple):
+        """
+        Removes an entity from the cache.
+
+        :param key: Entity key
+        """
+        if key in self.entries:
+            self._remove(key)
+
+    def invalidate_chat(self, chat_id: int):
+        """
+        Removes everything cached about a chat.
+
+        :param chat_id: Chat ID
         """
-        self.messages[message.id] = message
+        for key in list(self.chats.get(chat_id, ())):
+            self._remove(key)
+
+    def invalidate_member(self, chat_id: int, user_id: int):
+        """
+        Removes a user's membership along with the chat info
+        and the admin list that depend on it.
+
+        :param chat_id: Chat ID
+        :param user_id: User ID
+        """
+        self.invalidate(("membership", chat_id, user_id))
+        self.invalidate(("admins", chat_id))
+        self.invalidate(("chat", chat_id))
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        self.entries.clear()
+        self.chats.clear()
+
+    def _store(self, key: tuple, value: Any, negative: bool, ttl):
+        if ttl is None:
+            ttl = self.ttls.get(key[0], self.negative_ttl)
+
+        self.entries[key] = (time.monotonic() + ttl, value, negative)
+        self.entries.move_to_end(key)
+        self.chats.setdefault(key[1], set()).add(key)
+
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key: tuple):
+        self.entries.pop(key, None)
 
-        while len(self.messages) > self.max_size:
-            (k := next(iter(self.messages)), self.messages.pop(k))
+        keys = self.chats.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.chats[key[1]]
@@ -0,0 +1,181 @@
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+
+def update_key(update: dict) -> "str | None":
+    """
+    Returns a key that is the same for all deliveries of an update.
+    None if the update cannot be identified
+
+    :param update: Raw update
+    """
+    update_type = update.get("update_type")
+
+    if update_type == "message_created":
+        return f"m:{update['message']['body']['mid']}"
+
+    if update_type == "message_edited":
+        # the same message can be edited multiple times
+        return (
+            f"e:{update['message']['body']['mid']}:{update.get('timestamp')}"
+        )
+
+    if update_type == "message_callback":
+        return f"c:{update['callback']['callback_id']}"
+
+    if update_type == "message_removed":
+        return f"r:{update.get('message_id')}"
+
+    if "timestamp" not in update:
+        return None
+
+    user = update.get("user") or {}
+    return (
+        f"{update_type}:{update['timestamp']}:"
+        f"{update.get('chat_id')}:{user.get('user_id')}"
+    )
+
+
+class Deduplicator:
+    """
+    Remembers recently handled updates to skip their second delivery.
+    """
+
+    def __init__(self):
+        self.checked: int = 0
+        self.duplicates: int = 0
+
+    def is_duplicate(self, update: dict) -> bool:
+        """
+        Returns whether the update was already seen and remembers it
+
+        :param update: Raw update
+        """
+        key = update_key(update)
+        if key is None:
+            return False
+
+        self.checked += 1
+        if self.check(key):
+            self.duplicates += 1
+            return True
+
+        return False
+
+    def check(self, key: str) -> bool:
+        """
+        Returns whether the key was already seen and remembers it
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """
+        Returns deduplication statistics
+        """
+        return {"checked": self.checked, "duplicates": self.duplicates}
+
+
+class WindowDeduplicator(Deduplicator):
+    def __init__(self, window: float = 600, max_size: int = 100000):
+        """
+        Exact deduplicator. Remembers update keys for `window` seconds.
+
+        :param window: Seconds to remember an update for
+        :param max_size: Maximum number of remembered updates.
+            Oldest updates are forgotten first
+        """
+        super().__init__()
+
+        self.window: float = window
+        self.max_size: int = max_size
+        self.seen: OrderedDict[str, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.seen)
+
+    def check(self, key: str) -> bool:
+        now = time.monotonic()
+
+        # keys are ordered by the time they were seen
+        while self.seen:
+            oldest, seen = next(iter(self.seen.items()))
+            if now - seen < self.window:
+                break
+            del self.seen[oldest]
+
+        if key in self.seen:
+            return True
+
+        self.seen[key] = now
+        if len(self.seen) > self.max_size:
+            self.seen.popitem(last=False)
+
+        return False
+
+
+class BloomDeduplicator(Deduplicator):
+    def __init__(
+        self,
+        capacity: int = 100000,
+        error_rate: float = 0.001,
+        window: float = 600,
+    ):
+        """
+        Probabilistic deduplicator with fixed memory usage. A new update
+        is skipped as a duplicate with probability of up to twice
+        the `error_rate`, since it is checked against both filters.
+
+        Keeps two Bloom filters and drops the older one when the newer
+        one is full or `window` seconds pass, so updates are remembered
+        for at least `window` seconds or `capacity` updates.
+
+        :param capacity: Number of updates per filter
+        :param error_rate: False positive probability of a filter
+        :param window: Seconds after which the filters are rotated
+        """
+        super().__init__()
+
+        self.capacity: int = capacity
+        self.error_rate: float = error_rate
+        self.window: float = window
+
+        self.bits: int = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )
+        self.hashes: int = max(1, round(self.bits / capacity * math.log(2)))
+
+        self.current: bytearray = bytearray((self.bits + 7) // 8)
+        self.previous: bytearray = bytearray((self.bits + 7) // 8)
+        self.count: int = 0
+        self.rotated: float = time.monotonic()
+
+    def check(self, key: str) -> bool:
+        now = time.monotonic()
+        if self.count >= self.capacity or now - self.rotated >= self.window:
+            self.previous = self.current
+            self.current = bytearray(len(self.previous))
+            self.count = 0
+            self.rotated = now
+
+        positions = self._positions(key)
+
+        if all(self.current[i >> 3] & (1 << (i & 7)) for i in positions):
+            return True
+
+        seen = all(self.previous[i >> 3] & (1 << (i & 7)) for i in positions)
+
+        for i in positions:
+            self.current[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+        return seen
+
+    def _positions(self, key: str) -> list[int]:
+        # double hashing: h1 + i * h2
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
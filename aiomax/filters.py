@@ -1,6 +1,8 @@
 import re
 from typing import Any
 
+ANY_STATE = object()  # state of handlers that do not filter by state
+
 
 def normalize_filter(filter_):
     if isinstance(filter_, str):
@@ -1,46 +1,339 @@
-from typing import Any
+import asyncio
+import copy
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, Callable
+
+fsm_logger = logging.getLogger("aiomax.fsm")
+
+
+class FSMBackend:
+    """
+    Persistent storage behind `FSMStorage`.
+
+    Implement this to keep states in a database or share them
+    between processes. All methods are called from the event loop,
+    so they must not block it.
+    """
+
+    async def load(self, user_id: int) -> "tuple[Any, Any] | None":
+        """
+        Returns user's state and data. None if the user is not stored
+        """
+        raise NotImplementedError
+
+    async def save(self, entries: dict[int, tuple[Any, Any]]):
+        """
+        Stores states and data of multiple users
+        """
+        raise NotImplementedError
+
+    async def delete(self, user_ids: list[int]):
+        """
+        Deletes states and data of multiple users
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """
+        Releases resources
+        """
+
+
+class SQLiteFSMBackend(FSMBackend):
+    def __init__(
+        self,
+        path: str,
+        dumps: Callable[[Any], bytes] = pickle.dumps,
+        loads: Callable[[bytes], Any] = pickle.loads,
+    ):
+        """
+        Stores states and data in an SQLite database.
+        Queries are run in a separate thread.
+
+        :param path: Database file path
+        :param dumps: Function that serializes states and data
+        :param loads: Function that deserializes states and data
+        """
+        self.path: str = path
+        self.dumps = dumps
+        self.loads = loads
+
+        self.lock = threading.Lock()
+        self.connection: "sqlite3.Connection | None" = None
+        with self.lock:
+            self._connect()
+
+    def __repr__(self):
+        return f"{type(self).__name__}(path={self.path!r})"
+
+    async def load(self, user_id: int) -> "tuple[Any, Any] | None":
+        row = await asyncio.to_thread(self._read, user_id)
+        if row is None:
+            return None
+
+        return tuple(self.loads(i) if i is not None else None for i in row)
+
+    async def save(self, entries: dict[int, tuple[Any, Any]]):
+        rows = [
+            (
+                user_id,
+                self.dumps(state) if state is not None else None,
+                self.dumps(data) if data is not None else None,
+            )
+            for user_id, (state, data) in entries.items()
+        ]
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO fsm VALUES (?, ?, ?)", rows
+        )
+
+    async def delete(self, user_ids: list[int]):
+        await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM fsm WHERE user_id = ?",
+            [(i,) for i in user_ids],
+        )
+
+    async def close(self):
+        """
+        Closes the database. It is opened again when the backend is used
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns the connection, opening the database if it is closed.
+        Must be called with the lock held
+        """
+        if self.connection is not None:
+            return self.connection
+
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm "
+            "(user_id INTEGER PRIMARY KEY, state BLOB, data BLOB)"
+        )
+        connection.commit()
+
+        self.connection = connection
+        return connection
+
+    def _read(self, user_id: int):
+        with self.lock:
+            connection = self._connect()
+            return connection.execute(
+                "SELECT state, data FROM fsm WHERE user_id = ?", (user_id,)
+            ).fetchone()
+
+    def _execute(self, query: str, rows: list[tuple]):
+        with self.lock:
+            connection = self._connect()
+            try:
+                connection.executemany(query, rows)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
 
 
 class FSMStorage:
-    def __init__(self):
+    def __init__(
+        self,
+        backend: "FSMBackend | None" = None,
+        flush_interval: float = 0.5,
+        cache_ttl: "float | None" = None,
+        ttl: "float | None" = None,
+        max_users: "int | None" = None,
+        sweep_interval: float = 1,
+        lock_stripes: int = 64,
+    ):
+        """
+        FSM storage. Keeps states and data in memory and, if a backend
+        is specified, writes changes to it in the background.
+
+        :param backend: Persistent storage, e.g. `SQLiteFSMBackend`.
+            None to keep everything in memory only
+        :param flush_interval: Seconds to collect changes for before
+            writing them to the backend
+        :param cache_ttl: Seconds after which a user's state is loaded from
+            the backend again. Set it when the backend is shared between
+            multiple processes. None to load each user once
+        :param ttl: Seconds after the last change or load from the backend
+            after which user's state and data are cleared.
+            None to keep them forever
+        :param max_users: Maximum number of users to keep in memory.
+            Least recently used users are removed first. With a backend
+            they are only removed from memory
+        :param sweep_interval: How often expired users are cleared, in
+            seconds
+        :param lock_stripes: Number of locks shared between users for
+            atomic transitions. Updates from different users only wait
+            for each other if their locks are the same
+        """
         self.states: dict[int, Any] = {}
         self.data: dict[int, Any] = {}
 
+        self.backend: "FSMBackend | None" = backend
+        self.flush_interval: float = flush_interval
+        self.cache_ttl: "float | None" = cache_ttl
+
+        self.loaded: dict[int, float] = {}  # user id -> time loaded
+        self.dirty: set[int] = set()
+        self.flush_task: "asyncio.Task | None" = None
+        self.writing: bool = False
+
+        self.ttl: "float | None" = ttl
+        self.max_users: "int | None" = max_users
+        self.sweep_interval: float = sweep_interval
+
+        # user id -> expiration time, and expiration tick -> user ids
+        self.expires: dict[int, float] = {}
+        self.wheel: dict[int, set[int]] = {}
+        # user id -> TTL given explicitly, used instead of `ttl` by
+        # later changes without one
+        self.ttls: dict[int, float] = {}
+        self.last_tick: int = int(time.monotonic() // sweep_interval)
+        self.sweep_task: "asyncio.Task | None" = None
+
+        self.recent: OrderedDict[int, None] = OrderedDict()
+
+        self.expired: int = 0
+        self.evicted: int = 0
+
+        self.lock_stripes: int = lock_stripes
+        self.locks: "list[asyncio.Lock] | None" = None
+
+    def __len__(self) -> int:
+        return len(self.states.keys() | self.data.keys())
+
+    async def load(self, user_id: int):
+        """
+        Loads user's state and data from the backend into memory.
+        Does nothing if they are already loaded or there is no backend
+        """
+        if self.backend is None or user_id in self.dirty:
+            return
+
+        loaded = self.loaded.get(user_id)
+        if loaded is not None and (
+            self.cache_ttl is None
+            or time.monotonic() - loaded < self.cache_ttl
+        ):
+            return
+
+        entry = await self.backend.load(user_id)
+        if user_id in self.dirty:
+            return  # changed while loading
+
+        state, data = entry if entry is not None else (None, None)
+        self._set(self.states, user_id, state)
+        self._set(self.data, user_id, data)
+        self.loaded[user_id] = time.monotonic()
+        # the time of the last change is not stored, so the TTL of
+        # loaded users starts when they are loaded
+        self._schedule(user_id, None)
+        self._touch(user_id)
+
+    def lock(self, user_id: int) -> asyncio.Lock:
+        """
+        Returns the lock that guards user's state and data.
+
+        The lock is not reentrant and may be shared with other users,
+        so do not acquire it twice or for another user while holding it
+        """
+        if self.locks is None:
+            # created lazily to bind to the running loop
+            self.locks = [asyncio.Lock() for _ in range(self.lock_stripes)]
+
+        return self.locks[hash(user_id) % self.lock_stripes]
+
+    async def flush(self):
+        """
+        Writes all changes to the backend
+        """
+        task = self.flush_task
+
+        if task is not None and not task.done():
+            if self.writing:
+                await task
+            else:
+                task.cancel()
+
+        await self._write()
+
+    async def close(self):
+        """
+        Writes all changes to the backend and closes it
+        """
+        if self.backend is None:
+            return
+
+        await self.flush()
+        await self.backend.close()
+
     def get_state(self, user_id: int) -> Any:
         """
         Gets user's state
         """
+        self._access(user_id)
         return self.states.get(user_id)
 
     def get_data(self, user_id: int) -> Any:
         """
         Gets user's data
         """
+        self._access(user_id)
         return self.data.get(user_id)
 
-    def change_state(self, user_id: int, new: Any):
+    def change_state(self, user_id: int, new: Any, ttl: "float | None" = None):
         """
         Changes user's state
+
+        :param ttl: Seconds after which user's state and data are cleared.
+            The TTL given to an earlier change of the user, or
+            `FSMStorage.ttl`, by default
         """
         self.states[user_id] = new
+        self._changed(user_id, ttl)
 
-    def change_data(self, user_id: int, new: Any):
+    def change_data(self, user_id: int, new: Any, ttl: "float | None" = None):
         """
         Changes user's data
+
+        :param ttl: Seconds after which user's state and data are cleared.
+            The TTL given to an earlier change of the user, or
+            `FSMStorage.ttl`, by default
         """
         self.data[user_id] = new
+        self._changed(user_id, ttl)
 
     def clear_state(self, user_id: int) -> Any:
         """
         Clears user's state and returns it
         """
-        return self.states.pop(user_id, None)
+        self._access(user_id)
+        state = self.states.pop(user_id, None)
+        self._changed(user_id)
+        return state
 
     def clear_data(self, user_id: int) -> Any:
         """
         Clears user's data and returns it
         """
-        return self.data.pop(user_id, None)
+        self._access(user_id)
+        data = self.data.pop(user_id, None)
+        self._changed(user_id)
+        return data
 
     def clear(self, user_id: int):
         """
@@ -48,6 +341,210 @@ class FSMStorage:
         """
         self.states.pop(user_id, None)
         self.data.pop(user_id, None)
+        self._changed(user_id)
+
+    def stats(self) -> dict:
+        """
+        Returns the number of stored states, data, and users removed
+        because of `ttl` and `max_users`
+        """
+        return {
+            "states": len(self.states),
+            "data": len(self.data),
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+    @staticmethod
+    def _set(storage: dict, user_id: int, value: Any):
+        if value is None:
+            storage.pop(user_id, None)
+        else:
+            storage[user_id] = value
+
+    def _access(self, user_id: int):
+        if self.expires:
+            expires = self.expires.get(user_id)
+
+            if expires is not None and expires <= time.monotonic():
+                self._expire(user_id)
+
+        if self.max_users is not None and user_id in self.recent:
+            self.recent.move_to_end(user_id)
+
+    def _touch(self, user_id: int):
+        if self.max_users is None:
+            return
+
+        if user_id not in self.states and user_id not in self.data:
+            self.recent.pop(user_id, None)
+            return
+
+        self.recent[user_id] = None
+        self.recent.move_to_end(user_id)
+
+        if len(self.recent) <= self.max_users:
+            return
+
+        excess = len(self.recent) - self.max_users
+        victims = []
+
+        for old in self.recent:
+            if len(victims) >= excess:
+                break
+            if old in self.dirty or old == user_id:
+                continue  # not written to the backend yet
+            victims.append(old)
+
+        for old in victims:
+            del self.recent[old]
+            self.states.pop(old, None)
+            self.data.pop(old, None)
+            self.loaded.pop(old, None)
+            self.ttls.pop(old, None)
+            self._unschedule(old)
+            self.evicted += 1
+
+    def _schedule(self, user_id: int, ttl: "float | None"):
+        if ttl is not None:
+            self.ttls[user_id] = ttl
+        else:
+            ttl = self.ttls.get(user_id, self.ttl)
+        self._unschedule(user_id)
+
+        if user_id not in self.states and user_id not in self.data:
+            self.ttls.pop(user_id, None)
+            return
+        if ttl is None:
+            return
+
+        expires = time.monotonic() + ttl
+        self.expires[user_id] = expires
+        self.wheel.setdefault(self._tick(expires), set()).add(user_id)
+
+        if self.sweep_task is None or self.sweep_task.done():
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return  # expired users are still cleared when accessed
+
+            self.sweep_task = loop.create_task(self._sweep())
+
+    def _unschedule(self, user_id: int):
+        expires = self.expires.pop(user_id, None)
+        if expires is None:
+            return
+
+        tick = self._tick(expires)
+        users = self.wheel.get(tick)
+
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self.wheel[tick]
+
+    def _tick(self, timestamp: float) -> int:
+        return int(timestamp // self.sweep_interval) + 1
+
+    def _expire(self, user_id: int):
+        self._unschedule(user_id)
+        self.states.pop(user_id, None)
+        self.data.pop(user_id, None)
+        self.recent.pop(user_id, None)
+        self.expired += 1
+        self._changed(user_id)
+
+    async def _sweep(self):
+        self.last_tick = self._tick(time.monotonic()) - 1
+
+        while self.expires:
+            await asyncio.sleep(self.sweep_interval)
+
+            now = self._tick(time.monotonic()) - 1
+
+            # only ticks that passed since the last sweep are checked
+            for tick in range(self.last_tick + 1, now + 1):
+                for user_id in self.wheel.pop(tick, ()):
+                    self.expires.pop(user_id, None)
+                    self.states.pop(user_id, None)
+                    self.data.pop(user_id, None)
+                    self.recent.pop(user_id, None)
+                    self.expired += 1
+                    self._changed(user_id)
+
+            self.last_tick = now
+
+    def _changed(self, user_id: int, ttl: "float | None" = None):
+        self._schedule(user_id, ttl)
+        self._touch(user_id)
+
+        if self.backend is None:
+            return
+
+        self.dirty.add(user_id)
+        self.loaded[user_id] = time.monotonic()
+
+        if self.flush_task is not None and not self.flush_task.done():
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # will be written on the next flush
+
+        self.flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+
+        try:
+            await self._write()
+        except Exception as e:
+            fsm_logger.exception(e)
+
+        if self.dirty:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _write(self):
+        if not self.dirty:
+            return
+
+        dirty, self.dirty = self.dirty, set()
+        self.writing = True
+        saved = {}
+        deleted = []
+
+        for user_id in dirty:
+            state = self.states.get(user_id)
+            data = self.data.get(user_id)
+
+            if state is None and data is None:
+                deleted.append(user_id)
+            else:
+                saved[user_id] = (state, data)
+
+        try:
+            if saved:
+                await self.backend.save(saved)
+            if deleted:
+                await self.backend.delete(deleted)
+
+        except BaseException:
+            self.dirty |= dirty  # retry on the next flush
+            raise
+
+        finally:
+            self.writing = False
+
+
+class FSMTransaction:
+    def __init__(self, state: Any, data: Any):
+        """
+        User's state and data inside `FSMCursor.transaction()`.
+        Change the attributes to change them in the storage
+        """
+        self.state: Any = state
+        self.data: Any = data
 
 
 class FSMCursor:
@@ -67,17 +564,25 @@ class FSMCursor:
         """
         return self.storage.get_data(self.user_id)
 
-    def change_state(self, new: Any):
+    def change_state(self, new: Any, ttl: "float | None" = None):
         """
         Changes user's state
+
+        :param ttl: Seconds after which user's state and data are cleared.
+            The TTL given to an earlier change of the user, or
+            `FSMStorage.ttl`, by default
         """
-        self.storage.change_state(self.user_id, new)
+        self.storage.change_state(self.user_id, new, ttl)
 
-    def change_data(self, new: Any):
+    def change_data(self, new: Any, ttl: "float | None" = None):
         """
         Changes user's data
+
+        :param ttl: Seconds after which user's state and data are cleared.
+            The TTL given to an earlier change of the user, or
+            `FSMStorage.ttl`, by default
         """
-        self.storage.change_data(self.user_id, new)
+        self.storage.change_data(self.user_id, new, ttl)
 
     def clear_state(self) -> Any:
         """
@@ -96,3 +601,64 @@ class FSMCursor:
         Clears user's state and data
         """
         self.storage.clear(self.user_id)
+
+    async def compare_and_set_state(
+        self, expected: Any, new: Any, ttl: "float | None" = None
+    ) -> bool:
+        """
+        Changes user's state only if it is equal to `expected`.
+        Returns whether the state was changed
+
+        :param ttl: Seconds after which user's state and data are cleared.
+            The TTL given to an earlier change of the user, or
+            `FSMStorage.ttl`, by default
+        """
+        async with self.storage.lock(self.user_id):
+            await self.storage.load(self.user_id)
+
+            if self.storage.get_state(self.user_id) != expected:
+                return False
+
+            self.storage.change_state(self.user_id, new, ttl)
+            return True
+
+    @asynccontextmanager
+    async def transaction(self, ttl: "float | None" = None):
+        """
+        Locks user's state and data and yields them as `FSMTransaction`.
+        Changes are saved when the block exits without an exception,
+        nothing is written if the state and data did not change.
+        Setting them to None clears them. The data is a copy, so changes
+        made to it in place are discarded when the block raises.
+
+        Other transactions of this user wait until the block exits
+
+        :param ttl: Seconds after which user's state and data are cleared.
+            The TTL given to an earlier change of the user, or
+            `FSMStorage.ttl`, by default
+        """
+        async with self.storage.lock(self.user_id):
+            await self.storage.load(self.user_id)
+
+            state = self.storage.get_state(self.user_id)
+            data = self.storage.get_data(self.user_id)
+
+            # the block gets a copy, so that changes made to the data
+            # in place are discarded if it raises
+            transaction = FSMTransaction(state, copy.deepcopy(data))
+            yield transaction
+
+            changed = False
+            if transaction.state != state:
+                self.storage._set(
+                    self.storage.states, self.user_id, transaction.state
+                )
+                changed = True
+            if transaction.data != data:
+                self.storage._set(
+                    self.storage.data, self.user_id, transaction.data
+                )
+                changed = True
+
+            if changed:
+                self.storage._changed(self.user_id, ttl)
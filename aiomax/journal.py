@@ -0,0 +1,176 @@
+import asyncio
+import gzip
+import json
+import mmap
+import os
+import time
+from collections.abc import Iterator
+from typing import TYPE_CHECKING
+
+from .utils import percentile
+
+if TYPE_CHECKING:
+    from .bot import Bot
+
+
+def read_journal(path: str) -> Iterator[dict]:
+    """
+    Yields updates from a journal one by one without loading
+    the whole journal into memory
+
+    :param path: Path to a journal written by `UpdateRecorder`
+    """
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+
+        if compressed:
+            f.seek(0)
+            with gzip.open(f) as lines:
+                try:
+                    for line in lines:
+                        if line.strip():
+                            yield json.loads(line)
+                except EOFError:
+                    # the journal was not closed, updates up to the last
+                    # flush are read
+                    pass
+            return
+
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                if line.strip():
+                    yield json.loads(line)
+
+
+class UpdateRecorder:
+    def __init__(self, path: str, compress: bool = False):
+        """
+        Appends raw updates to a journal, one JSON object per line.
+
+        :param path: Path to the journal
+        :param compress: Whether to compress the journal with gzip
+        """
+        self.path: str = path
+        self.compress: bool = compress
+        # kept open until the recorder is closed
+        self.file = None
+        self.recorded: int = 0
+
+    def record(self, update: dict):
+        """
+        Appends an update to the journal. Opens it again if it was closed
+        """
+        if self.file is None:
+            # a closed gzip journal is appended to as a new member
+            self.file = (
+                gzip.open(self.path, "ab")  # noqa: SIM115
+                if self.compress
+                else open(self.path, "ab")  # noqa: SIM115
+            )
+
+        self.file.write(
+            json.dumps(
+                update, ensure_ascii=False, separators=(",", ":")
+            ).encode()
+            + b"\n"
+        )
+        self.recorded += 1
+
+    def flush(self):
+        """
+        Writes buffered updates to the file
+        """
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        """
+        Writes buffered updates and closes the journal.
+        A gzip journal is only complete when it is closed
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class UpdateReplayer:
+    def __init__(self, bot: "Bot", path: str, speed: "float | None" = 1.0):
+        """
+        Feeds updates from a journal into `Bot.handle_update`.
+
+        :param bot: Bot that handles the updates
+        :param path: Path to a journal written by `UpdateRecorder`
+        :param speed: Replay speed relative to the recorded one,
+            according to update timestamps. None to replay
+            as fast as possible
+        """
+        self.bot: "Bot" = bot
+        self.path: str = path
+        self.speed: "float | None" = speed
+
+    async def replay(self) -> dict:
+        """
+        Replays the journal and waits for all handlers to complete.
+
+        Returns the number of updates, their throughput per second and
+        percentiles of latency in milliseconds from the start of handling
+        an update to the completion of all its handlers
+        """
+        latencies = []
+        pending = set()
+        first_timestamp = None
+        count = 0
+        start = time.perf_counter()
+
+        for update in read_journal(self.path):
+            timestamp = update.get("timestamp")
+
+            if self.speed is not None and timestamp is not None:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+
+                delay = (timestamp - first_timestamp) / 1000 / self.speed
+                delay -= time.perf_counter() - start
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            handled = time.perf_counter()
+            self.bot._batch = []
+            try:
+                await self.bot.handle_update(update)
+            finally:
+                tasks, self.bot._batch = self.bot._batch, None
+            count += 1
+
+            if tasks:
+                waiter = asyncio.ensure_future(asyncio.wait(tasks))
+                waiter.add_done_callback(
+                    lambda _, handled=handled: latencies.append(
+                        time.perf_counter() - handled
+                    )
+                )
+                pending.add(waiter)
+                waiter.add_done_callback(pending.discard)
+            else:
+                latencies.append(time.perf_counter() - handled)
+
+            # let handlers run between updates
+            await asyncio.sleep(0)
+
+        if pending:
+            await asyncio.wait(pending)
+
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+
+        return {
+            "updates": count,
+            "seconds": elapsed,
+            "updates_per_second": count / elapsed if elapsed else 0.0,
+            "latency_ms": {
+                f"p{q}": percentile(latencies, q) * 1000 for q in (50, 90, 99)
+            },
+        }
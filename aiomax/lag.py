@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable
+
+from .utils import percentile
+
+lag_logger = logging.getLogger("aiomax.lag")
+
+
+class LagTracker:
+    def __init__(
+        self,
+        window: int = 1000,
+        threshold: "float | None" = None,
+        callback: "Callable[[bool, float], Any] | None" = None,
+    ):
+        """
+        Tracks how far the bot is behind: the age of updates when they
+        are dispatched (dispatch time minus the server timestamp) and the
+        time from dispatch until their handlers complete.
+
+        The server and the bot clocks must be synchronized for the age
+        to be accurate.
+
+        :param window: Number of latest values percentiles are computed of
+        :param threshold: Update age in seconds above which the bot is
+            considered lagging. None to only collect statistics
+        :param callback: Function that is called with True and the age of
+            the update when the bot starts lagging, and with False when
+            the age drops below half of the threshold.
+            Coroutine functions are run in a task
+        """
+        self.update_age: deque[float] = deque(maxlen=window)
+        self.handler_latency: deque[float] = deque(maxlen=window)
+        self.end_to_end: deque[float] = deque(maxlen=window)
+
+        self.threshold: "float | None" = threshold
+        self.callback: "Callable[[bool, float], Any] | None" = callback
+        self.lagging: bool = False
+        # running coroutine callbacks, referenced so they are not
+        # garbage collected
+        self.tasks: set[asyncio.Task] = set()
+
+    def record_update(self, timestamp: "float | None") -> "float | None":
+        """
+        Records the age of an update being dispatched. Returns the age
+
+        :param timestamp: Server timestamp of the update in milliseconds
+        """
+        if not timestamp:
+            return None
+
+        age = time.time() - timestamp / 1000
+        self.update_age.append(age)
+
+        if self.threshold is not None:
+            if not self.lagging and age > self.threshold:
+                self._set_lagging(True, age)
+            # hysteresis, so that the callback is not called on every update
+            elif self.lagging and age < self.threshold / 2:
+                self._set_lagging(False, age)
+
+        return age
+
+    def record_handler(self, latency: float, timestamp: "float | None"):
+        """
+        Records a completed handler
+
+        :param latency: Seconds from dispatch until the handler completed
+        :param timestamp: Server timestamp of its update in milliseconds
+        """
+        self.handler_latency.append(latency)
+        if timestamp:
+            self.end_to_end.append(time.time() - timestamp / 1000)
+
+    def _set_lagging(self, lagging: bool, age: float):
+        self.lagging = lagging
+
+        if lagging:
+            lag_logger.warning(f"Updates are dispatched {age:.2f}s late")
+        else:
+            lag_logger.info("Caught up with updates")
+
+        if self.callback is None:
+            return
+
+        try:
+            result = self.callback(lagging, age)
+            if asyncio.iscoroutine(result):
+                task = asyncio.get_running_loop().create_task(result)
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+        except Exception as e:
+            lag_logger.exception(e)
+
+    def percentiles(
+        self, qs: tuple = (50, 90, 99)
+    ) -> "dict[str, dict[str, float]]":
+        """
+        Returns percentiles of the update age, handler latency and
+        end-to-end latency (server timestamp until handler completion)
+        in seconds
+
+        :param qs: Percentiles from 0 to 100
+        """
+        result = {}
+
+        for name in ("update_age", "handler_latency", "end_to_end"):
+            values = sorted(getattr(self, name))
+            result[name] = {f"p{q}": percentile(values, q) for q in qs}
+
+        return result
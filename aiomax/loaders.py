@@ -0,0 +1,115 @@
+import asyncio
+from collections.abc import Awaitable
+from typing import Callable
+
+from .types import User
+
+
+class MembershipLoader:
+    def __init__(
+        self,
+        fetch: Callable[[int, list[int]], Awaitable[list[User]]],
+        delay: float = 0,
+        max_batch_size: int = 100,
+    ):
+        """
+        Merges membership lookups made by concurrent handlers into
+        one request per chat.
+
+        :param fetch: Coroutine function that requests memberships
+            of the users in the chat, e.g. `Bot._fetch_memberships`
+        :param delay: Seconds to wait for more lookups before sending
+            the request. With 0, lookups made in the same event loop
+            iteration are merged
+        :param max_batch_size: Maximum number of users per request
+        """
+        self.fetch = fetch
+        self.delay: float = delay
+        self.max_batch_size: int = max_batch_size
+
+        # chat id -> user id -> futures waiting for the membership
+        self.pending: dict[int, dict[int, list[asyncio.Future]]] = {}
+        # running requests, referenced so they are not garbage collected
+        self.tasks: set[asyncio.Task] = set()
+
+        self.loads: int = 0
+        self.requests: int = 0
+
+    async def load(self, chat_id: int, user_id: int) -> "User | None":
+        """
+        Returns the user's membership in the chat, or None
+        if the user is not in the chat.
+
+        :param chat_id: Chat ID
+        :param user_id: User ID
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        batch = self.pending.get(chat_id)
+        if batch is None:
+            batch = self.pending[chat_id] = {}
+
+            if self.delay > 0:
+                loop.call_later(self.delay, self._dispatch, chat_id)
+            else:
+                loop.call_soon(self._dispatch, chat_id)
+
+        batch.setdefault(user_id, []).append(future)
+        self.loads += 1
+
+        return await future
+
+    async def load_many(
+        self, chat_id: int, user_ids: list[int]
+    ) -> "list[User | None]":
+        """
+        Returns memberships of the users in the chat in the same order.
+        None for users that are not in the chat.
+
+        :param chat_id: Chat ID
+        :param user_ids: User IDs
+        """
+        return list(
+            await asyncio.gather(*(self.load(chat_id, i) for i in user_ids))
+        )
+
+    def _dispatch(self, chat_id: int):
+        batch = self.pending.pop(chat_id, None)
+        if not batch:
+            return
+
+        user_ids = list(batch)
+
+        for i in range(0, len(user_ids), self.max_batch_size):
+            chunk = {
+                user_id: batch[user_id]
+                for user_id in user_ids[i : i + self.max_batch_size]
+            }
+            task = asyncio.create_task(self._run(chat_id, chunk))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, chat_id: int, chunk: dict[int, list[asyncio.Future]]):
+        """
+        Requests one chunk of a batch. A failed request fails only
+        the lookups of its chunk
+        """
+        self.requests += 1
+
+        try:
+            users = await self.fetch(chat_id, list(chunk))
+
+        except Exception as e:
+            for futures in chunk.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        users = {user.user_id: user for user in users}
+
+        for user_id, futures in chunk.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(users.get(user_id))
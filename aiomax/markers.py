@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import os
+
+markers_logger = logging.getLogger("aiomax.markers")
+
+
+class MarkerStore:
+    """
+    Storage for the polling marker, so that the bot continues
+    from the same updates after a restart.
+
+    All methods are called from the event loop,
+    so they must not block it.
+    """
+
+    async def load(self) -> "int | None":
+        """
+        Returns the saved marker. None if there is no marker
+        """
+        raise NotImplementedError
+
+    async def save(self, marker: int):
+        """
+        Saves the marker
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """
+        Writes the last saved marker and releases resources
+        """
+
+
+class FileMarkerStore(MarkerStore):
+    def __init__(self, path: str, fsync_interval: float = 1):
+        """
+        Keeps the marker in a file. The file is replaced atomically,
+        so it always contains a whole marker.
+
+        :param path: Path to the file
+        :param fsync_interval: Seconds to collect markers for before
+            writing the last one to the disk. 0 to write every marker
+        """
+        self.path: str = path
+        self.fsync_interval: float = fsync_interval
+
+        self.marker: "int | None" = None
+        self.written: "int | None" = None
+        self.write_task: "asyncio.Task | None" = None
+        self.writing: bool = False
+
+    async def load(self) -> "int | None":
+        def read():
+            try:
+                with open(self.path) as f:
+                    text = f.read().strip()
+            except FileNotFoundError:
+                return None
+
+            return int(text) if text else None
+
+        self.marker = self.written = await asyncio.to_thread(read)
+        return self.marker
+
+    async def save(self, marker: int):
+        self.marker = marker
+
+        if self.fsync_interval <= 0:
+            await self._write()
+            return
+
+        if self.write_task is None or self.write_task.done():
+            self.write_task = asyncio.get_running_loop().create_task(
+                self._write_later()
+            )
+
+    async def close(self):
+        task = self.write_task
+        if task is not None and not task.done() and self.writing:
+            await task
+
+        # the write may have scheduled the next one
+        task = self.write_task
+        if task is not None and not task.done():
+            task.cancel()
+
+        await self._write()
+
+    async def _write_later(self):
+        await asyncio.sleep(self.fsync_interval)
+
+        self.writing = True
+        try:
+            await self._write()
+        except Exception as e:
+            markers_logger.exception(e)
+        finally:
+            self.writing = False
+
+        # saved while writing, or the write failed
+        if self.marker != self.written:
+            self.write_task = asyncio.get_running_loop().create_task(
+                self._write_later()
+            )
+
+    async def _write(self):
+        marker = self.marker
+        if marker is None or marker == self.written:
+            return
+
+        def write():
+            tmp = f"{self.path}.tmp"
+
+            with open(tmp, "w") as f:
+                f.write(str(marker))
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(tmp, self.path)
+
+        await asyncio.to_thread(write)
+        self.written = marker
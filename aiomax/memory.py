@@ -0,0 +1,222 @@
+import asyncio
+import sys
+import tracemalloc
+from itertools import islice
+from types import (
+    BuiltinFunctionType,
+    FunctionType,
+    MethodType,
+    ModuleType,
+)
+from typing import TYPE_CHECKING, Any
+
+from .router import Router
+
+if TYPE_CHECKING:
+    from .bot import Bot
+
+# objects shared by everything, their size is not counted
+SHARED_TYPES = (
+    type,
+    ModuleType,
+    FunctionType,
+    MethodType,
+    BuiltinFunctionType,
+    Router,
+    asyncio.AbstractEventLoop,
+)
+
+
+def deep_size(
+    obj: Any, limit: int = 100000, seen: "set[int] | None" = None
+) -> int:
+    """
+    Returns the approximate number of bytes an object and all objects
+    it references take in memory. Bots, routers, functions, classes
+    and modules are not counted
+
+    :param obj: Object
+    :param limit: Maximum number of objects to visit
+    :param seen: IDs of objects that are already counted. Objects
+        visited are added to it
+    """
+    if seen is None:
+        seen = set()
+    stack = [obj]
+    size = 0
+    visited = 0
+
+    while stack and visited < limit:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+            continue
+        seen.add(id(obj))
+        visited += 1
+
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, bytearray, int, float)):
+            continue
+
+        if hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+
+    return size
+
+
+def sampled_size(items: dict, sample: int = 1000) -> int:
+    """
+    Returns the approximate number of bytes the items of a dict take.
+    Only the first `sample` items are measured in large dicts
+
+    :param items: Dict
+    :param sample: Number of items to measure
+    """
+    if not items:
+        return sys.getsizeof(items)
+
+    measured = list(islice(items.items(), sample))
+    size = deep_size(measured) - sys.getsizeof(measured)
+
+    return sys.getsizeof(items) + size * len(items) // len(measured)
+
+
+def _task_size(task: asyncio.Task, seen: "set[int]") -> int:
+    size = sys.getsizeof(task)
+
+    coro = task.get_coro()
+    frame = getattr(coro, "cr_frame", None)
+    if frame is not None:
+        size += sys.getsizeof(coro) + deep_size(frame.f_locals, 1000, seen)
+
+    return size
+
+
+def memory_report(bot: "Bot") -> "dict[str, dict[str, int]]":
+    """
+    Returns approximate memory used by the bot: number of objects and
+    bytes of the message cache, entity cache, FSM storage, deduplicator,
+    running handler tasks and files being uploaded.
+    Components that are disabled are not included
+
+    :param bot: Bot
+    """
+    report = {}
+
+    if bot.cache is not None:
+        report["message_cache"] = {
+            "objects": len(bot.cache),
+            "bytes": bot.cache.size_bytes,
+        }
+
+    if bot.entity_cache is not None:
+        report["entity_cache"] = {
+            "objects": len(bot.entity_cache.entries),
+            "bytes": sampled_size(bot.entity_cache.entries)
+            + deep_size(bot.entity_cache.chats),
+        }
+
+    storage = bot.storage
+    report["fsm"] = {
+        "objects": len(storage),
+        "states": len(storage.states),
+        "data": len(storage.data),
+        "bytes": sampled_size(storage.states)
+        + sampled_size(storage.data)
+        + sys.getsizeof(storage.loaded)
+        + sys.getsizeof(storage.expires)
+        + sys.getsizeof(storage.ttls)
+        + sys.getsizeof(storage.recent)
+        + sum(sys.getsizeof(i) for i in storage.wheel.values()),
+    }
+
+    if bot.dedupe is not None:
+        seen = getattr(bot.dedupe, "seen", None)
+        report["dedupe"] = (
+            {"objects": len(seen), "bytes": sampled_size(seen)}
+            if seen is not None
+            else {
+                "objects": getattr(bot.dedupe, "count", 0),
+                "bytes": deep_size(bot.dedupe),
+            }
+        )
+
+    # objects referenced by handlers, e.g. cached messages and FSM
+    # cursors, are counted in their components
+    seen = {
+        id(i)
+        for i in (bot.cache, bot.entity_cache, bot.storage, bot.dedupe)
+        if i is not None
+    }
+    if bot.cache is not None:
+        seen.update(id(entry[0]) for entry in bot.cache.entries.values())
+
+    report["tasks"] = {
+        "objects": len(bot.tasks),
+        "bytes": sum(_task_size(i, seen) for i in list(bot.tasks)),
+    }
+
+    report["uploads"] = {
+        "objects": bot.uploads_in_flight,
+        "bytes": bot.upload_bytes_in_flight,
+    }
+
+    return report
+
+
+def take_snapshot(frames: int = 1) -> tracemalloc.Snapshot:
+    """
+    Takes a tracemalloc snapshot to compare with `snapshot_diff`.
+    Starts tracing memory allocations if it is not started, so only
+    allocations made after the first call are seen. Tracing slows
+    the bot down, stop it with `tracemalloc.stop()`
+
+    :param frames: Number of frames to store for each allocation
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+    return tracemalloc.take_snapshot().filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+    )
+
+
+def snapshot_diff(
+    before: tracemalloc.Snapshot,
+    after: tracemalloc.Snapshot,
+    limit: int = 10,
+    key_type: str = "lineno",
+) -> "list[dict]":
+    """
+    Returns the places where memory usage grew the most between two
+    snapshots
+
+    :param before: Earlier snapshot
+    :param after: Later snapshot
+    :param limit: Number of places to return
+    :param key_type: "lineno", "filename" or "traceback"
+    """
+    stats = after.compare_to(before, key_type)
+
+    return [
+        {
+            "location": str(stat.traceback),
+            "size_diff": stat.size_diff,
+            "size": stat.size,
+            "count_diff": stat.count_diff,
+            "count": stat.count,
+        }
+        for stat in stats[:limit]
+    ]
@@ -0,0 +1,457 @@
+import bisect
+from typing import TYPE_CHECKING, Callable
+
+from .memory import memory_report
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+    from .bot import Bot
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)  # fmt: skip
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _call(callback: Callable) -> dict:
+    """
+    Returns values that a callback of a metric returned, by label values
+    """
+    result = callback()
+    if not isinstance(result, dict):
+        return {(): result}
+
+    return {k if isinstance(k, tuple) else (k,): v for k, v in result.items()}
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type: str = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        """
+        :param name: Metric name
+        :param help: Description of the metric
+        :param labels: Names of the labels
+        """
+        self.name: str = name
+        self.help: str = help
+        self.labels: tuple = tuple(labels)
+
+    def render(self) -> list[str]:
+        """
+        Returns lines of the metric in Prometheus text format
+        """
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        callback: "Callable | None" = None,
+    ):
+        """
+        Value that only increases, e.g. the number of requests
+
+        :param callback: Function that returns the value, or a dict of
+            label values to values, when metrics are rendered. For values
+            counted elsewhere, e.g. cache hits
+        """
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        self.callback: "Callable | None" = callback
+
+    def inc(self, *labels, amount: float = 1):
+        """
+        Increases the value with the given label values
+        """
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        """
+        Returns the value with the given label values
+        """
+        return self.values.get(labels, 0)
+
+    def samples(self) -> list[str]:
+        values = self.values
+        if self.callback is not None:
+            values = _call(self.callback)
+
+        return [
+            f"{self.name}{_labels(self.labels, k)} {_number(v)}"
+            for k, v in values.items()
+            if v is not None
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        """
+        Distribution of observed values, e.g. request latency
+
+        :param buckets: Upper bounds of the buckets
+        """
+        super().__init__(name, help, labels)
+        self.buckets: tuple = tuple(sorted(buckets))
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, *labels):
+        """
+        Adds a value with the given label values
+        """
+        counts = self.counts.get(labels)
+        if counts is None:
+            # the last bucket is +Inf
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        names = (*self.labels, "le")
+
+        for labels, counts in self.counts.items():
+            total = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                total += count
+                lines.append(
+                    f"{self.name}_bucket"
+                    f"{_labels(names, (*labels, _number(bound)))} {total}"
+                )
+
+            suffix = _labels(self.labels, labels)
+            lines.append(
+                f"{self.name}_sum{suffix} {_number(self.sums[labels])}"
+            )
+            lines.append(f"{self.name}_count{suffix} {total}")
+
+        return lines
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        callback: "Callable | None" = None,
+    ):
+        """
+        Value that can go up and down, e.g. the number of running tasks
+
+        :param callback: Function that returns the value, or a dict of
+            label values to values, when metrics are rendered
+        """
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        self.callback: "Callable | None" = callback
+
+    def set(self, value: float, *labels):
+        """
+        Sets the value with the given label values
+        """
+        self.values[labels] = value
+
+    def samples(self) -> list[str]:
+        values = self.values
+        if self.callback is not None:
+            values = _call(self.callback)
+
+        return [
+            f"{self.name}{_labels(self.labels, k)} {_number(v)}"
+            for k, v in values.items()
+            if v is not None
+        ]
+
+
+class Metrics:
+    def __init__(self, prefix: str = "aiomax"):
+        """
+        Registry of bot metrics. Pass it to `Bot` to collect them.
+
+        :param prefix: Prefix of metric names
+        """
+        self.prefix: str = prefix
+        self.metrics: dict[str, Metric] = {}
+        self.runner: "web.AppRunner | None" = None
+        # number of renders, so that callbacks can share a value
+        # within one scrape
+        self.renders: int = 0
+
+        self.updates = self.counter(
+            "updates_total", "Updates received", ("type",)
+        )
+        self.duplicates = self.counter(
+            "updates_duplicate_total", "Duplicate updates skipped", ("type",)
+        )
+        self.dispatch_latency = self.histogram(
+            "dispatch_seconds",
+            "Time to dispatch an update to its handlers",
+            ("type",),
+        )
+        self.handlers_dispatched = self.counter(
+            "handlers_dispatched_total", "Handler tasks started", ("handler",)
+        )
+        self.handlers_failed = self.counter(
+            "handlers_failed_total",
+            "Handler tasks that raised an exception",
+            ("handler",),
+        )
+        self.api_requests = self.counter(
+            "api_requests_total",
+            "API requests by endpoint and response status",
+            ("method", "endpoint", "status"),
+        )
+        self.api_latency = self.histogram(
+            "api_request_seconds",
+            "API request latency",
+            ("method", "endpoint"),
+        )
+        self.upload_bytes = self.counter(
+            "upload_bytes_total", "Bytes uploaded", ("type",)
+        )
+        self.loop_lag = self.histogram(
+            "loop_lag_seconds", "How late the event loop runs callbacks"
+        )
+        self.loop_stalls = self.counter(
+            "loop_stalls_total",
+            "Times the event loop was blocked, by the handler blocking it",
+            ("handler",),
+        )
+
+    def counter(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        callback: "Callable | None" = None,
+    ) -> Counter:
+        """
+        Registers a counter
+        """
+        return self.register(
+            Counter(f"{self.prefix}_{name}", help, labels, callback)
+        )
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """
+        Registers a histogram
+        """
+        return self.register(
+            Histogram(f"{self.prefix}_{name}", help, labels, buckets)
+        )
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labels: tuple = (),
+        callback: "Callable | None" = None,
+    ) -> Gauge:
+        """
+        Registers a gauge
+        """
+        return self.register(
+            Gauge(f"{self.prefix}_{name}", help, labels, callback)
+        )
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Registers a metric
+        """
+        self.metrics[metric.name] = metric
+        return metric
+
+    def bind(self, bot: "Bot"):
+        """
+        Registers gauges that read the state of the bot
+        """
+
+        def cache_stats(name: str) -> Callable:
+            def callback():
+                values = {}
+                if bot.cache is not None:
+                    values["message"] = getattr(bot.cache, name)
+                if bot.entity_cache is not None:
+                    values["entity"] = getattr(bot.entity_cache, name)
+                return values
+
+            return callback
+
+        self.counter(
+            "cache_hits_total", "Cache hits", ("cache",), cache_stats("hits")
+        )
+        self.counter(
+            "cache_misses_total",
+            "Cache misses",
+            ("cache",),
+            cache_stats("misses"),
+        )
+        self.gauge(
+            "cache_entries",
+            "Entries in caches",
+            ("cache",),
+            lambda: {
+                "message": len(bot.cache) if bot.cache is not None else None,
+                "entity": (
+                    len(bot.entity_cache.entries)
+                    if bot.entity_cache is not None
+                    else None
+                ),
+            },
+        )
+        self.gauge(
+            "fsm_users",
+            "Users with a state or data in memory",
+            callback=lambda: len(bot.storage),
+        )
+        self.gauge(
+            "tasks", "Running handler tasks", callback=lambda: len(bot.tasks)
+        )
+
+        def lag():
+            if bot.lag_tracker is None:
+                return {}
+
+            return {
+                (kind, str(int(q[1:]) / 100)): value
+                for kind, values in bot.lag_tracker.percentiles().items()
+                for q, value in values.items()
+            }
+
+        # the report is slow, so it is made once per scrape
+        # and shared by both gauges
+        report = {"render": None, "report": {}}
+
+        def memory(key: str) -> Callable:
+            def callback():
+                if report["render"] != self.renders:
+                    report["render"] = self.renders
+                    report["report"] = memory_report(bot)
+
+                return {
+                    name: values[key]
+                    for name, values in report["report"].items()
+                }
+
+            return callback
+
+        self.gauge(
+            "memory_bytes",
+            "Approximate memory used by caches, FSM, tasks and uploads",
+            ("component",),
+            memory("bytes"),
+        )
+        self.gauge(
+            "memory_objects",
+            "Objects in caches, FSM, tasks and uploads",
+            ("component",),
+            memory("objects"),
+        )
+
+        self.gauge(
+            "lag_seconds",
+            "Percentiles of the update age, handler latency and end-to-end "
+            "latency of recent updates",
+            ("kind", "quantile"),
+            lag,
+        )
+
+    def render(self) -> str:
+        """
+        Returns all metrics in Prometheus text format
+        """
+        self.renders += 1
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+    async def start_server(
+        self, host: str = "0.0.0.0", port: int = 9100, path: str = "/metrics"
+    ):
+        """
+        Starts an HTTP server that serves the metrics for Prometheus
+
+        :param host: Host to listen on
+        :param port: Port to listen on
+        :param path: Path of the metrics
+        """
+        from aiohttp import web
+
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(
+                text=self.render(),
+                content_type="text/plain",
+                headers={"X-Content-Type-Options": "nosniff"},
+            )
+
+        app = web.Application()
+        app.router.add_get(path, handle)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop_server(self):
+        """
+        Stops the metrics server
+        """
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,374 @@
+import asyncio
+import cProfile
+import logging
+import math
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from . import exceptions, utils
+
+if TYPE_CHECKING:
+    from .bot import Bot
+    from .router import Router
+
+profiling_logger = logging.getLogger("aiomax.profiling")
+
+MODES = ("deterministic", "sampling")
+
+
+def _frame_name(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return (
+        f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class Profiler:
+    def __init__(self, bot: "Bot"):
+        """
+        Profiles the running bot on demand. Available as `Bot.profiler`.
+
+        :param bot: Bot to profile
+        """
+        self.bot: "Bot" = bot
+
+        self.mode: "str | None" = None
+        self.path: "str | None" = None
+        self.started: "float | None" = None
+        self.updates: int = 0
+        self.max_updates: "int | None" = None
+        self.interval: float = 0.005
+        # result of the last run
+        self.result: "dict | None" = None
+
+        self._profile: "cProfile.Profile | None" = None
+        self._samples: dict[tuple, int] = {}
+        self._thread: "threading.Thread | None" = None
+        self._stopped = threading.Event()
+        self._timer: "asyncio.Task | None" = None
+        self._done: "asyncio.Future | None" = None
+        # stop() started from callbacks, referenced so it is not
+        # garbage collected
+        self._stopping: "asyncio.Task | None" = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether the profiler is running
+        """
+        return self.mode is not None
+
+    def start(
+        self,
+        mode: str = "deterministic",
+        duration: "float | None" = None,
+        updates: "int | None" = None,
+        path: "str | None" = None,
+        interval: float = 0.005,
+    ):
+        """
+        Starts profiling. Must be called from the event loop
+
+        :param mode: "deterministic" to record every function call with
+            cProfile, or "sampling" to sample the stack of the event loop
+            thread, which is much cheaper
+        :param duration: Seconds to profile for. None to profile
+            until `Profiler.stop` is called or `updates` are handled
+        :param updates: Number of updates to profile
+        :param path: File to write the results to. A pstats file in the
+            deterministic mode and collapsed stacks in the sampling mode
+        :param interval: Seconds between samples in the sampling mode
+        """
+        if self.running:
+            raise exceptions.AiomaxException("Profiler is already running")
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+
+        loop = asyncio.get_running_loop()
+
+        if path is None:
+            extension = "pstats" if mode == "deterministic" else "collapsed"
+            path = f"aiomax-{time.strftime('%Y%m%d-%H%M%S')}.{extension}"
+
+        self.mode = mode
+        self.path = path
+        self.started = time.perf_counter()
+        self.updates = 0
+        self.max_updates = updates
+        self.interval = interval
+        self._done = loop.create_future()
+
+        if mode == "deterministic":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._samples = {}
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._sample,
+                args=(threading.get_ident(),),
+                name="aiomax-profiler",
+                daemon=True,
+            )
+            self._thread.start()
+
+        if duration is not None:
+            self._timer = loop.create_task(self._stop_later(duration))
+
+        profiling_logger.info(f"Started {mode} profiling to {path}")
+
+    async def stop(self) -> "dict | None":
+        """
+        Stops profiling, writes the results to the file and returns
+        a summary of them. None if the profiler is not running
+        """
+        if not self.running:
+            return None
+
+        mode, self.mode = self.mode, None
+        seconds = time.perf_counter() - self.started
+
+        if self._timer is not None:
+            if self._timer is not asyncio.current_task():
+                self._timer.cancel()
+            self._timer = None
+
+        if mode == "deterministic":
+            self._profile.disable()
+            profile, self._profile = self._profile, None
+            handlers = self._handler_times(profile)
+            await asyncio.to_thread(profile.dump_stats, self.path)
+        else:
+            self._stopped.set()
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+            handlers, stacks = self._collapse()
+            await asyncio.to_thread(self._write, stacks)
+
+        self.result = {
+            "mode": mode,
+            "path": self.path,
+            "seconds": seconds,
+            "updates": self.updates,
+            "handlers": dict(
+                sorted(
+                    handlers.items(),
+                    key=lambda i: i[1]["seconds"],
+                    reverse=True,
+                )
+            ),
+        }
+        profiling_logger.info(f"Profiling results written to {self.path}")
+
+        if not self._done.done():
+            self._done.set_result(self.result)
+        return self.result
+
+    async def wait(self) -> dict:
+        """
+        Waits until the profiler stops and returns the summary
+        """
+        if self._done is None:
+            raise exceptions.AiomaxException("Profiler was not started")
+        return await asyncio.shield(self._done)
+
+    async def profile(self, *args, **kwargs) -> dict:
+        """
+        Starts profiling with the arguments of `Profiler.start` and
+        returns the summary when it stops
+        """
+        self.start(*args, **kwargs)
+        return await self.wait()
+
+    def count_update(self):
+        """
+        Counts an update handled while profiling
+        """
+        self.updates += 1
+
+        if self.max_updates is not None and self.updates == self.max_updates:
+            self._stop_soon()
+
+    def add_signal_handler(self, signum: "int | None" = None, **options):
+        """
+        Makes a signal start profiling with the given options of
+        `Profiler.start`, and stop it if it is running.
+        Not supported on Windows
+
+        :param signum: Signal number, SIGUSR2 by default
+        """
+        if signum is None:
+            signum = signal.SIGUSR2
+
+        asyncio.get_running_loop().add_signal_handler(
+            signum, self._toggle, options
+        )
+
+    def add_command(
+        self,
+        router: "Router",
+        admins: "list[int]",
+        name: str = "profile",
+        **options,
+    ):
+        """
+        Registers a command that starts profiling. Only the given users
+        can use it. `/profile` starts profiling with the given options
+        of `Profiler.start`, `/profile 30` for 30 seconds,
+        `/profile 100 updates` for 100 updates and `/profile stop`
+        stops it. The summary is sent as a reply when profiling stops
+
+        :param router: Router or bot to register the command in
+        :param admins: IDs of the users that can use the command
+        :param name: Command name
+        """
+
+        async def command(ctx):
+            if ctx.sender.user_id not in admins:
+                return
+
+            if ctx.args[:1] == ["stop"]:
+                if not self.running:
+                    await ctx.reply("Profiler is not running")
+                else:
+                    await self.stop()
+                return
+
+            if self.running:
+                await ctx.reply("Profiler is already running")
+                return
+
+            kwargs = dict(options)
+            if ctx.args:
+                try:
+                    amount = float(ctx.args[0])
+                except ValueError:
+                    amount = math.nan
+
+                updates = ctx.args[1:2] == ["updates"]
+                if (
+                    not math.isfinite(amount)
+                    or amount <= 0
+                    or (updates and int(amount) < 1)
+                ):
+                    await ctx.reply(
+                        f"Usage: /{name} [seconds | N updates | stop]"
+                    )
+                    return
+
+                if updates:
+                    kwargs["updates"] = int(amount)
+                else:
+                    kwargs["duration"] = amount
+
+            self.start(**kwargs)
+            await ctx.reply(f"Started {self.mode} profiling")
+            await ctx.reply(self.format(await self.wait()))
+
+        router.on_command(name)(command)
+
+    def format(self, result: dict, limit: int = 10) -> str:
+        """
+        Returns a summary as text
+
+        :param result: Summary returned by `Profiler.stop`
+        :param limit: Number of handlers to list
+        """
+        lines = [
+            f"{result['mode'].capitalize()} profile of "
+            f"{result['seconds']:.1f}s, {result['updates']} updates",
+            f"Saved to {result['path']}",
+        ]
+        for handler, stats in list(result["handlers"].items())[:limit]:
+            lines.append(f"{handler}: {stats['seconds']:.3f}s")
+
+        return "\n".join(lines)
+
+    def _toggle(self, options: dict):
+        if self.running:
+            self._stop_soon()
+        else:
+            self.start(**options)
+
+    def _stop_soon(self):
+        if self._stopping is None or self._stopping.done():
+            self._stopping = asyncio.get_running_loop().create_task(
+                self.stop()
+            )
+
+    async def _stop_later(self, duration: float):
+        await asyncio.sleep(duration)
+        await self.stop()
+
+    def _sample(self, thread_id: int):
+        samples = self._samples
+
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+
+            # from the outermost frame
+            key = tuple(reversed(codes))
+            samples[key] = samples.get(key, 0) + 1
+
+    def _collapse(self) -> "tuple[dict, dict]":
+        """
+        Returns time of handlers and collapsed stacks. Stacks inside
+        handlers start with the handler name, so that they are grouped
+        by handler in flame graphs
+        """
+        names = utils.handler_codes(self.bot)
+        handlers = {}
+        stacks = {}
+
+        for codes, count in self._samples.items():
+            handler = None
+            for i, code in enumerate(codes):
+                if code in names:
+                    handler = names[code]
+                    codes = codes[i:]
+                    break
+
+            frames = [_frame_name(code) for code in codes]
+            if handler is not None:
+                frames.insert(0, f"handler {handler}")
+                stats = handlers.setdefault(
+                    handler, {"samples": 0, "seconds": 0.0}
+                )
+                stats["samples"] += count
+                stats["seconds"] += count * self.interval
+
+            stack = ";".join(frames)
+            stacks[stack] = stacks.get(stack, 0) + count
+
+        return handlers, stacks
+
+    def _write(self, stacks: dict):
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.items():
+                f.write(f"{stack} {count}\n")
+
+    def _handler_times(self, profile: cProfile.Profile) -> dict:
+        """
+        Returns cumulative time of handlers in a deterministic profile.
+        Every resumption of a coroutine is counted as a call
+        """
+        stats = pstats.Stats(profile).stats
+        handlers = {}
+
+        for code, name in utils.handler_codes(self.bot).items():
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            if key in stats:
+                _, calls, _, cumulative, _ = stats[key]
+                handlers[name] = {"calls": calls, "seconds": cumulative}
+
+        return handlers
@@ -3,7 +3,7 @@ from copy import deepcopy
 from typing import Callable, Optional
 
 from . import exceptions
-from .filters import normalize_filter
+from .filters import ANY_STATE, normalize_filter, state
 from .types import CommandHandler, Handler, MessageHandler
 
 bot_logger = logging.getLogger("aiomax.bot")
@@ -45,6 +45,8 @@ class Router:
             "message_removed": [],
             "message_callback": [],
         }
+        # update type -> (state -> handlers, handlers without a state)
+        self._index: dict[str, tuple[dict, list[Handler]]] = {}
 
     @staticmethod
     def wrap_filters(
@@ -80,6 +82,96 @@ class Router:
 
         return combined_filter
 
+    @staticmethod
+    def extract_state(
+        filters: tuple["Callable | str | None", ...], mode: str = "and"
+    ) -> tuple:
+        """
+        Separates a `filters.state` filter from other filters, so the
+        handler can be indexed by state. Returns the state (`ANY_STATE`
+        if there is none) and the remaining filters.
+
+        :param filters: filters of the handler
+        :param mode: filter combination mode
+        """
+        if mode != "and":
+            return ANY_STATE, filters
+
+        for i, filter_ in enumerate(filters):
+            if type(filter_) is not state:
+                continue
+
+            try:
+                hash(filter_.state)
+            except TypeError:
+                continue
+
+            return filter_.state, filters[:i] + filters[i + 1 :]
+
+        return ANY_STATE, filters
+
+    def handlers_for(self, update_type: str, state=ANY_STATE) -> list[Handler]:
+        """
+        Returns handlers in this and all the child routers that can handle
+        an update from a user with the given state, in the order
+        they were added.
+
+        :param update_type: Update type
+        :param state: User's state. If `ANY_STATE`, only handlers that
+            do not check the state are returned
+        """
+        index = self._index.get(update_type)
+
+        if index is None:
+            handlers = self._collect_handlers(update_type)
+            # handlers of events without filters are plain functions
+            handler_states = [getattr(i, "state", ANY_STATE) for i in handlers]
+            by_state = {
+                s: [
+                    i
+                    for i, i_state in zip(handlers, handler_states)
+                    if i_state is ANY_STATE or i_state == s
+                ]
+                for s in handler_states
+                if s is not ANY_STATE
+            }
+            stateless = [
+                i
+                for i, i_state in zip(handlers, handler_states)
+                if i_state is ANY_STATE
+            ]
+
+            index = self._index[update_type] = (by_state, stateless)
+
+        by_state, stateless = index
+
+        if state is ANY_STATE:
+            return stateless
+
+        try:
+            return by_state.get(state, stateless)
+        except TypeError:  # unhashable state
+            return stateless
+
+    def _collect_handlers(self, update_type: str) -> list[Handler]:
+        out = list(self._handlers[update_type])
+
+        for router in self.routers:
+            out.extend(router._collect_handlers(update_type))
+
+        return out
+
+    def _add_handler(self, update_type: str, handler: "Handler | Callable"):
+        self._handlers[update_type].append(handler)
+        self._invalidate()
+
+    def _invalidate(self):
+        router = self
+
+        while router is not None:
+            router._index = {}
+            router = router.parent
+
     # routers
 
     @property
@@ -123,6 +215,7 @@ class Router:
 
         router.parent = self
         self.routers.append(router)
+        self._invalidate()
 
     def remove_router(self, router: "Router"):
         if router not in self.routers:
@@ -130,6 +223,7 @@ class Router:
 
         router.parent = None
         self.routers.remove(router)
+        self._invalidate()
 
     # decorators
 
@@ -144,15 +238,18 @@ class Router:
         """
 
         def decorator(func):
-            new_filter = self.wrap_filters(filters, mode=mode)
+            state_, other_filters = self.extract_state(filters, mode)
+            new_filter = self.wrap_filters(other_filters, mode=mode)
 
-            self._handlers["message_created"].append(
+            self._add_handler(
+                "message_created",
                 MessageHandler(
                     call=func,
                     deco_filter=new_filter,
                     router_filters=self.filters["message_created"],
+                    state=state_,
                     detect_commands=detect_commands,
-                )
+                ),
             )
             return func
 
@@ -166,14 +263,17 @@ class Router:
         """
 
         def decorator(func):
-            new_filter = self.wrap_filters(filters, mode=mode)
+            state_, other_filters = self.extract_state(filters, mode)
+            new_filter = self.wrap_filters(other_filters, mode=mode)
 
-            self._handlers["message_edited"].append(
+            self._add_handler(
+                "message_edited",
                 Handler(
                     call=func,
                     deco_filter=new_filter,
                     router_filters=self.filters["message_edited"],
-                )
+                    state=state_,
+                ),
             )
             return func
 
@@ -187,14 +287,17 @@ class Router:
         """
 
         def decorator(func):
-            new_filter = self.wrap_filters(filters, mode=mode)
+            state_, other_filters = self.extract_state(filters, mode)
+            new_filter = self.wrap_filters(other_filters, mode=mode)
 
-            self._handlers["message_removed"].append(
+            self._add_handler(
+                "message_removed",
                 Handler(
                     call=func,
                     deco_filter=new_filter,
                     router_filters=self.filters["message_removed"],
-                )
+                    state=state_,
+                ),
             )
             return func
 
@@ -206,7 +309,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["bot_started"].append(func)
+            self._add_handler("bot_started", func)
             return func
 
         return decorator
@@ -217,7 +320,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["chat_title_changed"].append(func)
+            self._add_handler("chat_title_changed", func)
             return func
 
         return decorator
@@ -228,7 +331,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["bot_added"].append(func)
+            self._add_handler("bot_added", func)
             return func
 
         return decorator
@@ -239,7 +342,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["bot_removed"].append(func)
+            self._add_handler("bot_removed", func)
             return func
 
         return decorator
@@ -250,7 +353,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["user_added"].append(func)
+            self._add_handler("user_added", func)
             return func
 
         return decorator
@@ -261,7 +364,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["user_removed"].append(func)
+            self._add_handler("user_removed", func)
             return func
 
         return decorator
@@ -272,7 +375,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["on_ready"].append(func)
+            self._add_handler("on_ready", func)
             return func
 
         return decorator
@@ -285,14 +388,17 @@ class Router:
         """
 
         def decorator(func):
-            new_filter = self.wrap_filters(filters, mode=mode)
+            state_, other_filters = self.extract_state(filters, mode)
+            new_filter = self.wrap_filters(other_filters, mode=mode)
 
-            self._handlers["message_callback"].append(
+            self._add_handler(
+                "message_callback",
                 Handler(
                     call=func,
                     deco_filter=new_filter,
                     router_filters=self.filters["message_callback"],
-                )
+                    state=state_,
+                ),
             )
             return func
 
@@ -304,7 +410,7 @@ class Router:
         """
 
         def decorator(func):
-            self._handlers["message_chat_created"].append(func)
+            self._add_handler("message_chat_created", func)
             return func
 
         return decorator
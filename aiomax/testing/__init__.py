@@ -0,0 +1,8 @@
+"""
+Tools for testing bots and measuring their performance offline
+"""
+
+from .fake_api import ERRORS, FakeMaxAPI
+from .server import FakeMaxServer
+
+__all__ = ["ERRORS", "FakeMaxAPI", "FakeMaxServer"]
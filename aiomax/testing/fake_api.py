@@ -0,0 +1,628 @@
+import asyncio
+import contextlib
+import itertools
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Callable
+
+from ..utils import endpoint_name
+
+# known kinds of injected errors: kind -> (status, code, message)
+ERRORS = {
+    "attachment.not.ready": (
+        400,
+        "attachment.not.ready",
+        "Key: errors.process.attachment.file.not.processed",
+    ),
+    "rate_limit": (429, "too.many.requests", "Too many requests"),
+    "internal": (500, "internal.error", "Internal error id-0"),
+    "unavailable": (503, "service.unavailable", "Service unavailable"),
+    "not_found": (404, "not.found", "Not found"),
+    "chat_not_found": (404, "chat.not.found", "Chat not found"),
+    "access_denied": (403, "access.denied", "Access denied"),
+}
+
+
+class InjectedError:
+    def __init__(
+        self,
+        kind: str,
+        path: "str | None",
+        method: "str | None",
+        probability: float,
+        count: "int | None",
+    ):
+        self.kind: str = kind
+        self.path: "str | None" = path
+        self.method: "str | None" = method
+        self.probability: float = probability
+        self.count: "int | None" = count
+
+    def matches(self, method: str, path: str) -> bool:
+        if self.count is not None and self.count <= 0:
+            return False
+        if self.method is not None and self.method != method:
+            return False
+        return self.path is None or re.fullmatch(self.path, path) is not None
+
+
+class FakeMaxAPI:
+    def __init__(
+        self,
+        latency: "float | tuple[float, float]" = 0,
+        poll_timeout: float = 30,
+        seed: "int | None" = None,
+    ):
+        """
+        In-memory imitation of the Max Bot API. Use it through
+        `FakeMaxServer` or call `handle` directly.
+
+        :param latency: Seconds to wait before each response, or a range
+            to pick a random delay from
+        :param poll_timeout: Maximum seconds `GET /updates` waits
+            for new updates
+        :param seed: Random seed for latency and error injection
+        """
+        self.latency: "float | tuple[float, float]" = latency
+        self.poll_timeout: float = poll_timeout
+        self.random = random.Random(seed)
+
+        self.upload_url: str = "upload"
+        self.bot: dict = self.make_user(1, "Fake bot", is_bot=True)
+        self.bot["username"] = "fakebot"
+
+        self.chats: dict[int, dict] = {}
+        self.members: dict[int, dict[int, dict]] = {}
+        self.pins: dict[int, dict] = {}
+        self.messages: dict[str, dict] = {}
+        self.answers: list[dict] = []
+        self.uploads: dict[str, int] = {}  # token -> size
+
+        self.updates: list[dict] = []
+        self.marker: int = 0
+        self.new_updates: "asyncio.Event | None" = None
+
+        self.errors: list[InjectedError] = []
+        self.requests: Counter[tuple[str, str]] = Counter()
+        self.responses: Counter[int] = Counter()
+        self.upload_bytes: int = 0
+
+        self.ids = itertools.count(1)
+
+    # setting up
+
+    @staticmethod
+    def make_user(user_id: int, name: str, is_bot: bool = False) -> dict:
+        """
+        Returns user's JSON
+        """
+        return {
+            "user_id": user_id,
+            "first_name": name,
+            "last_name": "",
+            "name": name,
+            "username": None,
+            "is_bot": is_bot,
+            "last_activity_time": int(time.time() * 1000),
+        }
+
+    def add_chat(
+        self,
+        chat_id: int,
+        title: str = "Chat",
+        members: "list[int] | None" = None,
+        admins: "list[int] | None" = None,
+    ) -> dict:
+        """
+        Adds a chat with the bot and the given members
+
+        :param chat_id: Chat ID
+        :param title: Chat title
+        :param members: IDs of members besides the bot
+        :param admins: IDs of members that are admins
+        """
+        admins = set(admins or [])
+        chat = {
+            "chat_id": chat_id,
+            "type": "chat",
+            "status": "active",
+            "last_event_time": int(time.time() * 1000),
+            "participants_count": len(members or []) + 1,
+            "is_public": False,
+            "title": title,
+        }
+        self.chats[chat_id] = chat
+        self.members[chat_id] = {self.bot["user_id"]: dict(self.bot)}
+
+        for user_id in members or []:
+            member = self.make_user(user_id, f"User {user_id}")
+            member["is_admin"] = user_id in admins
+            member["is_owner"] = False
+            self.members[chat_id][user_id] = member
+
+        return chat
+
+    def push_update(self, update: dict):
+        """
+        Adds an update that the bot receives on the next poll
+        """
+        update.setdefault("timestamp", int(time.time() * 1000))
+        self.updates.append(update)
+        if self.new_updates is not None:
+            self.new_updates.set()
+
+    def push_message(
+        self, text: str, user_id: int = 2, chat_id: "int | None" = None
+    ) -> dict:
+        """
+        Sends a message to the bot from a user and returns its JSON
+
+        :param text: Message text
+        :param user_id: Sender ID
+        :param chat_id: Chat to send the message in. A dialog by default
+        """
+        message = self._message(
+            {"text": text},
+            self.make_user(user_id, f"User {user_id}"),
+            {
+                "chat_id": chat_id if chat_id is not None else user_id,
+                "chat_type": "chat" if chat_id is not None else "dialog",
+            },
+        )
+        self.push_update(
+            {"update_type": "message_created", "message": message}
+        )
+        return message
+
+    def push_callback(
+        self, payload: str, user_id: int = 2, message: "dict | None" = None
+    ) -> str:
+        """
+        Presses a callback button as a user and returns the callback ID
+
+        :param payload: Button payload
+        :param user_id: ID of the user that pressed the button
+        :param message: Message with the button
+        """
+        callback_id = f"cb.{next(self.ids)}"
+        self.push_update(
+            {
+                "update_type": "message_callback",
+                "callback": {
+                    "timestamp": int(time.time() * 1000),
+                    "callback_id": callback_id,
+                    "payload": payload,
+                    "user": self.make_user(user_id, f"User {user_id}"),
+                },
+                "message": message,
+            }
+        )
+        return callback_id
+
+    def inject_error(
+        self,
+        kind: str,
+        path: "str | None" = None,
+        method: "str | None" = None,
+        probability: float = 1,
+        count: "int | None" = None,
+    ):
+        """
+        Makes matching requests fail
+
+        :param kind: One of `ERRORS`, e.g. "attachment.not.ready",
+            "rate_limit" or "internal"
+        :param path: Regular expression that the request path must match,
+            e.g. "messages". Any path by default
+        :param method: HTTP method, e.g. "POST". Any method by default
+        :param probability: Probability of a matching request to fail
+        :param count: How many requests fail. Unlimited by default
+        """
+        if kind not in ERRORS:
+            raise ValueError(f"Unknown error kind: {kind}")
+
+        self.errors.append(
+            InjectedError(kind, path, method, probability, count)
+        )
+
+    def clear_errors(self):
+        """
+        Removes all injected errors
+        """
+        self.errors.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns numbers of requests per endpoint and responses per status
+        """
+        return {
+            "requests": {
+                f"{method} {path}": count
+                for (method, path), count in self.requests.items()
+            },
+            "responses": dict(self.responses),
+            "upload_bytes": self.upload_bytes,
+        }
+
+    # handling
+
+    async def handle(
+        self,
+        method: str,
+        path: str,
+        params: "dict[str, str | list[str]] | None" = None,
+        json: Any = None,
+        data: "bytes | None" = None,
+    ) -> "tuple[int, Any]":
+        """
+        Handles a request and returns its status and JSON response
+
+        :param method: HTTP method
+        :param path: Path relative to the API URL
+        :param params: Query parameters. Repeated parameters are lists
+        :param json: JSON body
+        :param data: Raw body of uploads
+        """
+        method = method.upper()
+        path = path.strip("/")
+        params = params or {}
+        self.requests[method, endpoint_name(path)] += 1
+
+        latency = self.latency
+        if isinstance(latency, tuple):
+            latency = self.random.uniform(*latency)
+        if latency > 0:
+            await asyncio.sleep(latency)
+
+        status, body = self._injected(method, path)
+        if status is None:
+            status, body = await self._route(method, path, params, json, data)
+
+        self.responses[status] += 1
+        return status, body
+
+    def _injected(self, method: str, path: str) -> "tuple[Any, Any]":
+        for error in self.errors:
+            if not error.matches(method, path):
+                continue
+            if self.random.random() >= error.probability:
+                continue
+
+            if error.count is not None:
+                error.count -= 1
+
+            status, code, message = ERRORS[error.kind]
+            return status, {"code": code, "message": message}
+
+        return None, None
+
+    async def _route(
+        self,
+        method: str,
+        path: str,
+        params: dict,
+        json: Any,
+        data: "bytes | None",
+    ) -> "tuple[int, Any]":
+        for pattern, route_method, handler in self._routes():
+            match = re.fullmatch(pattern, path)
+            if match is None or route_method != method:
+                continue
+
+            result = handler(
+                *match.groups(), params=params, json=json, data=data
+            )
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+
+        return 404, {"code": "not.found", "message": f"No route: {path}"}
+
+    def _routes(self) -> "list[tuple[str, str, Callable]]":
+        return [
+            ("me", "GET", self._get_me),
+            ("me", "PATCH", self._patch_me),
+            ("updates", "GET", self._get_updates),
+            ("messages", "POST", self._send_message),
+            ("messages", "PUT", self._edit_message),
+            ("messages", "DELETE", self._delete_message),
+            ("messages", "GET", self._get_messages),
+            ("messages/([^/]+)", "GET", self._get_message),
+            ("answers", "POST", self._answer),
+            ("uploads", "POST", self._uploads),
+            ("upload", "POST", self._upload),
+            ("chats", "GET", self._get_chats),
+            (r"chats/(-?\d+)", "GET", self._get_chat),
+            (r"chats/(-?\d+)", "PATCH", self._patch_chat),
+            (r"chats/(-?\d+)/pin", "GET", self._get_pin),
+            (r"chats/(-?\d+)/pin", "PUT", self._pin),
+            (r"chats/(-?\d+)/pin", "DELETE", self._unpin),
+            (r"chats/(-?\d+)/members/me", "GET", self._my_membership),
+            (r"chats/(-?\d+)/members/me", "DELETE", self._leave_chat),
+            (r"chats/(-?\d+)/members/admins", "GET", self._get_admins),
+            (r"chats/(-?\d+)/members", "GET", self._get_members),
+            (r"chats/(-?\d+)/members", "POST", self._add_members),
+            (r"chats/(-?\d+)/members", "DELETE", self._kick_member),
+            (r"chats/(-?\d+)/actions", "POST", self._action),
+            (r"chats/([^/]+)", "GET", self._chat_by_link),
+        ]
+
+    def _chat(self, chat_id: str) -> "dict | None":
+        return self.chats.get(int(chat_id))
+
+    @staticmethod
+    def _list(params: dict, key: str) -> "list[str]":
+        """
+        Returns the values of a list parameter, sent either as repeated
+        keys or joined with commas
+        """
+        values = params.get(key)
+        if values is None:
+            return []
+        if not isinstance(values, list):
+            values = [values]
+
+        return [i for value in values for i in str(value).split(",") if i]
+
+    @staticmethod
+    def _missing_chat(chat_id) -> "tuple[int, dict]":
+        return 404, {
+            "code": "chat.not.found",
+            "message": f"Chat {chat_id} not found",
+        }
+
+    def _message(self, body: dict, sender: dict, recipient: dict) -> dict:
+        seq = next(self.ids)
+        message = {
+            "sender": sender,
+            "recipient": recipient,
+            "timestamp": int(time.time() * 1000),
+            "body": {
+                "mid": f"mid.{seq:016x}",
+                "seq": seq,
+                "text": body.get("text") or "",
+                "attachments": body.get("attachments") or [],
+            },
+        }
+        if body.get("link"):
+            message["link"] = {
+                "type": body["link"]["type"],
+                "message": self.messages.get(body["link"]["mid"], {}).get(
+                    "body"
+                ),
+            }
+
+        self.messages[message["body"]["mid"]] = message
+        return message
+
+    # endpoints
+
+    def _get_me(self, **_):
+        return 200, self.bot
+
+    def _patch_me(self, json, **_):
+        self.bot.update({k: v for k, v in (json or {}).items() if v})
+        return 200, self.bot
+
+    async def _get_updates(self, params, **_):
+        limit = int(params.get("limit", 100))
+        marker = int(params.get("marker", 0) or 0)
+        marker = max(marker, self.marker)
+
+        if not self.updates:
+            # created lazily to bind to the running loop
+            if self.new_updates is None:
+                self.new_updates = asyncio.Event()
+            self.new_updates.clear()
+            timeout = float(params.get("timeout", self.poll_timeout))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+
+        updates = self.updates[:limit]
+        del self.updates[:limit]
+        self.marker = marker + len(updates)
+
+        return 200, {"updates": updates, "marker": self.marker}
+
+    def _send_message(self, params, json, **_):
+        body = json or {}
+        for attachment in body.get("attachments") or []:
+            token = (attachment.get("payload") or {}).get("token")
+            if (
+                token is not None
+                and token.startswith("fake.")
+                and (token not in self.uploads)
+            ):
+                return 400, {
+                    "code": "attachment.not.ready",
+                    "message": "Key: errors.process.attachment.file."
+                    "not.processed",
+                }
+
+        if "chat_id" in params:
+            recipient = {
+                "chat_id": int(params["chat_id"]),
+                "chat_type": "chat",
+            }
+        elif "user_id" in params:
+            recipient = {
+                "chat_id": int(params["user_id"]),
+                "chat_type": "dialog",
+            }
+        else:
+            return 400, {
+                "code": "proto.payload",
+                "message": "chat_id or user_id is required",
+            }
+
+        return 200, {"message": self._message(body, self.bot, recipient)}
+
+    def _edit_message(self, params, json, **_):
+        message = self.messages.get(params.get("message_id"))
+        if message is None:
+            return 404, {"code": "not.found", "message": "Message not found"}
+
+        body = json or {}
+        if body.get("text") is not None:
+            message["body"]["text"] = body["text"]
+        if body.get("attachments") is not None:
+            message["body"]["attachments"] = body["attachments"]
+
+        return 200, {"success": True}
+
+    def _delete_message(self, params, **_):
+        if self.messages.pop(params.get("message_id"), None) is None:
+            return 200, {"success": False, "message": "Message not found"}
+        return 200, {"success": True}
+
+    def _get_messages(self, params, **_):
+        ids = self._list(params, "message_ids")
+        return 200, {
+            "messages": [self.messages[i] for i in ids if i in self.messages]
+        }
+
+    def _get_message(self, message_id, **_):
+        message = self.messages.get(message_id)
+        if message is None:
+            return 404, {"code": "not.found", "message": "Message not found"}
+        return 200, message
+
+    def _answer(self, params, json, **_):
+        self.answers.append(
+            {"callback_id": params.get("callback_id"), **(json or {})}
+        )
+        return 200, {"success": True}
+
+    def _uploads(self, params, **_):
+        token = f"fake.{next(self.ids)}"
+        response = {"url": f"{self.upload_url}?token={token}"}
+
+        # audio and video tokens are returned before the upload
+        if params.get("type") in {"audio", "video"}:
+            response["token"] = token
+
+        return 200, response
+
+    def _upload(self, params, data, **_):
+        token = params.get("token", f"fake.{next(self.ids)}")
+        size = len(data or b"")
+        self.uploads[token] = size
+        self.upload_bytes += size
+
+        return 200, {
+            "token": token,
+            "photos": {"original": {"token": token}},
+        }
+
+    def _get_chats(self, params, **_):
+        return 200, self._page(list(self.chats.values()), params, "chats")
+
+    def _page(self, items: list, params: dict, key: str) -> dict:
+        count = int(params.get("count", 50))
+        start = int(params.get("marker", 0) or 0)
+        page = {key: items[start : start + count]}
+
+        if start + count < len(items):
+            page["marker"] = start + count
+
+        return page
+
+    def _get_chat(self, chat_id, **_):
+        chat = self._chat(chat_id)
+        if chat is None:
+            return self._missing_chat(chat_id)
+        return 200, chat
+
+    def _chat_by_link(self, link, **_):
+        for chat in self.chats.values():
+            if chat.get("link") == link:
+                return 200, chat
+        return self._missing_chat(link)
+
+    def _patch_chat(self, chat_id, json, **_):
+        chat = self._chat(chat_id)
+        if chat is None:
+            return self._missing_chat(chat_id)
+
+        if (json or {}).get("title"):
+            chat["title"] = json["title"]
+        return 200, chat
+
+    def _get_pin(self, chat_id, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+        return 200, {"message": self.pins.get(int(chat_id))}
+
+    def _pin(self, chat_id, json, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+
+        message = self.messages.get((json or {}).get("message_id"))
+        if message is None:
+            return 404, {"code": "not.found", "message": "Message not found"}
+
+        self.pins[int(chat_id)] = message
+        return 200, {"success": True}
+
+    def _unpin(self, chat_id, **_):
+        self.pins.pop(int(chat_id), None)
+        return 200, {"success": True}
+
+    def _my_membership(self, chat_id, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+        return 200, self.members[int(chat_id)][self.bot["user_id"]]
+
+    def _leave_chat(self, chat_id, **_):
+        if self.chats.pop(int(chat_id), None) is None:
+            return self._missing_chat(chat_id)
+        self.members.pop(int(chat_id), None)
+        return 200, {"success": True}
+
+    def _get_admins(self, chat_id, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+        return 200, {
+            "members": [
+                i
+                for i in self.members[int(chat_id)].values()
+                if i.get("is_admin")
+            ]
+        }
+
+    def _get_members(self, chat_id, params, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+
+        members = self.members[int(chat_id)]
+        if "user_ids" in params:
+            ids = self._list(params, "user_ids")
+            return 200, {
+                "members": [members[int(i)] for i in ids if int(i) in members]
+            }
+
+        return 200, self._page(list(members.values()), params, "members")
+
+    def _add_members(self, chat_id, json, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+
+        for user_id in (json or {}).get("user_ids", []):
+            self.members[int(chat_id)][user_id] = self.make_user(
+                user_id, f"User {user_id}"
+            )
+        return 200, {"success": True}
+
+    def _kick_member(self, chat_id, params, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+
+        self.members[int(chat_id)].pop(int(params.get("user_id", 0)), None)
+        return 200, {"success": True}
+
+    def _action(self, chat_id, **_):
+        if self._chat(chat_id) is None:
+            return self._missing_chat(chat_id)
+        return 200, {"success": True}
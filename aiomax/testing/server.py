@@ -0,0 +1,85 @@
+from aiohttp import web
+
+from .fake_api import FakeMaxAPI
+
+
+class FakeMaxServer:
+    def __init__(
+        self,
+        api: "FakeMaxAPI | None" = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        HTTP server that serves `FakeMaxAPI`, including the upload host.
+        Pass `FakeMaxServer.url` to `Bot` as `api_url`.
+
+        :param api: Fake API to serve. A new one by default
+        :param host: Host to listen on
+        :param port: Port to listen on. 0 to pick a free one
+        """
+        self.api: FakeMaxAPI = api if api is not None else FakeMaxAPI()
+        self.host: str = host
+        self.port: int = port
+
+        self.runner: "web.AppRunner | None" = None
+
+    @property
+    def url(self) -> str:
+        """
+        Base URL of the API
+        """
+        return f"http://{self.host}:{self.port}/"
+
+    async def start(self):
+        """
+        Starts the server
+        """
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_route("*", "/{path:.*}", self._handle)
+
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+
+        if self.port == 0:
+            self.port = self.runner.addresses[0][1]
+
+        self.api.upload_url = f"{self.url}upload"
+
+    async def close(self):
+        """
+        Stops the server
+        """
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def __aenter__(self) -> "FakeMaxServer":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        path = request.match_info["path"]
+        json = data = None
+
+        if path == "upload":
+            data = await request.read()
+        elif request.can_read_body:
+            json = await request.json()
+
+        # repeated parameters, e.g. user_ids=1&user_ids=2, are lists
+        params = {}
+        for key in request.query:
+            values = request.query.getall(key)
+            params[key] = values if len(values) > 1 else values[0]
+
+        status, body = await self.api.handle(
+            request.method, path, params, json, data
+        )
+        return web.json_response(body, status=status)
@@ -0,0 +1,204 @@
+import contextlib
+import json
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable
+
+current_span: "ContextVar[Span | None]" = ContextVar(
+    "aiomax_current_span", default=None
+)
+
+# returned instead of a span when the update is not traced
+NO_SPAN = contextlib.nullcontext()
+
+
+class Span:
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        parent: "Span | None" = None,
+        attributes: "dict[str, Any] | None" = None,
+    ):
+        """
+        Timed operation of a trace. Used as a context manager
+        that makes it the current span.
+
+        :param tracer: Tracer that exports the span
+        :param name: Operation name
+        :param parent: Parent span. None for the root span of a trace
+        :param attributes: Additional information about the operation
+        """
+        self.tracer: "Tracer" = tracer
+        self.name: str = name
+        self.parent: "Span | None" = parent
+        self.root: Span = parent.root if parent is not None else self
+        self.trace_id: str = (
+            parent.trace_id
+            if parent is not None
+            else f"{random.getrandbits(128):032x}"
+        )
+        self.span_id: str = f"{random.getrandbits(64):016x}"
+        self.attributes: dict[str, Any] = attributes or {}
+        self.error: "str | None" = None
+
+        self.start: float = time.time()
+        self._start: float = time.perf_counter()
+        self.duration: "float | None" = None
+        self._token = None
+
+    def set(self, key: str, value: Any):
+        """
+        Sets an attribute of the span
+        """
+        self.attributes[key] = value
+
+    def finish(self):
+        """
+        Ends the span and exports it
+        """
+        if self.duration is not None:
+            return
+
+        self.duration = time.perf_counter() - self._start
+        self.tracer.export(self)
+
+    def to_json(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": (
+                self.parent.span_id if self.parent is not None else None
+            ),
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def __enter__(self) -> "Span":
+        self._token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        current_span.reset(self._token)
+
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.finish()
+
+
+class Exporter:
+    """
+    Receives finished spans.
+    """
+
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def flush(self):
+        """
+        Writes buffered spans
+        """
+
+    def close(self):
+        """
+        Writes buffered spans and releases resources
+        """
+
+
+class CallbackExporter(Exporter):
+    def __init__(self, callback: Callable[[dict], Any]):
+        """
+        Calls a function with each finished span as a dict
+
+        :param callback: Function that receives spans
+        """
+        self.callback: Callable[[dict], Any] = callback
+
+    def export(self, span: Span):
+        self.callback(span.to_json())
+
+
+class JSONLExporter(Exporter):
+    def __init__(self, path: str):
+        """
+        Appends finished spans to a file, one JSON object per line
+
+        :param path: Path to the file
+        """
+        self.path: str = path
+        # kept open for the lifetime of the exporter
+        self.file = open(path, "a", encoding="utf-8")  # noqa: SIM115
+
+    def export(self, span: Span):
+        self.file.write(
+            json.dumps(span.to_json(), ensure_ascii=False, default=str) + "\n"
+        )
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Tracer:
+    def __init__(
+        self,
+        exporter: "Exporter | Callable[[dict], Any]",
+        sample_rate: float = 1.0,
+    ):
+        """
+        Records spans of updates, handlers and API requests.
+
+        :param exporter: Exporter of finished spans, or a function
+            that receives them as dicts
+        :param sample_rate: Share of updates to trace, from 0 to 1.
+            Untraced updates cost almost nothing
+        """
+        if not isinstance(exporter, Exporter):
+            exporter = CallbackExporter(exporter)
+
+        self.exporter: Exporter = exporter
+        self.sample_rate: float = sample_rate
+        self.random = random.Random()
+
+    def trace(self, name: str, **attributes):
+        """
+        Starts a new trace with the given root span if it is sampled.
+        Use as a context manager
+        """
+        if self.sample_rate < 1 and self.random.random() >= self.sample_rate:
+            return NO_SPAN
+
+        return Span(self, name, None, attributes)
+
+    def span(self, name: str, parent: "Span | None" = None, **attributes):
+        """
+        Starts a child span of `parent` or the current span.
+        Does nothing outside of a trace. Use as a context manager
+        """
+        if parent is None:
+            parent = current_span.get()
+            if parent is None:
+                return NO_SPAN
+
+        return Span(self, name, parent, attributes)
+
+    def export(self, span: Span):
+        self.exporter.export(span)
+
+    def flush(self):
+        """
+        Writes spans buffered by the exporter
+        """
+        self.exporter.flush()
+
+    def close(self):
+        """
+        Closes the exporter
+        """
+        self.exporter.close()
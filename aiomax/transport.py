@@ -0,0 +1,173 @@
+import asyncio
+import json as json_
+from typing import Any, Callable
+from urllib.parse import parse_qsl, urlsplit
+
+import aiohttp
+
+
+class Transport:
+    """
+    Sends API requests for `Bot`.
+
+    Responses must have `status` and `content_type` attributes,
+    `json()`, `text()` and `read()` coroutines and
+    a `raise_for_status()` method, like `aiohttp.ClientResponse`.
+    """
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: "dict | None" = None,
+        **kwargs,
+    ):
+        """
+        Sends a request and returns the response
+
+        :param method: HTTP method
+        :param url: URL relative to the API URL, or an absolute URL
+        :param params: Query parameters
+        :param kwargs: `json` or `data` body
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """
+        Releases resources of the transport
+        """
+
+
+class AiohttpTransport(Transport):
+    def __init__(self, session: aiohttp.ClientSession):
+        """
+        Sends requests over HTTP with an aiohttp session.
+
+        :param session: Session with the API URL as `base_url`
+        """
+        self.session: aiohttp.ClientSession = session
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: "dict | None" = None,
+        **kwargs,
+    ) -> aiohttp.ClientResponse:
+        return await self.session.request(
+            method, url, params=params or {}, **kwargs
+        )
+
+    async def close(self):
+        await self.session.close()
+
+
+class MemoryResponse:
+    def __init__(self, status: int, body: Any):
+        """
+        Response of `MemoryTransport`.
+
+        :param status: HTTP status
+        :param body: JSON-serializable body, or a string for a plain text
+            response
+        """
+        self.status: int = status
+        self.body: Any = body
+        self.content_type: str = (
+            "text/plain" if isinstance(body, str) else "application/json"
+        )
+
+    async def json(self, *args, **kwargs) -> Any:
+        return self.body
+
+    async def text(self, *args, **kwargs) -> str:
+        if isinstance(self.body, str):
+            return self.body
+        return json_.dumps(self.body)
+
+    async def read(self) -> bytes:
+        return (await self.text()).encode()
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise aiohttp.ClientResponseError(
+                None, (), status=self.status, message=str(self.body)
+            )
+
+    def release(self):
+        pass
+
+
+class MemoryTransport(Transport):
+    def __init__(self, responder: "Callable | Any | None" = None):
+        """
+        Answers requests in memory, without sockets or HTTP, so that
+        benchmarks measure only the bot's own work.
+
+        :param responder: Object with a `handle` coroutine, like
+            `aiomax.testing.FakeMaxAPI`, or a function that is called with
+            the method, path, query parameters, JSON body and raw body
+            and returns (or resolves to) a status and a JSON body.
+            Parameters with several values are passed as lists of strings.
+            A new `FakeMaxAPI` by default
+        """
+        if responder is None:
+            from .testing import FakeMaxAPI
+
+            responder = FakeMaxAPI()
+
+        self.responder = getattr(responder, "handle", responder)
+        self.requests: int = 0
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        params: "dict | None" = None,
+        **kwargs,
+    ) -> MemoryResponse:
+        self.requests += 1
+
+        # absolute URLs, e.g. of the upload host
+        parts = urlsplit(url)
+        query: dict[str, list[str]] = {}
+        for key, value in parse_qsl(parts.query):
+            query.setdefault(key, []).append(value)
+
+        # lists are sent as repeated keys, like aiohttp does
+        for key, value in (params or {}).items():
+            values = value if isinstance(value, list) else [value]
+            query[key] = [str(i) for i in values]
+
+        # empty lists are not sent, like aiohttp does
+        params = {k: v if len(v) > 1 else v[0] for k, v in query.items() if v}
+
+        data = kwargs.get("data")
+        if isinstance(data, aiohttp.FormData):
+            data = await _form_bytes(data)
+
+        result = self.responder(
+            method.upper(), parts.path, params, kwargs.get("json"), data
+        )
+        if asyncio.iscoroutine(result):
+            result = await result
+
+        status, body = result
+        return MemoryResponse(status, body)
+
+
+class _Buffer:
+    def __init__(self):
+        self.chunks: list[bytes] = []
+
+    async def write(self, chunk: bytes):
+        self.chunks.append(chunk)
+
+
+async def _form_bytes(form: aiohttp.FormData) -> bytes:
+    """
+    Returns the encoded body of a form
+    """
+    buffer = _Buffer()
+    await form().write(buffer)
+    return b"".join(buffer.chunks)
@@ -1,6 +1,7 @@
-from typing import Callable, Literal, Optional
+from typing import Any, Callable, Literal, Optional
 
 from . import buttons, exceptions, utils
+from .filters import ANY_STATE
 
 
 class BotCommand:
@@ -944,6 +945,7 @@ class Handler:
         call: Callable,
         deco_filter: "Callable | None" = None,
         router_filters: Optional[list[Callable]] = None,
+        state: Any = ANY_STATE,
     ):
         if router_filters is None:
             router_filters = []
@@ -951,6 +953,7 @@ class Handler:
         self.call = call
         self.deco_filter: "Callable | None" = deco_filter
         self.router_filters: list[Callable] = router_filters
+        self.state: Any = state  # state the handler waits for
 
     @property
     def filters(self) -> list[Callable]:
@@ -966,11 +969,12 @@ class MessageHandler(Handler):
         deco_filter: "Callable | None" = None,
         router_filters: Optional[list[Callable]] = None,
         detect_commands: bool = False,
+        state: Any = ANY_STATE,
     ):
         if router_filters is None:
             router_filters = []
 
-        super().__init__(call, deco_filter, router_filters)
+        super().__init__(call, deco_filter, router_filters, state)
         self.detect_commands: bool = detect_commands
 
 
@@ -1244,7 +1248,7 @@ class Callback:
             )
 
         out = await self.bot.post(
-            "https://botapi.max.ru/answers",
+            "answers",
             params={"callback_id": self.callback_id},
             json=body,
         )
@@ -1343,7 +1347,11 @@ class MessageDeletePayload:
 
         return MessageDeletePayload(
             data["timestamp"],
-            bot.cache.get_message(data.get("message_id")),
+            (
+                bot.cache.get_message(data.get("message_id"))
+                if bot.cache is not None
+                else None
+            ),
             data.get("message_id"),
             data.get("chat_id"),
             data.get("user_id"),
@@ -1,3 +1,7 @@
+import inspect
+import os
+import re
+from functools import lru_cache
 from inspect import signature
 from typing import Callable, Literal
 
@@ -67,17 +71,112 @@ def get_message_body(
     return body
 
 
+@lru_cache(maxsize=4096)
+def _cached_parameters(func: Callable) -> frozenset:
+    return frozenset(signature(func).parameters)
+
+
+def parameters(func: Callable) -> frozenset:
+    """
+    Returns names of the parameters that callable accepts
+    """
+    try:
+        return _cached_parameters(func)
+    except TypeError:
+        # unhashable callables, e.g. dataclass instances with __call__
+        return frozenset(signature(func).parameters)
+
+
+def accepts(func: Callable, name: str) -> bool:
+    """
+    Returns whether callable accepts a parameter with this name
+    """
+    return name in parameters(func)
+
+
 def context_kwargs(func: Callable, **kwargs):
     """
     Returns only those kwargs, that callable accepts
     """
-    params = list(signature(func).parameters.keys())
+    params = parameters(func)
 
     kwargs = {kw: arg for kw, arg in kwargs.items() if kw in params}
 
     return kwargs
 
 
+def payload_size(data) -> "int | None":
+    """
+    Returns the size of an upload in bytes. None if it is unknown
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+
+    if hasattr(data, "getbuffer"):
+        return data.getbuffer().nbytes
+
+    if hasattr(data, "fileno"):
+        try:
+            return os.fstat(data.fileno()).st_size
+        except (OSError, ValueError):
+            return None
+
+    return None
+
+
+def endpoint_name(url: str) -> str:
+    """
+    Returns the API endpoint of the URL with IDs replaced by `{id}`,
+    e.g. `chats/{id}/members`. Absolute URLs of the upload host
+    are named `upload`
+    """
+    if "://" in url:
+        return "upload"
+
+    path = url.split("?", 1)[0].strip("/")
+    if path.startswith("messages/"):
+        return "messages/{id}"
+    if re.fullmatch(r"chats/[^/]*[^\d/-][^/]*", path):
+        return "chats/{link}"
+    return re.sub(r"(?<=/)-?\d+(?=/|$)", "{id}", path)
+
+
+def handler_codes(router) -> dict:
+    """
+    Returns names of all handlers and commands of the router and its
+    child routers by code objects of their functions, to find handlers
+    in sampled stacks
+    """
+    calls = [
+        handler
+        for update_type in router._handlers
+        for handler in router._collect_handlers(update_type)
+    ]
+    calls.extend(i for c in router.commands.values() for i in c)
+
+    codes = {}
+    for handler in calls:
+        call = inspect.unwrap(getattr(handler, "call", handler))
+        code = getattr(call, "__code__", None)
+        if code is not None:
+            codes[code] = call.__qualname__
+
+    return codes
+
+
+def percentile(values: list[float], q: float) -> float:
+    """
+    Returns the `q` percentile of sorted values
+
+    :param values: Sorted values
+    :param q: Percentile from 0 to 100
+    """
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
 async def get_exception(response: aiohttp.ClientResponse):
     if response.status in range(200, 300):
         return None
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import TYPE_CHECKING
+
+from . import utils
+
+if TYPE_CHECKING:
+    from .bot import Bot
+
+watchdog_logger = logging.getLogger("aiomax.watchdog")
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.1,
+        threshold: float = 0.25,
+        max_stalls: int = 100,
+    ):
+        """
+        Measures how late the event loop runs scheduled callbacks.
+        A watchdog thread samples the stack of the loop thread when it is
+        blocked for longer than `threshold` and attributes the stall
+        to the handler that was running.
+
+        :param interval: Seconds between lag measurements
+        :param threshold: Seconds the loop has to be blocked for
+            to report a stall
+        :param max_stalls: Number of latest stalls to keep in
+            `LoopMonitor.stalls`
+        """
+        self.interval: float = interval
+        self.threshold: float = threshold
+
+        self.lag: float = 0.0
+        self.max_lag: float = 0.0
+        self.stalls: deque[dict] = deque(maxlen=max_stalls)
+
+        self.bot: "Bot | None" = None
+        self.task: "asyncio.Task | None" = None
+        self.thread: "threading.Thread | None" = None
+        self._stopped = threading.Event()
+        self._loop_thread: "int | None" = None
+
+        # the time the loop should wake up at, set by the loop thread
+        self._deadline: float = 0.0
+        # stack sampled by the watchdog thread: deadline, stack, code objects
+        self._sample: "tuple[float, traceback.StackSummary, list] | None" = (
+            None
+        )
+
+    def start(self, bot: "Bot | None" = None):
+        """
+        Starts monitoring the running event loop
+
+        :param bot: Bot whose handlers stalls are attributed to
+            and whose metrics they are reported to
+        """
+        if self.task is not None:
+            return
+
+        self.bot = bot
+        self._loop_thread = threading.get_ident()
+        self._deadline = time.monotonic() + self.interval
+        self._stopped.clear()
+
+        self.task = asyncio.get_running_loop().create_task(self._measure())
+        self.thread = threading.Thread(
+            target=self._watch, name="aiomax-watchdog", daemon=True
+        )
+        self.thread.start()
+
+    async def stop(self):
+        """
+        Stops monitoring
+        """
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        self._stopped.set()
+        await asyncio.to_thread(self.thread.join)
+
+        self.task = None
+        self.thread = None
+
+    async def _measure(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            start = loop.time()
+            deadline = self._deadline = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+
+            self.lag = max(loop.time() - start - self.interval, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+            self._report(deadline)
+
+    def _watch(self):
+        sampled = None
+
+        while not self._stopped.wait(self.threshold / 2):
+            deadline = self._deadline
+            if sampled == deadline:
+                continue
+            if time.monotonic() - deadline < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+
+            codes = []
+            current = frame
+            while current is not None:
+                codes.append(current.f_code)
+                current = current.f_back
+
+            self._sample = (deadline, traceback.extract_stack(frame), codes)
+            sampled = deadline
+
+    def _report(self, deadline: float):
+        metrics = self.bot.metrics if self.bot is not None else None
+        if metrics is not None:
+            metrics.loop_lag.observe(self.lag)
+
+        if self.lag < self.threshold:
+            return
+
+        sample, self._sample = self._sample, None
+        handler = None
+        stack = None
+
+        if sample is not None and sample[0] == deadline:
+            _, stack, codes = sample
+            handler = self._attribute(codes)
+
+        self.stalls.append(
+            {
+                "time": time.time(),
+                "duration": self.lag,
+                "handler": handler,
+                "stack": stack.format() if stack is not None else None,
+            }
+        )
+
+        if metrics is not None:
+            metrics.loop_stalls.inc(handler or "unknown")
+
+        message = f"Event loop was blocked for {self.lag:.3f}s"
+        if handler is not None:
+            message += f' by "{handler}"'
+        if stack is not None:
+            message += "\n" + "".join(stack.format())
+        watchdog_logger.warning(message)
+
+    def _attribute(self, codes: list) -> "str | None":
+        """
+        Returns the name of the innermost handler in the sampled stack
+        """
+        if self.bot is None:
+            return None
+
+        handlers = utils.handler_codes(self.bot)
+        dispatch = type(self.bot)._dispatch.__code__
+
+        # codes are ordered from the innermost frame
+        for code in codes:
+            if code in handlers:
+                return handlers[code]
+
+        # blocked in a filter
+        if dispatch in codes:
+            return "dispatch"
+
+        return None
@@ -0,0 +1,25 @@
+import asyncio
+
+from aiomax import Bot, EntityCache
+from aiomax.testing import FakeMaxAPI
+from aiomax.transport import MemoryTransport
+
+
+def test_patch_chat_seeds_empty_cache():
+    async def main():
+        api = FakeMaxAPI()
+        api.add_chat(10, "Old title")
+
+        cache = EntityCache()
+        assert len(cache) == 0
+
+        bot = Bot("token", transport=MemoryTransport(api), entity_cache=cache)
+        await bot.patch_chat(10, title="New title")
+
+        requests = dict(api.stats()["requests"])
+        chat = await bot.get_chat(10)
+        assert chat.title == "New title"
+        # served from the cache
+        assert api.stats()["requests"] == requests
+
+    asyncio.run(main())
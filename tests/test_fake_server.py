@@ -0,0 +1,84 @@
+import asyncio
+
+import aiohttp
+
+from aiomax import Bot, Callback, MemoryTransport
+from aiomax.testing import FakeMaxAPI, FakeMaxServer
+
+
+def make_api() -> FakeMaxAPI:
+    api = FakeMaxAPI()
+    api.add_chat(10, members=[3, 4, 5, 6])
+    for i in range(3):
+        api.push_message(f"message {i}", user_id=3, chat_id=10)
+    return api
+
+
+async def fetch(bot: Bot, api: FakeMaxAPI) -> dict:
+    message_ids = list(api.messages)[:2]
+    memberships = await bot.get_memberships(10, [3, 5, 7])
+    messages = await bot.get_messages(message_ids, use_cache=False)
+
+    return {
+        "memberships": [i.user_id for i in memberships],
+        "messages": [i.id for i in messages],
+    }
+
+
+def test_server_and_memory_transport_agree():
+    async def main():
+        memory_api = make_api()
+        bot = Bot("token", transport=MemoryTransport(memory_api))
+        in_memory = await fetch(bot, memory_api)
+
+        async with FakeMaxServer(make_api()) as server:
+            assert server.port != 0
+
+            bot = Bot("token", api_url=server.url)
+            async with aiohttp.ClientSession(base_url=server.url) as session:
+                bot.session = session
+                over_http = await fetch(bot, server.api)
+
+        return in_memory, over_http
+
+    in_memory, over_http = asyncio.run(main())
+    assert in_memory == over_http
+    assert in_memory["memberships"] == [3, 5]
+    assert len(in_memory["messages"]) == 2
+
+
+def test_list_params_repeated_or_comma_joined():
+    async def main():
+        api = make_api()
+        repeated = await api.handle(
+            "GET", "chats/10/members", {"user_ids": ["3", "5"]}
+        )
+        joined = await api.handle(
+            "GET", "chats/10/members", {"user_ids": "3,5"}
+        )
+        return repeated, joined
+
+    repeated, joined = asyncio.run(main())
+    assert repeated == joined
+    assert [i["user_id"] for i in repeated[1]["members"]] == [3, 5]
+
+
+def test_callback_answer_follows_api_url():
+    async def main():
+        async with FakeMaxServer() as server:
+            callback_id = server.api.push_callback("payload")
+            update = server.api.updates.pop()
+
+            bot = Bot("token", api_url=server.url)
+            async with aiohttp.ClientSession(base_url=server.url) as session:
+                bot.session = session
+                callback = Callback.from_json(
+                    update["callback"], update["message"]
+                )
+                callback.bot = bot
+                await callback.answer("done")
+
+            return callback_id, server.api.answers
+
+    callback_id, answers = asyncio.run(main())
+    assert [i["callback_id"] for i in answers] == [callback_id]
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from aiomax.fsm import FSMBackend, FSMCursor, FSMStorage
+
+
+class RecordingBackend(FSMBackend):
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+        self.saved = []
+        self.deleted = []
+
+    async def load(self, user_id):
+        return self.entries.get(user_id)
+
+    async def save(self, entries):
+        self.saved.append(dict(entries))
+        self.entries.update(entries)
+
+    async def delete(self, user_ids):
+        self.deleted.append(list(user_ids))
+        for i in user_ids:
+            self.entries.pop(i, None)
+
+    async def close(self):
+        pass
+
+
+def test_unchanged_transaction_writes_nothing():
+    async def main():
+        backend = RecordingBackend({1: ("a", {"x": 1})})
+        storage = FSMStorage(backend, flush_interval=60)
+        cursor = FSMCursor(storage, 1)
+
+        async with cursor.transaction() as tx:
+            assert tx.state == "a"
+            assert tx.data == {"x": 1}
+
+        assert not storage.dirty
+        await storage.flush()
+        assert backend.saved == []
+
+    asyncio.run(main())
+
+
+def test_transaction_writes_changes_made_in_place():
+    async def main():
+        backend = RecordingBackend({1: ("a", {"x": 1})})
+        storage = FSMStorage(backend, flush_interval=60)
+        cursor = FSMCursor(storage, 1)
+
+        async with cursor.transaction() as tx:
+            tx.data["x"] += 1
+
+        await storage.flush()
+        assert backend.saved == [{1: ("a", {"x": 2})}]
+
+    asyncio.run(main())
+
+
+def test_transaction_clears_none_values():
+    async def main():
+        backend = RecordingBackend({1: ("a", {"x": 1})})
+        storage = FSMStorage(backend, flush_interval=60)
+        cursor = FSMCursor(storage, 1)
+
+        async with cursor.transaction() as tx:
+            tx.state = None
+
+        assert 1 not in storage.states
+        assert storage.data[1] == {"x": 1}
+
+        async with cursor.transaction() as tx:
+            tx.data = None
+
+        assert 1 not in storage.data
+        await storage.flush()
+        assert backend.deleted == [[1]]
+
+    asyncio.run(main())
+
+
+def test_failed_transaction_discards_changes_made_in_place():
+    async def main():
+        backend = RecordingBackend({1: ("a", {"x": 1})})
+        storage = FSMStorage(backend, flush_interval=60)
+        cursor = FSMCursor(storage, 1)
+
+        with pytest.raises(ValueError):
+            async with cursor.transaction() as tx:
+                tx.data["x"] += 1
+                tx.state = "b"
+                raise ValueError
+
+        assert storage.get_state(1) == "a"
+        assert storage.get_data(1) == {"x": 1}
+        assert not storage.dirty
+
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from aiomax import Bot, MemoryTransport, exceptions
+from aiomax.testing import FakeMaxAPI
+
+
+def make_bot() -> "tuple[Bot, FakeMaxAPI]":
+    api = FakeMaxAPI()
+    api.add_chat(10, members=[3])
+    return Bot("token", transport=MemoryTransport(api)), api
+
+
+def test_deleted_message_is_not_served_from_cache():
+    bot, _ = make_bot()
+
+    async def main():
+        message = await bot.send_message("hello", chat_id=10)
+        assert (await bot.get_message(message.id)).id == message.id
+
+        await bot.delete_message(message.id)
+        with pytest.raises(exceptions.MessageNotFoundException):
+            await bot.get_message(message.id)
+
+    asyncio.run(main())
+
+
+def test_edited_message_is_fetched_again():
+    bot, _ = make_bot()
+
+    async def main():
+        message = await bot.send_message("hello", chat_id=10)
+        await bot.get_message(message.id)
+
+        await bot.edit_message(message.id, "edited")
+        return await bot.get_message(message.id)
+
+    assert asyncio.run(main()).body.text == "edited"
+
+
+def test_message_removed_update_drops_cached_message():
+    bot, _ = make_bot()
+    deleted = []
+
+    @bot.on_message_delete()
+    async def on_delete(payload):
+        deleted.append(payload.message)
+
+    async def main():
+        message = await bot.send_message("hello", chat_id=10)
+        await bot.get_message(message.id)
+
+        await bot.handle_update(
+            {
+                "update_type": "message_removed",
+                "timestamp": 1000,
+                "message_id": message.id,
+                "chat_id": 10,
+                "user_id": 3,
+            }
+        )
+        await asyncio.gather(*bot.tasks)
+        return message
+
+    message = asyncio.run(main())
+    assert [i.id for i in deleted] == [message.id]
+    assert bot.cache.get_message(message.id) is None
@@ -0,0 +1,60 @@
+import asyncio
+import gzip
+
+import pytest
+
+from aiomax import Bot, UpdateRecorder, UpdateReplayer, read_journal
+from aiomax.bench import UpdateGenerator
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_record_then_replay(tmp_path, compress):
+    path = str(tmp_path / "updates.jsonl")
+    updates = UpdateGenerator(seed=1).generate(50)
+
+    async def main():
+        bot = Bot("token", recorder=UpdateRecorder(path, compress))
+        for update in updates[:30]:
+            await bot.handle_update(update)
+        bot.recorder.close()
+
+        # reopened after close, a gzip journal gets a second member
+        for update in updates[30:]:
+            await bot.handle_update(update)
+        bot.recorder.close()
+
+        handled = []
+        replayer = Bot("token")
+
+        @replayer.on_message()
+        async def on_message(message):
+            handled.append(message.id)
+
+        @replayer.on_button_callback()
+        async def on_callback(callback):
+            handled.append(callback.callback_id)
+
+        stats = await UpdateReplayer(replayer, path, speed=None).replay()
+        return stats, handled
+
+    stats, handled = asyncio.run(main())
+    assert stats["updates"] == 50
+    assert handled
+    assert list(read_journal(path)) == updates
+
+
+def test_unclosed_gzip_journal_is_read_until_last_flush(tmp_path):
+    path = str(tmp_path / "updates.jsonl.gz")
+    updates = UpdateGenerator(seed=2).generate(20)
+
+    recorder = UpdateRecorder(path, compress=True)
+    for update in updates:
+        recorder.record(update)
+    recorder.flush()
+
+    # no end marker yet, as if the bot crashed
+    with pytest.raises(EOFError), gzip.open(path) as f:
+        f.read()
+
+    assert list(read_journal(path)) == updates
+    recorder.close()
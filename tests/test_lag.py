@@ -0,0 +1,74 @@
+import asyncio
+
+from aiomax import Bot, LagTracker
+from aiomax.bench import UpdateGenerator
+from aiomax.fsm import FSMBackend, FSMStorage
+
+
+class SlowBackend(FSMBackend):
+    def __init__(self, slow_user: int):
+        self.slow_user = slow_user
+
+    async def load(self, user_id):
+        if user_id == self.slow_user:
+            await asyncio.sleep(0.02)
+        return None
+
+    async def save(self, entries):
+        pass
+
+    async def delete(self, user_ids):
+        pass
+
+
+def test_concurrent_updates_keep_their_timestamps():
+    generator = UpdateGenerator(seed=1)
+    first, second = generator.text(), generator.text()
+    first["timestamp"], second["timestamp"] = 1000, 2000
+    sender = first["message"]["sender"]["user_id"]
+    second["message"]["sender"]["user_id"] = sender + 1
+
+    tracker = LagTracker()
+    recorded = []
+    tracker.record_handler = lambda latency, timestamp: recorded.append(
+        timestamp
+    )
+    bot = Bot(
+        "token",
+        storage=FSMStorage(SlowBackend(sender)),
+        lag_tracker=tracker,
+    )
+
+    @bot.on_message()
+    async def handler(message):
+        pass
+
+    async def main():
+        await asyncio.gather(
+            bot.handle_update(first), bot.handle_update(second)
+        )
+        await asyncio.gather(*bot.tasks)
+
+    asyncio.run(main())
+    assert sorted(recorded) == [1000, 2000]
+
+
+def test_coroutine_callback_task_is_referenced():
+    async def main():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def callback(lagging, age):
+            started.set()
+            await release.wait()
+
+        tracker = LagTracker(threshold=1, callback=callback)
+        tracker.record_update(1)
+        await started.wait()
+        assert len(tracker.tasks) == 1
+
+        release.set()
+        await asyncio.gather(*tracker.tasks)
+        assert not tracker.tasks
+
+    asyncio.run(main())
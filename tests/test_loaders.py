@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from aiomax.loaders import MembershipLoader
+from aiomax.types import User
+
+
+def user(user_id: int) -> User:
+    return User(user_id, "User", "User", False, 0)
+
+
+def test_requests_are_merged():
+    calls = []
+
+    async def fetch(chat_id, user_ids):
+        calls.append(user_ids)
+        return [user(i) for i in user_ids if i != 3]
+
+    async def main():
+        loader = MembershipLoader(fetch)
+        return await loader.load_many(1, [1, 2, 3])
+
+    result = asyncio.run(main())
+
+    assert calls == [[1, 2, 3]]
+    assert [i.user_id if i else None for i in result] == [1, 2, None]
+
+
+def test_failed_chunk_fails_only_its_lookups():
+    async def fetch(chat_id, user_ids):
+        if 1 in user_ids:
+            raise RuntimeError("chunk failed")
+        return [user(i) for i in user_ids]
+
+    async def main():
+        loader = MembershipLoader(fetch, max_batch_size=2)
+        results = await asyncio.gather(
+            *(loader.load(1, i) for i in (1, 2, 3, 4)),
+            return_exceptions=True,
+        )
+        assert not loader.tasks
+        return results
+
+    results = asyncio.run(main())
+
+    assert isinstance(results[0], RuntimeError)
+    assert isinstance(results[1], RuntimeError)
+    assert [i.user_id for i in results[2:]] == [3, 4]
+
+
+@pytest.mark.parametrize("delay", [0, 0.01])
+def test_tasks_are_referenced(delay):
+    async def fetch(chat_id, user_ids):
+        await asyncio.sleep(0.01)
+        return []
+
+    async def main():
+        loader = MembershipLoader(fetch, delay=delay)
+        load = asyncio.ensure_future(loader.load(1, 1))
+        await asyncio.sleep(delay + 0.001)
+        assert len(loader.tasks) == 1
+        assert await load is None
+
+    asyncio.run(main())
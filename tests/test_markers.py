@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+import threading
+
+from aiomax import Bot, FileMarkerStore, MarkerStore
+
+
+def test_save_during_write_is_written(tmp_path, monkeypatch):
+    path = tmp_path / "marker"
+    started = threading.Event()
+    release = threading.Event()
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        started.set()
+        release.wait(5)
+        fsync(fd)
+
+    monkeypatch.setattr(os, "fsync", slow_fsync)
+
+    async def main():
+        store = FileMarkerStore(str(path), fsync_interval=0.01)
+        await store.save(1)
+        await asyncio.to_thread(started.wait, 5)
+        assert store.writing
+
+        await store.save(2)
+        release.set()
+
+        for _ in range(100):
+            if store.written == 2:
+                break
+            await asyncio.sleep(0.01)
+
+        assert store.written == 2
+        await store.close()
+
+    asyncio.run(main())
+    assert path.read_text() == "2"
+
+
+class MemoryMarkerStore(MarkerStore):
+    def __init__(self):
+        self.markers = []
+
+    async def save(self, marker):
+        self.markers.append(marker)
+
+
+def test_hung_handler_does_not_block_markers(caplog):
+    async def main():
+        store = MemoryMarkerStore()
+        bot = Bot("token", marker_store=store, marker_timeout=0.05)
+
+        hung = asyncio.create_task(asyncio.sleep(60))
+        done = asyncio.create_task(asyncio.sleep(0))
+        bot._save_marker(1, [hung])
+        bot._save_marker(2, [done])
+        await bot._checkpoint
+
+        hung.cancel()
+        return store.markers
+
+    with caplog.at_level(logging.WARNING, "aiomax.bot"):
+        assert asyncio.run(main()) == [1, 2]
+
+    assert "saving marker 1" in caplog.text
@@ -0,0 +1,33 @@
+import time
+
+from aiomax import MessageCache
+from aiomax.bench import UpdateGenerator
+from aiomax.types import Message
+
+
+def message() -> "tuple[Message, dict]":
+    raw = UpdateGenerator(seed=1).text()["message"]
+    return Message.from_json(raw), raw
+
+
+def test_ttl_is_second_positional_argument():
+    cache = MessageCache()
+    msg, _ = message()
+
+    cache.add_message(msg, 0.01)
+    assert cache.get_message(msg.id) is not None
+
+    time.sleep(0.02)
+    assert cache.get_message(msg.id) is None
+
+
+def test_compact_message_round_trip():
+    cache = MessageCache(compact=True)
+    msg, raw = message()
+
+    cache.add_message(msg, raw=raw)
+    cached = cache.get_message(msg.id)
+
+    assert isinstance(cache.entries[msg.id][0], bytes)
+    assert cached.id == msg.id
+    assert cached.body.text == msg.body.text
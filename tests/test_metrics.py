@@ -0,0 +1,35 @@
+import aiomax.metrics
+from aiomax import Bot, Metrics
+
+
+def test_cache_hits_and_misses_are_counters():
+    metrics = Metrics()
+    bot = Bot("token", metrics=metrics)
+    bot.cache.get_message("missing")
+
+    text = metrics.render()
+    assert "# TYPE aiomax_cache_hits_total counter" in text
+    assert "# TYPE aiomax_cache_misses_total counter" in text
+    assert 'aiomax_cache_misses_total{cache="message"} 1' in text
+
+
+def test_memory_report_is_made_once_per_scrape(monkeypatch):
+    calls = []
+    memory_report = aiomax.metrics.memory_report
+
+    def counted(bot):
+        calls.append(bot)
+        return memory_report(bot)
+
+    monkeypatch.setattr(aiomax.metrics, "memory_report", counted)
+
+    metrics = Metrics()
+    Bot("token", metrics=metrics)
+
+    text = metrics.render()
+    assert len(calls) == 1
+    assert 'aiomax_memory_bytes{component="fsm"}' in text
+    assert 'aiomax_memory_objects{component="fsm"} 0' in text
+
+    metrics.render()
+    assert len(calls) == 2
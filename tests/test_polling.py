@@ -0,0 +1,36 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from aiomax import Bot, LoopMonitor, MemoryTransport, exceptions
+from aiomax.fsm import FSMStorage, SQLiteFSMBackend
+from aiomax.testing import FakeMaxAPI
+
+
+def test_shutdown_runs_when_polling_fails(tmp_path):
+    path = tmp_path / "fsm.db"
+    api = FakeMaxAPI()
+    api.inject_error("internal", path="me")
+
+    monitor = LoopMonitor()
+    bot = Bot(
+        "token",
+        transport=MemoryTransport(api),
+        storage=FSMStorage(SQLiteFSMBackend(str(path)), flush_interval=60),
+        loop_monitor=monitor,
+    )
+    bot.storage.change_state(1, "a")
+
+    with pytest.raises(exceptions.InternalError):
+        asyncio.run(bot.start_polling())
+
+    assert not bot.polling
+    assert monitor.thread is None
+
+    connection = sqlite3.connect(path)
+    try:
+        rows = connection.execute("SELECT user_id FROM fsm").fetchall()
+    finally:
+        connection.close()
+    assert rows == [(1,)]
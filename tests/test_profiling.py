@@ -0,0 +1,55 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from aiomax import Bot
+
+
+class CommandRouter:
+    def __init__(self):
+        self.commands = {}
+
+    def on_command(self, name):
+        def decorator(func):
+            self.commands[name] = func
+            return func
+
+        return decorator
+
+
+@pytest.mark.parametrize(
+    "args", [["inf"], ["nan"], ["-5"], ["0"], ["inf", "updates"], ["x"]]
+)
+def test_profile_command_rejects_bad_amounts(args):
+    bot = Bot("token")
+    router = CommandRouter()
+    bot.profiler.add_command(router, admins=[1])
+    replies = []
+
+    async def reply(text):
+        replies.append(text)
+
+    ctx = SimpleNamespace(sender=SimpleNamespace(user_id=1), args=args)
+    ctx.reply = reply
+
+    asyncio.run(router.commands["profile"](ctx))
+    assert replies == ["Usage: /profile [seconds | N updates | stop]"]
+    assert not bot.profiler.running
+
+
+def test_stop_after_updates_is_referenced(tmp_path):
+    profiler = Bot("token").profiler
+
+    async def main():
+        profiler.start(updates=2, path=str(tmp_path / "profile.pstats"))
+        profiler.count_update()
+        profiler.count_update()
+
+        stopping = profiler._stopping
+        assert stopping is not None
+        return await profiler.wait()
+
+    result = asyncio.run(main())
+    assert result["updates"] == 2
+    assert not profiler.running
@@ -0,0 +1,115 @@
+import asyncio
+import sqlite3
+
+from aiomax import SQLiteCacheBackend
+
+
+def count(path) -> int:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_flush_and_close_write_pending(tmp_path):
+    path = tmp_path / "cache.db"
+
+    async def main():
+        backend = SQLiteCacheBackend(str(path), flush_interval=60)
+        backend.put("a", b"1")
+        backend.put("b", b"2")
+        assert await backend.get("a") == b"1"  # still buffered
+
+        await backend.flush()
+        assert count(path) == 2
+
+        backend.put("c", b"3")
+        backend.delete("a")
+        await backend.close()
+
+    asyncio.run(main())
+    assert count(path) == 2
+
+
+def test_batch_size_wakes_sleeping_flush(tmp_path):
+    path = tmp_path / "cache.db"
+
+    async def main():
+        backend = SQLiteCacheBackend(
+            str(path), flush_interval=60, batch_size=10
+        )
+        backend.put("first", b"0")
+        await asyncio.sleep(0.01)  # the flush task is sleeping now
+
+        for i in range(10):
+            backend.put(str(i), b"x")
+
+        for _ in range(100):
+            if not backend.pending and count(path) == 11:
+                break
+            await asyncio.sleep(0.01)
+
+        assert count(path) == 11
+        await backend.close()
+
+    asyncio.run(main())
+
+
+def test_failed_write_is_retried(tmp_path):
+    path = tmp_path / "cache.db"
+
+    async def main():
+        backend = SQLiteCacheBackend(str(path), flush_interval=0.01)
+        write = backend._write
+        failures = []
+
+        def failing_write(pending):
+            if not failures:
+                failures.append(pending)
+                raise sqlite3.OperationalError("disk I/O error")
+            write(pending)
+
+        backend._write = failing_write
+        backend.put("a", b"1")
+
+        await asyncio.sleep(0.05)
+        assert failures
+        await backend.flush()
+        assert not backend.pending
+        await backend.close()
+
+    asyncio.run(main())
+    assert count(path) == 1
+
+
+def test_reopens_after_close(tmp_path):
+    path = tmp_path / "cache.db"
+
+    async def main():
+        backend = SQLiteCacheBackend(str(path))
+        backend.put("a", b"1")
+        await backend.close()
+
+        # e.g. polling is started again
+        assert await backend.get("a") == b"1"
+        backend.put("b", b"2")
+        await backend.close()
+
+    asyncio.run(main())
+    assert count(path) == 2
+
+
+def test_reuse_under_a_new_event_loop(tmp_path):
+    path = tmp_path / "cache.db"
+    backend = SQLiteCacheBackend(str(path), flush_interval=0.01)
+
+    async def run(key):
+        backend.put(key, b"1")
+        await asyncio.sleep(0.05)
+        assert not backend.pending
+        await backend.close()
+
+    asyncio.run(run("a"))
+    asyncio.run(run("b"))
+    assert count(path) == 2
@@ -0,0 +1,97 @@
+import asyncio
+import sqlite3
+
+from aiomax.fsm import FSMStorage, SQLiteFSMBackend
+
+
+def count(path) -> int:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_flush_and_close_write_changes(tmp_path):
+    path = tmp_path / "fsm.db"
+
+    async def main():
+        storage = FSMStorage(SQLiteFSMBackend(str(path)), flush_interval=60)
+        storage.change_state(1, "a")
+        storage.change_data(2, {"x": 1})
+
+        await storage.flush()
+        assert count(path) == 2
+
+        storage.change_state(3, "c")
+        storage.clear(1)
+        await storage.close()
+
+    asyncio.run(main())
+    assert count(path) == 2
+
+    async def load():
+        backend = SQLiteFSMBackend(str(path))
+        try:
+            return [await backend.load(i) for i in (1, 2, 3)]
+        finally:
+            await backend.close()
+
+    assert asyncio.run(load()) == [None, (None, {"x": 1}), ("c", None)]
+
+
+def test_backend_reopens_after_close(tmp_path):
+    path = tmp_path / "fsm.db"
+
+    async def main():
+        backend = SQLiteFSMBackend(str(path))
+        await backend.save({1: ("a", None)})
+        await backend.close()
+        assert backend.connection is None
+
+        assert await backend.load(1) == ("a", None)
+        await backend.save({2: ("b", None)})
+        await backend.close()
+
+    asyncio.run(main())
+    assert count(path) == 2
+
+
+def test_ttl_applies_to_loaded_users(tmp_path):
+    path = tmp_path / "fsm.db"
+
+    async def main():
+        backend = SQLiteFSMBackend(str(path))
+        await backend.save({1: ("a", {"x": 1})})
+
+        storage = FSMStorage(
+            backend, flush_interval=0, ttl=0.05, sweep_interval=0.01
+        )
+        await storage.load(1)
+        assert storage.get_state(1) == "a"
+        assert 1 in storage.expires
+
+        await asyncio.sleep(0.2)
+        assert storage.get_state(1) is None
+        assert storage.expired == 1
+
+        await storage.close()
+
+    asyncio.run(main())
+    assert count(path) == 0
+
+
+def test_explicit_ttl_survives_later_changes():
+    async def main():
+        storage = FSMStorage(sweep_interval=0.01)
+        storage.change_state(1, "a", ttl=0.05)
+        storage.change_data(1, {"x": 1})
+        storage.clear_state(1)
+        assert 1 in storage.expires
+
+        await asyncio.sleep(0.2)
+        assert storage.get_data(1) is None
+        assert storage.expired == 1
+        assert 1 not in storage.ttls
+
+    asyncio.run(main())
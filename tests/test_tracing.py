@@ -0,0 +1,27 @@
+import asyncio
+
+from aiomax import Bot, CallbackExporter, Tracer
+from aiomax.bench import UpdateGenerator
+from aiomax.tracing import NO_SPAN
+
+
+def test_filter_spans_name_handlers():
+    spans = []
+    bot = Bot("token", tracer=Tracer(CallbackExporter(spans.append)))
+
+    @bot.on_message()
+    async def echo(message):
+        pass
+
+    async def main():
+        await bot.handle_update(UpdateGenerator(seed=1).text())
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    filters = [i for i in spans if i["name"] == "filter"]
+    assert [i["attributes"]["handler"] for i in filters] == [echo.__qualname__]
+
+
+def test_filter_span_skips_handler_lookup_without_tracer():
+    # the handler is not touched when tracing is disabled
+    assert Bot("token")._filter_span(None) is NO_SPAN
@@ -0,0 +1,70 @@
+import asyncio
+
+import aiohttp
+
+from aiomax import Bot, MemoryTransport
+from aiomax.testing import FakeMaxAPI, FakeMaxServer
+
+
+def test_memory_transport_sends_lists_as_repeated_keys():
+    requests = []
+
+    def responder(method, path, params, json, data):
+        requests.append(params)
+        return 200, {}
+
+    async def main():
+        transport = MemoryTransport(responder)
+        await transport.request(
+            "GET", "chats/1/members", params={"user_ids": [3, 4], "count": 5}
+        )
+        await transport.request("GET", "https://host/path?a=1&a=2&b=3")
+        await transport.request(
+            "GET", "chats/1/members", params={"user_ids": [], "count": 5}
+        )
+
+    asyncio.run(main())
+    assert requests == [
+        {"user_ids": ["3", "4"], "count": "5"},
+        {"a": ["1", "2"], "b": "3"},
+        {"count": "5"},
+    ]
+
+
+def test_empty_list_param_matches_aiohttp():
+    def make_api():
+        api = FakeMaxAPI()
+        api.add_chat(10, members=[3])
+        return api
+
+    async def main():
+        bot = Bot("token", transport=MemoryTransport(make_api()))
+        in_memory = await bot.get_memberships(10, [])
+
+        async with FakeMaxServer(make_api()) as server:
+            bot = Bot("token", api_url=server.url)
+            async with aiohttp.ClientSession(base_url=server.url) as session:
+                bot.session = session
+                over_http = await bot.get_memberships(10, [])
+
+        return in_memory, over_http
+
+    in_memory, over_http = asyncio.run(main())
+    assert [i.user_id for i in in_memory] == [i.user_id for i in over_http]
+
+
+def test_aiohttp_transport_is_created_once_per_session():
+    async def main():
+        bot = Bot("token")
+
+        async with aiohttp.ClientSession() as session:
+            bot.session = session
+            transport = bot._transport()
+            assert bot._transport() is transport
+
+        async with aiohttp.ClientSession() as session:
+            bot.session = session
+            assert bot._transport() is not transport
+            assert bot._transport().session is session
+
+    asyncio.run(main())
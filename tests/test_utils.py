@@ -0,0 +1,18 @@
+from dataclasses import dataclass
+
+from aiomax import utils
+
+
+@dataclass
+class CallableHandler:
+    name: str
+
+    async def __call__(self, message, cursor):
+        pass
+
+
+def test_context_kwargs_of_unhashable_callable():
+    handler = CallableHandler("echo")
+
+    assert utils.context_kwargs(handler, cursor=1, bot=2) == {"cursor": 1}
+    assert utils.accepts(handler, "cursor")